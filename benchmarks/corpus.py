@@ -0,0 +1,110 @@
+""" A reproducible synthetic corpus of webpages for benchmarks. """
+from shared.pagestore import PageStoreReader, PageStoreWriter
+from web_crawler.utils import get_urlhash
+from itertools import accumulate, islice
+from typing import Dict, List, Tuple
+from pathlib import Path
+import random
+import json
+import os
+
+SYLLABLES = ["ka", "ri", "to", "mu", "sen", "lo", "da", "vi", "ne", "xo", "pra", "ul", "ge", "fa", "zi", "bo", "che", "an", "il", "or"]
+
+def generate_vocabulary(size: int, rng: random.Random) -> List[str]:
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(SYLLABLES) for _ in range(rng.randint(1, 4))))
+    return sorted(words)
+
+class Corpus:
+    """ Generates pages whose word frequencies roughly follow Zipf's law, spread over a number of domains.
+    A fraction of pages are near-duplicates of earlier pages, differing in a few words.
+    """
+
+    def __init__(self, num_pages: int, seed=0, num_domains=50, vocabulary_size=20000, words_per_page=600, duplicate_rate=0.05):
+        self.num_pages = num_pages
+        self.seed = seed
+        self.num_domains = num_domains
+        self.words_per_page = words_per_page
+        self.duplicate_rate = duplicate_rate
+        self.vocabulary = generate_vocabulary(vocabulary_size, random.Random(seed))
+        random.Random(seed).shuffle(self.vocabulary)
+        self.cum_weights = list(accumulate(1 / (rank + 1) for rank in range(vocabulary_size)))
+        self.duplicate_of: Dict[int, int] = {}  # The page each near-duplicate was copied from, filled in as pages are generated.
+
+    def url(self, i: int) -> str:
+        return f"https://www{i % self.num_domains}.example.edu/pages/{i}"
+
+    def words(self, rng: random.Random, count: int) -> List[str]:
+        return rng.choices(self.vocabulary, cum_weights=self.cum_weights, k=count)
+
+    def page(self, i: int, layout: int, body: List[str]) -> str:
+        # The title, headings and links come from the layout, so near-duplicates share them.
+        rng = random.Random(f"{self.seed}-{layout}")
+        title = " ".join(self.words(rng, 5))
+        links = "".join(f'<li><a href="/pages/{rng.randrange(self.num_pages)}#top">{" ".join(self.words(rng, 2))}</a></li>' for _ in range(30))
+        paragraphs = []
+        for start in range(0, len(body), 60):
+            words = body[start:start + 60]
+            words[3] = f"<strong>{words[3]}</strong>"
+            paragraphs.append(f"<p>{' '.join(words)}</p>")
+            if start % 240 == 0:
+                paragraphs.append(f"<h2>{' '.join(self.words(rng, 3))}</h2>")
+        rows = "".join(f"<tr><td>{row}</td><td>{' '.join(self.words(rng, 4))}</td></tr>" for row in range(5))
+        return (
+            f"<!DOCTYPE html>\n<html lang=\"en\"><head><meta charset=\"utf-8\"><title>{title}</title>"
+            f"<style>body {{ font-family: sans-serif; }} .nav li {{ display: inline; }}</style>"
+            f"<script>window.analytics = {{ page: {i} }};</script></head>\n"
+            f"<body><ul class=\"nav\">{links}</ul><h1>{title}</h1>{''.join(paragraphs)}"
+            f"<table>{rows}</table><code>print({i})</code>"
+            f"<footer><a href=\"https://www{(i + 1) % self.num_domains}.example.edu/\">Next site</a></footer></body></html>"
+        )
+
+    def __iter__(self):
+        """ Yields (url, html) for each page. """
+        rng = random.Random(self.seed)
+        originals: List[Tuple[int, List[str]]] = []
+        for i in range(self.num_pages):
+            if originals and rng.random() < self.duplicate_rate:
+                layout, body = rng.choice(originals)
+                self.duplicate_of[i] = layout
+                body = list(body)
+                for _ in range(3):
+                    body[rng.randrange(len(body))] = rng.choice(self.vocabulary)
+            else:
+                layout, body = i, self.words(rng, self.words_per_page)
+                if len(originals) < 1000:
+                    originals.append((layout, body))
+            yield self.url(i), self.page(i, layout, body)
+
+    def write_segments(self, folder: Path) -> List[str]:
+        """ Saves every page into a page store, returning the references to them. """
+        writer = PageStoreWriter(folder)
+        refs = [writer.write(url, html) for url, html in self]
+        writer.close()
+        return refs
+
+    def write_pages(self, folder: Path) -> List[Path]:
+        """ Saves every page as a JSON file, the way older versions of the crawler did, returning the file paths. """
+        paths = []
+        for url, html in self:
+            directory = Path(folder) / url.split("/")[2]
+            os.makedirs(directory, exist_ok=True)
+            path = directory / f"{get_urlhash(url)}.json"
+            with open(path, "w") as f:
+                json.dump({"url": url, "content": html, "encoding": "utf-8"}, f)
+            paths.append(path)
+        return paths
+
+def read_pages(folder: Path, limit: int) -> List[Tuple[str, str]]:
+    """ Reads up to limit saved pages from a crawler's pages folder. """
+    pages = []
+    for _, data in islice(PageStoreReader(folder).scan(), limit):
+        data = json.loads(data)
+        pages.append((data["url"], data["content"]))
+    limit -= len(pages)
+    for path in sorted(Path(folder).rglob("*.json"))[:limit]:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        pages.append((data["url"], data["content"]))
+    return pages
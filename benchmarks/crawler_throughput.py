@@ -0,0 +1,63 @@
+""" Compares crawl throughput of the threaded and async workers against a local HTTPS stand-in,
+with pages parsed by the workers or by a pool of parser processes.
+
+Usage: python -m benchmarks.crawler_throughput [--hosts 20] [--pages 50] [--words 300] [--latency 0.02] [-n 8] [--concurrency 200] [--parsers 4]
+"""
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from benchmarks.standin import StandInServer, crawler_config
+from web_crawler.utils.config import Config
+from web_crawler.crawler import Crawler
+from typing import List
+from pathlib import Path
+import tempfile
+import logging
+import time
+import os
+
+def crawl(seed_urls: List[str], total_pages: int, mode: str, n: int, parsers: int) -> float:
+    """ Crawls every stand-in page and returns the number of pages per second. """
+    logging.disable(logging.INFO)
+    with tempfile.TemporaryDirectory(ignore_cleanup_errors=True) as folder:
+        os.chdir(folder)
+        config = Config(crawler_config(seed_urls, str(Path(folder) / "frontier.db")))
+        config.parsers = parsers
+        crawler = Crawler(config, True, n, mode)
+
+        start = time.perf_counter()
+        crawler.start_async()
+        while crawler.pages_scraped < total_pages:
+            if time.perf_counter() - start > 600:
+                raise TimeoutError(f"{mode} crawl did not finish, see web_crawler/logs.")
+            time.sleep(0.01)
+        elapsed = time.perf_counter() - start
+        crawler.frontier.stop()
+        crawler.join()
+    return total_pages / elapsed
+
+def main(hosts, pages, words, latency, n, concurrency, parsers):
+    server = StandInServer(hosts, pages, latency, words)
+    server.start()
+    try:
+        print(f"{server.total_pages} pages of {words} words on {hosts} hosts, {latency * 1000:.0f}ms server latency, {os.cpu_count()} cpus")
+        for mode, workers in (("thread", n), ("async", concurrency)):
+            for num_parsers in (0, parsers):
+                # Each crawl runs in a fresh process that trusts the stand-in's certificate.
+                with ProcessPoolExecutor(1, mp_context=get_context("spawn")) as pool:
+                    pages_per_second = pool.submit(crawl, server.seed_urls, server.total_pages, mode, workers, num_parsers).result()
+                print(f"{mode:>6} -n {workers:<5} -p {num_parsers:<3} {pages_per_second:8.1f} pages/s")
+    finally:
+        server.stop()
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--hosts", type=int, default=20)
+    parser.add_argument("--pages", type=int, default=50, help="Pages per host")
+    parser.add_argument("--words", type=int, default=300, help="Words per page")
+    parser.add_argument("--latency", type=float, default=0.02, help="Server response delay in seconds")
+    parser.add_argument("-n", type=int, default=8, help="Threads for the threaded worker")
+    parser.add_argument("--concurrency", type=int, default=200, help="Concurrent fetches for the async worker")
+    parser.add_argument("--parsers", type=int, default=4, help="Parser processes to compare against parsing in the workers")
+    args = parser.parse_args()
+    main(args.hosts, args.pages, args.words, args.latency, args.n, args.concurrency, args.parsers)
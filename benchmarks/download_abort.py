@@ -0,0 +1,79 @@
+""" Compares buffering whole responses against streaming them with early aborts, for pages the crawler throws away.
+
+Usage: python -m benchmarks.download_abort [--size 20] [--repeat 5]
+"""
+from argparse import ArgumentParser
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from threading import Lock, Thread
+from web_crawler.utils.download import download, aborted
+import requests
+import time
+
+class SiteHandler(BaseHTTPRequestHandler):
+    """ Serves an html page and large responses the crawler has no use for, counting the bytes written for each. """
+    protocol_version = "HTTP/1.0"  # Bodies without a Content-Length end when the connection closes.
+
+    def do_GET(self):
+        size = self.server.size
+        kinds = {
+            "/page": ("text/html; charset=utf-8", b"<html><body>" + b"<p>words</p>" * 4000 + b"</body></html>", True),
+            "/paper.pdf": ("application/pdf", b"%PDF-1.5" + b"\0" * size, True),
+            "/dump": ("text/html", b"<html>" + b"x" * size, True),
+            "/stream": ("text/html", b"<html>" + b"x" * size, False),
+            "/mislabeled": ("", b"\x89PNG" + b"\0" * size, False),
+        }
+        content_type, body, send_length = kinds[self.path]
+        self.send_response(200)
+        if content_type:
+            self.send_header("Content-Type", content_type)
+        if send_length:
+            self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        written = 0
+        try:
+            for start in range(0, len(body), 65536):
+                self.wfile.write(body[start:start + 65536])
+                written += len(body[start:start + 65536])
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        with self.server.lock:
+            self.server.written[self.path] = self.server.written.get(self.path, 0) + written
+
+    def log_message(self, format, *args):
+        pass
+
+def buffered(url: str) -> None:
+    """ The crawler's original download, which read every body into memory. """
+    requests.get(url, timeout=5).content
+
+def streamed(url: str) -> None:
+    download(url, max_bytes=10000000, html_only=True)
+
+def main(size_mb, repeat):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), SiteHandler)
+    server.size, server.lock, server.written = size_mb * 1000000, Lock(), {}
+    Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_port}"
+    print(f"Large responses are {size_mb}MB, the byte cap is 10MB")
+    try:
+        for path in ("/page", "/paper.pdf", "/dump", "/stream", "/mislabeled"):
+            results = []
+            for fetch in (buffered, streamed):
+                server.written = {}
+                start = time.perf_counter()
+                for _ in range(repeat):
+                    fetch(base + path)
+                elapsed = (time.perf_counter() - start) / repeat
+                time.sleep(0.5)  # Let the server finish counting the last response.
+                results.append(f"{elapsed * 1000:7.1f}ms {server.written.get(path, 0) / repeat / 1e6:6.2f}MB sent")
+            print(f"{path:>12}: buffered {results[0]}, streamed {results[1]}")
+        print(f"Aborted fetches: {aborted.get()}")
+    finally:
+        server.shutdown()
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--size", type=int, default=20, help="Size of the large responses in MB")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    main(args.size, args.repeat)
@@ -0,0 +1,90 @@
+""" Measures how quickly the frontier dispenses urls when many urls are queued over many domains.
+
+Usage: python -m benchmarks.frontier_scheduler [--urls 1000000] [--domains 1000] [--threads 8]
+"""
+from argparse import ArgumentParser
+from urllib.robotparser import RobotFileParser
+from threading import Thread
+from typing import List
+from benchmarks.standin import crawler_config
+from web_crawler.utils.config import Config
+from web_crawler.crawler.frontier import Frontier
+import statistics
+import tempfile
+import logging
+import time
+import os
+
+def create_frontier(folder: str, num_urls: int, num_domains: int, time_delay: float) -> Frontier:
+    """ Creates a frontier with the given number of urls spread evenly over the domains. """
+    config = Config(crawler_config(["https://d0.example/p/0"], os.path.join(folder, "frontier.db"), time_delay))
+    frontier = Frontier(config, True)
+
+    # Every domain allows everything, so no robots.txt is downloaded.
+    for domain in range(num_domains):
+        robot = RobotFileParser()
+        robot.modified()
+        frontier.robot_cache[f"d{domain}.example"] = robot
+    for i in range(1, num_urls):
+        frontier.add_url(f"https://d{i % num_domains}.example/p/{i}")
+    return frontier
+
+def dispense_all(frontier: Frontier) -> List[float]:
+    """ Dispenses every url from a single thread, returning the latency of each call. """
+    latencies = []
+    while not frontier.empty():
+        start = time.perf_counter()
+        frontier.get_tbd_url()
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+def dispense_politely(frontier: Frontier, num_threads: int, duration: float) -> int:
+    """ Dispenses urls from several threads for the given duration, returning the number dispensed. """
+    counts = [0] * num_threads
+    def run(i):
+        while frontier.get_tbd_url():
+            counts[i] += 1
+    threads = [Thread(target=run, args=(i,)) for i in range(num_threads)]
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    frontier.stop()
+    for thread in threads:
+        thread.join()
+    return sum(counts)
+
+def main(num_urls, num_domains, num_threads):
+    logging.disable(logging.INFO)
+    with tempfile.TemporaryDirectory() as folder:
+        os.chdir(folder)
+
+        start = time.perf_counter()
+        frontier = create_frontier(folder, num_urls, num_domains, 0)
+        print(f"Queued {num_urls} urls over {num_domains} domains in {time.perf_counter() - start:.1f}s")
+
+        # Without a politeness delay, every call dispenses immediately.
+        cpu_start = time.process_time()
+        latencies = dispense_all(frontier)
+        cpu = time.process_time() - cpu_start
+        quantiles = statistics.quantiles(latencies, n=100)
+        print(f"No delay: {len(latencies)} urls, p50 {quantiles[49] * 1e6:.1f}us, p99 {quantiles[98] * 1e6:.1f}us, "
+              f"max {max(latencies) * 1e3:.2f}ms, {cpu:.1f}s cpu ({cpu / len(latencies) * 1e6:.1f}us/url)")
+
+        # With a politeness delay, workers wait for the earliest domain instead of spinning.
+        frontier.close()
+        time_delay, duration = 0.5, 5.0
+        frontier = create_frontier(folder, num_urls // 10, num_domains, time_delay)
+        cpu_start = time.process_time()
+        dispensed = dispense_politely(frontier, num_threads, duration)
+        cpu = time.process_time() - cpu_start
+        print(f"{time_delay}s delay, {num_threads} threads: {dispensed} urls in {duration}s "
+              f"(at most {int(num_domains * (duration / time_delay + 1))} allowed), {cpu / duration * 100:.0f}% cpu")
+        frontier.close()
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--urls", type=int, default=1000000)
+    parser.add_argument("--domains", type=int, default=1000)
+    parser.add_argument("--threads", type=int, default=8)
+    args = parser.parse_args()
+    main(args.urls, args.domains, args.threads)
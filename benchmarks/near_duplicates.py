@@ -0,0 +1,67 @@
+""" Compares the indexer's exact text hash against SimHash fingerprints with a banded lookup, in the time per page
+and in how many of the corpus's near-duplicates each one drops.
+
+Usage: python -m benchmarks.near_duplicates [--pages 5000] [--source pages/]
+"""
+from argparse import ArgumentParser
+from benchmarks.corpus import Corpus, read_pages
+from shared.parser import ParsedPage
+from shared.simhash import SimHashIndex, simhash
+from typing import Dict, List
+import time
+
+def compute_hash(page_content: List[str]) -> int:
+    """ The indexer's original hash, which only matched pages with exactly the same text. """
+    raw_text = ' '.join(page_content)
+    hash_value = 0
+    for char in raw_text:
+        hash_value = (hash_value * 31 + ord(char)) % (2**32)
+    return hash_value
+
+def exact(texts: List[List[str]]) -> Dict[int, int]:
+    """ Returns the pages dropped by the exact hash, mapped to the page they matched. """
+    seen: Dict[int, int] = {}
+    duplicates = {}
+    for i, text in enumerate(texts):
+        page_hash = compute_hash(text)
+        if page_hash in seen:
+            duplicates[i] = seen[page_hash]
+        else:
+            seen[page_hash] = i
+    return duplicates
+
+def near(texts: List[List[str]]) -> Dict[int, int]:
+    """ Returns the pages dropped by SimHash, mapped to the page they matched. """
+    fingerprints = SimHashIndex()
+    duplicates = {}
+    for i, text in enumerate(texts):
+        if (original := fingerprints.add(simhash(text), i)) is not None:
+            duplicates[i] = original
+    return duplicates
+
+def main(num_pages, source):
+    corpus = None if source else Corpus(num_pages)
+    pages = read_pages(source, num_pages) if source else list(corpus)
+    texts = [ParsedPage(html.encode(), url).text for url, html in pages]
+    print(f"{len(pages)} pages, {sum(len(' '.join(text)) for text in texts) / len(texts) / 1000:.1f}KB of text on average")
+    if corpus:
+        print(f"The corpus has {len(corpus.duplicate_of)} near-duplicates ({len(corpus.duplicate_of) / len(pages):.1%})")
+
+    for name, dedup in (("exact hash", exact), ("simhash", near)):
+        start = time.process_time()
+        duplicates = dedup(texts)
+        elapsed = (time.process_time() - start) / len(texts) * 1000
+        line = f"{name:>10}: {elapsed:6.3f}ms cpu/page, dropped {len(duplicates)} pages ({len(duplicates) / len(texts):.1%})"
+        if corpus:
+            # A match is correct if both pages were copied from the same original.
+            origin = lambda i: corpus.duplicate_of.get(i, i)
+            correct = sum(origin(i) == origin(j) for i, j in duplicates.items())
+            line += f", {correct} correct, {len(duplicates) - correct} false matches"
+        print(line)
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--pages", type=int, default=5000)
+    parser.add_argument("--source", type=str, default=None, help="A crawler pages folder to read pages from instead of the synthetic corpus")
+    args = parser.parse_args()
+    main(args.pages, args.source)
@@ -0,0 +1,57 @@
+""" Measures CPU time per page spent parsing HTML in the crawler and indexer, before and after sharing one lxml parse.
+
+Usage: python -m benchmarks.page_parsing [--pages 1000] [--source pages/]
+"""
+from argparse import ArgumentParser
+from urllib.parse import urldefrag, urljoin
+from bs4 import BeautifulSoup
+from benchmarks.corpus import Corpus, read_pages
+from shared.parser import ParsedPage
+from shared.tokenizer import computeWordFrequencies, tokenize
+from shared.webpage import decoder
+from typing import List, Tuple
+import json
+import time
+
+def separate_parses(url: str, html: str) -> None:
+    """ The crawler parsed each page twice with html.parser, and the indexer parsed it again with lxml. """
+    content = html.encode()
+    soup = BeautifulSoup(content, "html.parser")
+    [urldefrag(urljoin(url, tag["href"]))[0] for tag in soup.find_all("a", href=True)]
+
+    soup = BeautifulSoup(content, "html.parser")
+    [s.extract() for s in soup(['style', 'script', '[document]', 'head', 'title', 'td', 'tr', 'code'])]
+    computeWordFrequencies(tokenize(soup.getText()))
+
+    soup = BeautifulSoup(html, "lxml")
+    [s.decompose() for s in soup(['style', 'script', 'code', '[document]', 'head'])]
+    [string for string in soup.stripped_strings]
+
+def shared_parse(url: str, html: str) -> None:
+    """ The crawler parses each page once, and saves its title, text and headings for the indexer. """
+    page = ParsedPage(html.encode(), url)
+    page.links
+    computeWordFrequencies(tokenize(" ".join(page.text)))
+
+    webpage = decoder.decode(json.dumps({"url": url, "content": html, "encoding": "utf-8", "title": page.title, "text": page.text, "headings": page.headings}))
+    webpage.get_text()
+
+def measure(pipeline, pages: List[Tuple[str, str]]) -> float:
+    """ Returns the CPU milliseconds per page of the pipeline. """
+    start = time.process_time()
+    for url, html in pages:
+        pipeline(url, html)
+    return (time.process_time() - start) / len(pages) * 1000
+
+def main(num_pages, source):
+    pages = read_pages(source, num_pages) if source else list(Corpus(num_pages))
+    print(f"{len(pages)} pages, {sum(len(html) for _, html in pages) / len(pages) / 1000:.1f}KB on average")
+    for name, pipeline in (("separate parses", separate_parses), ("shared parse", shared_parse)):
+        print(f"{name:>16}: {measure(pipeline, pages):6.2f}ms cpu/page")
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--pages", type=int, default=1000)
+    parser.add_argument("--source", type=str, default=None, help="A crawler pages folder to read pages from instead of the synthetic corpus")
+    args = parser.parse_args()
+    main(args.pages, args.source)
@@ -0,0 +1,83 @@
+""" Compares saving pages as one JSON file each against the segmented page store: disk usage, files, and pages/s
+written from several crawler threads and read back by the indexer.
+
+Usage: python -m benchmarks.page_store [--pages 10000] [--threads 8]
+"""
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from benchmarks.corpus import Corpus
+from shared.pagestore import PageStoreReader, PageStoreWriter, migrate
+from shared.webpage import WebPage
+from web_crawler.utils import get_urlhash
+from typing import List, Tuple
+from pathlib import Path
+import tempfile
+import json
+import time
+import os
+
+def disk_usage(folder: Path) -> Tuple[int, int]:
+    """ Returns the bytes allocated on disk and the number of files under a folder. """
+    files = [path for path in Path(folder).rglob("*") if path.is_file()]
+    return sum(os.stat(path).st_blocks * 512 for path in files), len(files)
+
+def write_json(folder: Path, pages: List[Tuple[str, str]], threads: int) -> None:
+    def save(page):
+        url, html = page
+        directory = folder / url.split("/")[2]
+        os.makedirs(directory, exist_ok=True)
+        with open(directory / f"{get_urlhash(url)}.json", "w") as f:
+            json.dump({"url": url, "content": html, "encoding": "utf-8"}, f)
+    with ThreadPoolExecutor(threads) as pool:
+        list(pool.map(save, pages))
+
+def write_segments(folder: Path, pages: List[Tuple[str, str]], threads: int) -> None:
+    writer = PageStoreWriter(folder, segment_size=64 * 1024 * 1024)
+    with ThreadPoolExecutor(threads) as pool:
+        list(pool.map(lambda page: writer.write(*page), pages))
+    writer.close()
+
+def read_json(folder: Path) -> int:
+    total = 0
+    for path in folder.rglob("*.json"):
+        with open(path, "rb") as f:
+            total += len(f.read())
+    return total
+
+def read_segments(folder: Path) -> int:
+    return sum(len(data) for _, data in PageStoreReader(folder).scan())
+
+def timed(function, *args) -> float:
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
+
+def main(num_pages, threads):
+    pages = list(Corpus(num_pages))
+    print(f"{len(pages)} pages, {sum(len(html) for _, html in pages) / 1e6:.1f}MB of html, {threads} writer threads")
+    with tempfile.TemporaryDirectory() as folder:
+        os.chdir(folder)
+        for name, write, read in (("json files", write_json, read_json), ("segments", write_segments, read_segments)):
+            path = Path(name.replace(" ", "_"))
+            write_time = timed(write, path, pages, threads)
+            read_time = timed(read, path)
+            size, files = disk_usage(path)
+            print(
+                f"{name:>10}: {size / 1e6:7.1f}MB on disk in {files} files, "
+                f"{len(pages) / write_time:6.0f} pages/s written, {len(pages) / read_time:6.0f} pages/s read"
+            )
+
+        # Every page written by the threads must read back intact.
+        stored = sorted((page.url, page.content) for page in map(WebPage.from_path, (ref for ref, _ in PageStoreReader("segments").refs())))
+        assert stored == sorted(pages), "pages were lost or corrupted by concurrent writes"
+
+        migrate_time = timed(migrate, Path("json_files"), True)
+        print(f"Migrated the json files into segments at {len(pages) / migrate_time:.0f} pages/s")
+        os.chdir("/")
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--pages", type=int, default=10000)
+    parser.add_argument("--threads", type=int, default=8)
+    args = parser.parse_args()
+    main(args.pages, args.threads)
@@ -0,0 +1,145 @@
+""" Times the workers' merges of their partial indices and the final merge of the workers' indices, with the merge
+that scanned every file for the smallest token against the heap merge, and the final merge split into term ranges.
+
+The partial indices are synthetic: each holds the postings of a run of documents whose tokens follow Zipf's law,
+with a quarter of the vocabulary being n-grams. The old merge is run by swapping its loop into the current code.
+
+Usage: python -m benchmarks.partial_merge [--workers 8] [--files 50] [--docs 20]
+"""
+from argparse import ArgumentParser
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager, redirect_stdout
+from itertools import accumulate
+from benchmarks.corpus import generate_vocabulary
+from inverted_indexer.indexer import merge
+from inverted_indexer.indexer import worker
+from inverted_indexer.indexer.worker import Worker
+from shared.postings import LIST_HEADER, TOKEN_LENGTH, PostingsList, write_postings
+from typing import Dict, List
+from pathlib import Path
+import tempfile
+import shutil
+import random
+import time
+import io
+import os
+
+def write_partial_indices(folder: Path, num_workers: int, num_files: int, docs_per_file: int, tokens_per_doc=1000, seed=0) -> int:
+    """ Writes the partial indices each worker would have flushed, returning the number of postings. """
+    rng = random.Random(seed)
+    words = generate_vocabulary(60000, rng)
+    vocabulary = words + [f"{rng.choice(words)} {rng.choice(words)}" for _ in range(20000)]
+    rng.shuffle(vocabulary)
+    cum_weights = list(accumulate(1 / (rank + 1) for rank in range(len(vocabulary))))
+    count = 0
+    for file in range(num_files):
+        for worker_id in range(num_workers):
+            # Workers take documents from a shared queue, so their runs of doc ids interleave.
+            postings: Dict[str, List] = {}
+            for doc in range(docs_per_file):
+                doc_id = (file * num_workers + worker_id) * docs_per_file + doc
+                for token, tf in sorted(Counter(rng.choices(vocabulary, cum_weights=cum_weights, k=tokens_per_doc)).items()):
+                    postings.setdefault(token, []).append((doc_id, tf))
+            with open(folder / f"w{worker_id:02}-i{file}.dat", "wb") as index:
+                for token, token_postings in sorted(postings.items()):
+                    write_postings(index, token, [id for id, _ in token_postings], [tf for _, tf in token_postings], quantize=False)
+                    count += len(token_postings)
+    return count
+
+def min_scan_merge(indices):
+    """ The merge both the workers and the final merge used before, which scanned every file for the smallest token. """
+    indices = list(indices)
+    entries = [next(index, (None, None)) for index in indices]
+    while any(token for token, _ in entries):
+        min_token = min(token for token, _ in entries if token)
+        parts = []
+        for i, (token, postings) in enumerate(entries):
+            if token == min_token:
+                parts.append(postings)
+                entries[i] = next(indices[i], (None, None))
+        yield min_token, parts
+
+def small_buffer_iter_postings(path: Path, start=0):
+    """ Reads a file with the default buffer size, as before. """
+    with open(path, "rb") as file:
+        file.seek(start)
+        while header := file.read(TOKEN_LENGTH.size):
+            name_length = TOKEN_LENGTH.unpack(header)[0]
+            entry = file.read(name_length + LIST_HEADER.size)
+            length, count, scale = LIST_HEADER.unpack_from(entry, name_length)
+            yield entry[:name_length].decode("utf-8"), PostingsList(file.read(length), count, scale)
+
+@contextmanager
+def old_merge():
+    """ Swaps the old merge loop and reads into the worker and final merge. """
+    originals = (worker.merge_postings, worker.iter_postings, merge.merge_postings, merge.iter_postings)
+    worker.merge_postings = merge.merge_postings = min_scan_merge
+    worker.iter_postings = merge.iter_postings = small_buffer_iter_postings
+    try:
+        yield
+    finally:
+        worker.merge_postings, worker.iter_postings, merge.merge_postings, merge.iter_postings = originals
+
+def merge_workers(folder: Path, num_workers: int) -> float:
+    """ Runs each worker's merge in turn, returning the seconds taken. """
+    start = time.perf_counter()
+    with redirect_stdout(io.StringIO()):
+        for worker_id in range(num_workers):
+            Worker(worker_id, folder, None, None, None).merge_indices()
+    return time.perf_counter() - start
+
+def final_merge(folder: Path, output: Path, num_ranges: int) -> float:
+    """ Merges the workers' indices the way InvertedIndex.save_to_file does, returning the seconds taken. """
+    os.makedirs(output, exist_ok=True)
+    start = time.perf_counter()
+    paths = sorted(folder.glob("*.dat"))
+    ranges = merge.split_ranges(paths, num_ranges)
+    outputs = [output / f"range-{i:02}.bin" for i in range(len(ranges))]
+    if len(ranges) > 1:
+        with ProcessPoolExecutor(len(ranges)) as pool:
+            futures = [pool.submit(merge.merge_range, paths, low, high, set(), out) for (low, high), out in zip(ranges, outputs)]
+            [future.result() for future in futures]
+    else:
+        merge.merge_range(paths, None, None, set(), outputs[0])
+    merge.combine(outputs, output)
+    return time.perf_counter() - start
+
+def main(num_workers, num_files, docs_per_file):
+    folder = tempfile.TemporaryDirectory()
+    partials = Path(folder.name) / "partials"
+    os.makedirs(partials)
+    start = time.perf_counter()
+    count = write_partial_indices(partials, num_workers, num_files, docs_per_file)
+    size = sum(os.path.getsize(path) for path in partials.iterdir())
+    print(f"{num_workers} workers x {num_files} partial files, {count} postings in {size / 1e6:.1f}MB, written in {time.perf_counter() - start:.1f}s, {os.cpu_count()} cpus")
+
+    merged = {}
+    for name in ("min scan", "heap"):
+        merged[name] = Path(folder.name) / name
+        shutil.copytree(partials, merged[name])
+        if name == "min scan":
+            with old_merge():
+                elapsed = merge_workers(merged[name], num_workers)
+        else:
+            elapsed = merge_workers(merged[name], num_workers)
+        print(f"Worker merges, {name:>8}: {elapsed:6.2f}s for {num_workers} x {num_files} files")
+
+    with old_merge():
+        print(f"Final merge, min scan: {final_merge(merged['min scan'], Path(folder.name) / 'old', 1):6.2f}s")
+    for num_ranges in sorted({1, num_workers}):
+        elapsed = final_merge(merged["heap"], Path(folder.name) / f"ranges-{num_ranges}", num_ranges)
+        print(f"Final merge, heap in {num_ranges} range{'s' if num_ranges > 1 else ''}: {elapsed:6.2f}s")
+
+    # Every version of the merge should produce the same index.
+    indices = [(Path(folder.name) / name / "index.bin").read_bytes() for name in ["old"] + [f"ranges-{n}" for n in sorted({1, num_workers})]]
+    assert all(index == indices[0] for index in indices), "The merges produced different indices."
+    folder.cleanup()
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--files", type=int, default=50, help="Partial indices per worker")
+    parser.add_argument("--docs", type=int, default=20, help="Documents per partial index")
+    args = parser.parse_args()
+    main(args.workers, args.files, args.docs)
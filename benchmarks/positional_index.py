@@ -0,0 +1,218 @@
+""" Compares the positional index against the index of every unigram, bigram and trigram it replaced, in indexing
+time, postings written to partial indices, index size, and the latency of phrase and multi-word queries.
+
+The corpus is indexed with the indexer into a temporary folder, once as it is and once with the old n-gram tokenizer
+and merge swapped into the current code. Phrases are two or three consecutive words from the body of a page. On the
+n-gram index, they are searched for the way the search engine did before, by the n-grams of the query, one shorter
+than it. Results that have the exact phrase are counted for both, with the phrase in quotes and without.
+
+Usage: python -m benchmarks.positional_index [--pages 2000] [--queries 200]
+"""
+from argparse import ArgumentParser
+from benchmarks.corpus import Corpus
+from bs4 import BeautifulSoup
+from collections import Counter
+from contextlib import contextmanager, redirect_stdout
+from itertools import chain, islice
+from multiprocessing import Value
+from nltk.stem import PorterStemmer
+from nltk.util import ngrams
+from inverted_indexer import indexer
+from inverted_indexer.indexer import InvertedIndex, worker
+from inverted_indexer.indexer.merge import read_range
+from inverted_indexer.indexer.worker import Worker
+from shared.dictionary import DICTIONARY_FILE
+from shared.posting import Posting
+from shared.postings import INDEX_FILE, IndexWriter, iter_postings, merge_postings, pack_fields
+from shared.proximity import phrase_documents
+from shared.segments import SegmentSet
+from shared.tokenizer import stem
+from shared.topk import top_k
+from start_search_engine import SearchEngine
+from statistics import quantiles
+from typing import Dict, List, Tuple
+from pathlib import Path
+import tempfile
+import shutil
+import random
+import time
+import io
+import os
+import re
+
+partial_postings = Value("q", 0)            # Postings written to partial indices by every worker, counted by wrapping Worker.create_partial_index.
+
+def tokenize_with_ngrams(text: List[str], stem=False) -> Dict[str, int]:
+    """ The frequency of every unigram, bigram and trigram in the text, as the indexer counted them before. """
+    stemmer = PorterStemmer()
+    n_grams = []
+    for string in text:
+        tokens = [token.lower() for token in re.findall(r'\b[a-zA-Z0-9]+\b', string) if not token.isnumeric() or len(token) <= 4]
+        if stem:
+            tokens = [stemmer.stem(token) for token in tokens]
+        n_grams.extend((token,) for token in tokens)
+        n_grams.extend(n_gram for n_gram in ngrams(tokens, 2) if any(not token.isnumeric() for token in n_gram))
+        n_grams.extend(n_gram for n_gram in ngrams(tokens, 3) if any(not token.isnumeric() for token in n_gram))
+    return Counter(" ".join(n_gram) for n_gram in n_grams)
+
+def count_ngrams(text: List[str]) -> Tuple[Dict[str, int], int]:
+    frequencies = tokenize_with_ngrams(text)
+    length = sum(count for token, count in frequencies.items() if " " not in token)
+    for token, count in tokenize_with_ngrams(text, stem=True).items():
+        if token not in frequencies:
+            frequencies[token] = count
+    return frequencies, length
+
+def ngram_postings(text: List[str], headings: List[str], title: str, id: int):
+    """ Posting.get_postings as it was, with a posting for every n-gram and no positions. """
+    fields, lengths = zip(*(count_ngrams(field) for field in (text, headings, [title])))
+    return {token: Posting(id, pack_fields([field.get(token, 0) for field in fields])) for token in set().union(*fields)}, lengths
+
+def ngram_merge_range(paths, low, high, dropped, output) -> int:
+    """ merge_range as it was, leaving out n-grams with fewer than 10 postings. """
+    index = IndexWriter(output, output.with_suffix(".dict"), quantize=False)
+    for token, parts in merge_postings(read_range(path, low, high) for path in paths):
+        if token.find(" ") > -1 and sum(len(postings) for postings in parts) < 10:
+            continue
+        postings = sorted(p for p in chain.from_iterable(zip(*postings.decode()) for postings in parts) if p[0] not in dropped)
+        if not postings or (token.find(" ") > -1 and len(postings) < 10):
+            continue
+        index.write(token, [doc_id for doc_id, _ in postings], [tf for _, tf in postings])
+    index.close()
+    return index.count
+
+def write_postings_without_positions(file, token, ids, values, quantize=True, positions=None) -> int:
+    return write_postings(file, token, ids, values, quantize)
+
+write_postings = worker.write_postings
+create_partial_index = Worker.create_partial_index
+
+def counting_create_partial_index(self) -> None:
+    with partial_postings.get_lock():
+        partial_postings.value += len(self.postings)
+    create_partial_index(self)
+
+@contextmanager
+def ngram_index():
+    """ Swaps the n-gram tokenizer and merge into the indexer. Workers and merges are forked, so they are swapped there too. """
+    originals = (Posting.get_postings, worker.write_postings, indexer.merge_range)
+    Posting.get_postings = staticmethod(ngram_postings)
+    worker.write_postings = write_postings_without_positions
+    indexer.merge_range = ngram_merge_range
+    try:
+        yield
+    finally:
+        Posting.get_postings, worker.write_postings, indexer.merge_range = originals
+
+def build(pages: Path, folder: Path) -> Tuple[float, int]:
+    """ Indexes the pages into folder/indices, returning the seconds taken and the postings written to partial indices. """
+    partial_postings.value = 0
+    start = time.perf_counter()
+    with redirect_stdout(io.StringIO()):
+        index = InvertedIndex(pages, restart=True, num_workers=2, index_folder=folder / "indices")
+        index.start()
+        index.merger.join()
+    elapsed = time.perf_counter() - start
+    return elapsed, partial_postings.value
+
+def open_engine(folder: Path) -> SearchEngine:
+    with redirect_stdout(io.StringIO()):
+        return SearchEngine(index_folder=folder / "indices")
+
+def index_stats(folder: Path) -> Tuple[int, int, int]:
+    """ Returns the number of tokens and postings in an index, and its size in bytes with its term dictionary. """
+    indices = next(iter(SegmentSet(folder / "indices"))).folder
+    tokens = postings = 0
+    for _, token_postings in iter_postings(indices / INDEX_FILE):
+        tokens += 1
+        postings += len(token_postings)
+    return tokens, postings, os.path.getsize(indices / INDEX_FILE) + os.path.getsize(indices / DICTIONARY_FILE)
+
+def ngram_search(engine: SearchEngine, query: str) -> List[int]:
+    """ The search engine's old search, by the n-grams of the query one shorter than it, including stemmed n-grams. """
+    tokens = engine.words(query)
+    stemmed_tokens = [stem(token) for token in tokens]
+    n = min(max(1, len(tokens) - 1), 3)
+    n_grams = list(ngrams(tokens, n))
+    n_grams += [n_gram for n_gram in ngrams(stemmed_tokens, n) if n_gram not in n_grams]
+    segment = next(iter(engine.segments))
+    postings = list(engine.get_postings(segment, [" ".join(n_gram) for n_gram in n_grams]).values())
+    results = [doc_id for doc_id, _ in top_k(postings, engine.ranking.scorers(postings, segment.lengths), 5)]
+    # If no webpages were found, the search was rerun with the stemmed version of each token, and without n-grams.
+    if not results:
+        postings = list(engine.get_postings(segment, stemmed_tokens).values())
+        results = [doc_id for doc_id, _ in top_k(postings, engine.ranking.scorers(postings, segment.lengths), 5)]
+    for doc_id in results:
+        engine.documents.get(doc_id)
+    return results
+
+def positional_search(engine: SearchEngine, query: str) -> List[int]:
+    """ The search engine's search, returning the doc id of each result. """
+    engine.search(query)
+    return engine.prev_ids
+
+def phrases_from(corpus: Corpus, count: int, rng: random.Random) -> List[str]:
+    """ Picks runs of two or three consecutive words from the paragraphs of pages. """
+    phrases = []
+    pages = [html for _, html in islice(corpus, 500)]
+    while len(phrases) < count:
+        strings = [string.split() for p in BeautifulSoup(rng.choice(pages), "lxml").find_all("p") for string in p.stripped_strings]
+        words = rng.choice([string for string in strings if len(string) >= 3])
+        length = rng.randint(2, 3)
+        start = rng.randrange(len(words) - length + 1)
+        phrases.append(" ".join(words[start:start + length]))
+    return phrases
+
+def latency(times: List[float]) -> str:
+    p50, p95 = (quantiles(times, n=100)[i] for i in (49, 94))
+    return f"p50 {p50 * 1000:7.3f}ms, p95 {p95 * 1000:7.3f}ms"
+
+def main(num_pages, num_queries):
+    folder = Path(tempfile.mkdtemp())
+    corpus = Corpus(num_pages)
+    corpus.write_segments(folder / "pages")
+
+    Worker.create_partial_index = counting_create_partial_index
+    builds = {}
+    builds["positional"] = build(folder / "pages", folder / "positional")
+    with ngram_index():
+        builds["n-gram"] = build(folder / "pages", folder / "ngram")
+    Worker.create_partial_index = create_partial_index
+
+    for name, subfolder in (("n-gram", "ngram"), ("positional", "positional")):
+        elapsed, partial = builds[name]
+        tokens, postings, size = index_stats(folder / subfolder)
+        print(f"{name:>10}: indexed {num_pages} pages in {elapsed:6.1f}s, {partial:9} postings in partial indices, "
+              f"{tokens:7} tokens and {postings:8} postings in {size / 1e6:6.2f}MB")
+
+    engines = {"n-gram": open_engine(folder / "ngram"), "positional": open_engine(folder / "positional")}
+
+    rng = random.Random(0)
+    phrases = phrases_from(corpus, num_queries, rng)
+    searches = {"n-gram": ngram_search, "positional": positional_search}
+    for kind, queries in (("phrase", [f'"{phrase}"' for phrase in phrases]), ("words", phrases)):
+        times = {name: [] for name in engines}
+        exact = {name: 0 for name in engines}
+        first = {name: 0 for name in engines}
+        count = {name: 0 for name in engines}
+        for query, phrase in zip(queries, phrases):
+            postings = list(engines["positional"].get_postings(next(iter(engines["positional"].segments)), engines["positional"].words(phrase)).values())
+            has_phrase = set(phrase_documents(postings)) if len(postings) == len(phrase.split()) else set()
+            for name, engine in engines.items():
+                start = time.perf_counter()
+                results = searches[name](engine, query)
+                times[name].append(time.perf_counter() - start)
+                exact[name] += sum(doc_id in has_phrase for doc_id in results)
+                first[name] += bool(results) and results[0] in has_phrase
+                count[name] += len(results)
+        for name in engines:
+            print(f"{kind:>6} queries, {name:>10}: {latency(times[name])}, {exact[name] / max(1, count[name]):6.1%} of {count[name]} results "
+                  f"and {first[name] / len(queries):6.1%} of first results have the phrase")
+    shutil.rmtree(folder)
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--pages", type=int, default=2000)
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+    main(args.pages, args.queries)
@@ -0,0 +1,149 @@
+""" Compares the array-backed postings buffer of the indexer's workers against the dict of Posting lists it replaced,
+in peak memory of each worker, documents indexed per second and partial indices written.
+
+The corpus is indexed with the indexer into a temporary folder. The old buffer is swapped into the current code,
+flushing after 100,000 postings as before, and the new one is run with a few memory budgets. Workers are forked, so
+each one measures its resident memory when it starts and before writing each partial index, when its buffer is
+fullest, and reports them as it exits. The memory taken by each buffer is also traced on its own, holding the postings
+of the same pages.
+
+Usage: python -m benchmarks.postings_buffer [--pages 2000] [--workers 2]
+"""
+from argparse import ArgumentParser
+from benchmarks.corpus import Corpus
+from contextlib import contextmanager, redirect_stdout
+from inverted_indexer.indexer import InvertedIndex, worker
+from inverted_indexer.indexer.buffer import PostingsBuffer
+from inverted_indexer.indexer.worker import Worker
+from itertools import islice
+from multiprocessing import Queue, Value
+from shared.parser import ParsedPage
+from shared.posting import Posting
+from typing import Dict, Iterator, List, Tuple
+from pathlib import Path
+import tracemalloc
+import resource
+import tempfile
+import shutil
+import time
+import io
+
+peaks: Queue = Queue()                      # Resident memory of each worker when it started and at its peak, put by wrapping Worker.exit.
+call_worker, exit_worker = Worker.__call__, Worker.exit
+
+def resident_memory() -> int:
+    """ Returns the bytes of memory the process has resident. A forked process starts with the peak of its parent, so the peak is sampled. """
+    with open("/proc/self/statm") as statm:
+        return int(statm.read().split()[1]) * resource.getpagesize()
+
+def reporting_call(self) -> None:
+    self.start_rss = self.peak_rss = resident_memory()
+    call_worker(self)
+
+def reporting_exit(self) -> None:
+    exit_worker(self)
+    peaks.put((self.start_rss, self.peak_rss))
+
+class OldPosting:
+    """ A posting as it was, with its attributes in a dict instead of slots. """
+
+    def __init__(self, id: int, value: int, positions: bytes):
+        self.id = id
+        self.value = value
+        self.positions = positions
+
+class ObjectBuffer:
+    """ The worker's postings as they were kept before: a list of Posting objects for each token, written out after 100,000 postings. """
+
+    def __init__(self):
+        self.postings: Dict[str, List[OldPosting]] = {}
+        self.count = 0
+
+    def add(self, postings: Dict[str, Posting]) -> None:
+        for token, posting in postings.items():
+            self.postings.setdefault(token, []).append(OldPosting(posting.id, posting.value, posting.positions))
+            self.count += 1
+
+    def __len__(self) -> int:
+        return self.count
+
+    def nbytes(self) -> float:
+        return float("inf") if self.count > 100000 else 0
+
+    def __iter__(self) -> Iterator[Tuple[str, List[int], List[int], List[bytes]]]:
+        for token, postings in sorted(self.postings.items()):
+            yield token, [p.id for p in postings], [p.value for p in postings], [p.positions for p in postings]
+
+    def clear(self) -> None:
+        self.__init__()
+
+@contextmanager
+def object_buffer():
+    """ Swaps the old buffer into the workers, which are created by the main process before they are forked. """
+    original = worker.PostingsBuffer
+    worker.PostingsBuffer = ObjectBuffer
+    try:
+        yield
+    finally:
+        worker.PostingsBuffer = original
+
+partial_indices = Value("i", 0)             # Partial indices written by every worker, counted by wrapping Worker.create_partial_index.
+create_partial_index = Worker.create_partial_index
+
+def counting_create_partial_index(self) -> None:
+    self.peak_rss = max(self.peak_rss, resident_memory())
+    with partial_indices.get_lock():
+        partial_indices.value += 1
+    create_partial_index(self)
+
+def traced_bytes(buffer, pages: List[str]) -> int:
+    """ Returns the bytes the buffer takes holding the postings of the pages. """
+    tracemalloc.start()
+    for id, html in enumerate(pages):
+        page = ParsedPage(html.encode(), "")
+        buffer.add(Posting.get_postings(page.text, page.headings, page.title, id)[0])
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return size
+
+def build(pages: Path, num_workers: int, memory_budget: int) -> Tuple[float, List[Tuple[int, int]]]:
+    """ Indexes the pages, returning the seconds taken and the starting and peak memory of each worker. """
+    start = time.perf_counter()
+    with redirect_stdout(io.StringIO()):
+        index = InvertedIndex(pages, restart=True, num_workers=num_workers, memory_budget=memory_budget, index_folder=pages.parent / "indices")
+        index.start()
+        index.merger.join()
+    elapsed = time.perf_counter() - start
+    return elapsed, sorted(peaks.get() for _ in range(num_workers))
+
+def main(num_pages, num_workers):
+    folder = Path(tempfile.mkdtemp())
+    corpus = Corpus(num_pages)
+    corpus.write_segments(folder / "pages")
+    Worker.__call__, Worker.exit, Worker.create_partial_index = reporting_call, reporting_exit, counting_create_partial_index
+
+    runs = [("Posting lists, 100,000 postings", None)] + [(f"Arrays, {budget}MB budget", budget) for budget in (4, 16, 64)]
+    for name, budget in runs:
+        partial_indices.value = 0
+        if budget is None:
+            with object_buffer():
+                elapsed, rss = build(folder / "pages", num_workers, 0)
+        else:
+            elapsed, rss = build(folder / "pages", num_workers, budget * 1024 * 1024)
+        print(f"{name:>32}: {num_pages / elapsed:6.1f} documents/s, {partial_indices.value:3} partial indices, "
+              f"peak memory of each worker {', '.join(f'{peak / 1e6:6.1f}MB (+{(peak - start) / 1e6:5.1f}MB)' for start, peak in rss)}")
+    Worker.__call__, Worker.exit, Worker.create_partial_index = call_worker, exit_worker, create_partial_index
+
+    # Memory freed by the main process would be reused by the workers forked after it, so the buffers are traced last.
+    pages = [html for _, html in islice(corpus, 300)]
+    for name, buffer in (("Posting lists", ObjectBuffer()), ("Arrays", PostingsBuffer())):
+        size = traced_bytes(buffer, pages)
+        print(f"{name:>32}: {size / 1e6:6.2f}MB for the {len(buffer)} postings of {len(pages)} pages, {size / len(buffer):6.1f} bytes per posting")
+    shutil.rmtree(folder)
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--pages", type=int, default=2000)
+    parser.add_argument("--workers", type=int, default=2)
+    args = parser.parse_args()
+    main(args.pages, args.workers)
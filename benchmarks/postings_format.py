@@ -0,0 +1,88 @@
+""" Compares the text index against the binary postings format, in size and in the time to read a token's postings.
+
+The corpus is indexed with the indexer, and the same postings are written out in the old text format.
+
+Usage: python -m benchmarks.postings_format [--pages 3000] [--queries 200]
+"""
+from argparse import ArgumentParser
+from benchmarks.corpus import Corpus
+from inverted_indexer.indexer import InvertedIndex
+from shared.posting import Posting
+from shared.postings import INDEX_FILE, IndexReader, iter_postings
+from shared.dictionary import DICTIONARY_FILE, TermDictionary
+from shared.segments import SegmentSet
+from typing import Dict, List
+from pathlib import Path
+import contextlib
+import tempfile
+import random
+import time
+import io
+import os
+
+def write_text_index(index_folder: Path, path: Path) -> Dict[str, int]:
+    """ Writes the binary index as "token:id,score;..." lines, returning the offset of each token. """
+    offsets = {}
+    with open(path, "w") as index:
+        for token, postings in iter_postings(index_folder / INDEX_FILE):
+            offsets[token] = index.tell()
+            index.write(f"{token}:" + ";".join(f"{id},{score:.3f}" for id, score in zip(*postings.decode())) + "\n")
+    return offsets
+
+def read_text(path: Path, offsets: Dict[str, int], tokens: List[str]) -> int:
+    """ The search engine's original lookup, which parsed each posting into an object. """
+    count = 0
+    with open(path, "r") as index:
+        for token in tokens:
+            index.seek(offsets[token])
+            token, postings_string = index.readline().split(":", 1)
+            count += len([Posting.from_string(p) for p in postings_string.split(";")])
+    return count
+
+def read_binary(reader: IndexReader, offsets: Dict[str, int], tokens: List[str]) -> int:
+    count = 0
+    for token in tokens:
+        ids, scores = reader.read(offsets[token])[1].decode()
+        count += len(ids)
+    return count
+
+def main(num_pages, num_queries):
+    folder = tempfile.TemporaryDirectory()
+    Corpus(num_pages).write_segments(Path(folder.name) / "pages")
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        indexer = InvertedIndex(Path(folder.name) / "pages", restart=True, num_workers=2, index_folder=Path(folder.name) / "indices")
+        indexer.start()
+        indexer.merger.join()
+    print(f"Indexed {num_pages} pages in {time.perf_counter() - start:.1f}s")
+
+    index_folder = next(iter(SegmentSet(indexer.index_folder))).folder   # A new index is one segment.
+    binary_offsets, lengths = dict(TermDictionary(index_folder / DICTIONARY_FILE)), {}
+    text_path = Path(folder.name) / "index.txt"
+    text_offsets = write_text_index(index_folder, text_path)
+    for token, postings in iter_postings(index_folder / INDEX_FILE):
+        lengths[token] = len(postings)
+    print(f"Text index: {os.path.getsize(text_path) / 1e6:.2f}MB, binary index: {os.path.getsize(index_folder / INDEX_FILE) / 1e6:.2f}MB")
+
+    # Frequent tokens are where parsing cost shows up, so they are measured apart from tokens picked at random.
+    rng = random.Random(0)
+    frequent = sorted(lengths, key=lengths.get, reverse=True)[:num_queries]
+    samples = {"frequent": frequent, "random": rng.sample(sorted(lengths), min(num_queries, len(lengths)))}
+    reader = IndexReader(index_folder / INDEX_FILE)
+    for name, tokens in samples.items():
+        results = []
+        for read in (lambda: read_text(text_path, text_offsets, tokens), lambda: read_binary(reader, binary_offsets, tokens)):
+            start = time.perf_counter()
+            count = read()
+            elapsed = time.perf_counter() - start
+            results.append(f"{elapsed / len(tokens) * 1000:7.3f}ms/token ({count / elapsed / 1e6:5.2f}M postings/s)")
+        print(f"{name:>8} tokens, {sum(lengths[token] for token in tokens) / len(tokens):7.1f} postings on average: text {results[0]}, binary {results[1]}")
+    reader.close()
+    folder.cleanup()
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--pages", type=int, default=3000)
+    parser.add_argument("--queries", type=int, default=200, help="Tokens to read in each sample")
+    args = parser.parse_args()
+    main(args.pages, args.queries)
@@ -0,0 +1,76 @@
+""" Measures the time per query of a skewed log of queries with the postings and results caches, against searching
+without them, and checks that both give the same results.
+
+The corpus is indexed with the indexer into a temporary folder. The log is drawn from a set of distinct queries with
+Zipf weights, so a few of them make up most of it, as in the logs of a search engine.
+Cache hit rates and memory are as reported by the search engine's cache stats.
+
+Usage: python -m benchmarks.query_cache [--pages 2000] [--distinct 2000] [--queries 5000] [--skew 1.0] [--postings-mb 64] [--results-mb 4]
+"""
+from argparse import ArgumentParser
+from benchmarks.corpus import Corpus
+from contextlib import redirect_stdout
+from inverted_indexer.indexer import InvertedIndex
+from start_search_engine import SearchEngine
+from statistics import quantiles
+from typing import List
+from pathlib import Path
+import tempfile
+import shutil
+import random
+import time
+import io
+
+def replay(engine: SearchEngine, queries: List[str]) -> List[float]:
+    times = []
+    for query in queries:
+        start = time.perf_counter()
+        engine.find(query)
+        times.append(time.perf_counter() - start)
+    return times
+
+def latency(times: List[float]) -> str:
+    p50, p99 = (quantiles(times, n=100)[i] for i in (49, 98))
+    return f"mean {sum(times) / len(times) * 1000:6.3f}ms, p50 {p50 * 1000:6.3f}ms, p99 {p99 * 1000:7.3f}ms"
+
+def main(num_pages, num_distinct, num_queries, skew, postings_mb, results_mb):
+    folder = Path(tempfile.mkdtemp())
+    corpus = Corpus(num_pages)
+    corpus.write_segments(folder / "pages")
+    with redirect_stdout(io.StringIO()):
+        indexer = InvertedIndex(folder / "pages", restart=True, num_workers=2, index_folder=folder / "indices")
+        indexer.start()
+        indexer.merger.join()
+
+    rng = random.Random(0)
+    distinct = [" ".join(corpus.words(rng, rng.randint(1, 3))) for _ in range(num_distinct)]
+    # Some queries quote their words, searching for them as a phrase.
+    distinct = [f'"{query}"' if " " in query and rng.random() < 0.2 else query for query in distinct]
+    queries = rng.choices(distinct, weights=[1 / rank ** skew for rank in range(1, num_distinct + 1)], k=num_queries)
+    print(f"{num_pages} pages, {num_queries} queries drawn from {num_distinct} with Zipf skew {skew}, {len(set(queries))} of them distinct")
+
+    uncached = SearchEngine(postings_cache=0, results_cache=0, index_folder=folder / "indices")
+    cached = SearchEngine(postings_cache=int(postings_mb * 2**20), results_cache=int(results_mb * 2**20), index_folder=folder / "indices")
+    print(f"{'no caches':>8}: {latency(replay(uncached, queries))}")
+    print(f"{'caches':>8}: {latency(replay(cached, queries))}")
+    for name, stats in cached.cache_stats().items():
+        if isinstance(stats, dict):
+            print(f"{name:>8}: {stats['hit_rate']:6.1%} hits, {stats['entries']} entries, {stats['bytes'] / 2**20:.2f}MB of {stats['budget'] / 2**20:.0f}MB, {stats['evictions']} evicted")
+
+    # Results cached as the postings were being cached, and results found from cached postings, are both checked.
+    cached.results_cache.set_generation(None)
+    same = all(cached.find(query) == uncached.find(query) for query in distinct)
+    print(f"Same results for every query: {same}")
+    assert same, "The cached search engine gave different results"
+    shutil.rmtree(folder)
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--pages", type=int, default=2000)
+    parser.add_argument("--distinct", type=int, default=2000)
+    parser.add_argument("--queries", type=int, default=5000)
+    parser.add_argument("--skew", type=float, default=1.0)
+    parser.add_argument("--postings-mb", type=float, default=64)
+    parser.add_argument("--results-mb", type=float, default=4)
+    args = parser.parse_args()
+    main(args.pages, args.distinct, args.queries, args.skew, args.postings_mb, args.results_mb)
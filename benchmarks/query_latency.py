@@ -0,0 +1,244 @@
+""" Measures the latency of the search engine over a file of queries, against an index built from the benchmark corpus
+by the indexer, and writes the results as JSON so runs on two commits can be compared.
+
+The corpus is indexed with the indexer into a temporary folder. The queries are then searched in a new process, so its
+memory is only that of searching. Each query is searched once with the index just opened, after asking the OS to drop
+the index files from its page cache, which is the cold latency, then the file is searched again a number of times,
+which is the warm latency. The results cache is left out, so every search is run again rather than looked up, and its
+effect is measured by benchmarks/query_cache.py instead. The postings decoded by each query are counted from the
+blocks the search engine decodes, so postings read from the postings cache are not. A sharded index is searched with
+its shards in the same process as stand-ins, so their postings and memory are counted.
+
+Each line of the query file is a category and a query, separated by a tab:
+  single    one word
+  multi     more than one word, ranked again with how close together they are
+  phrase    words in quotes that some pages have in that order
+  fallback  words in quotes that no page has in that order, searched for again as words
+  none      words no page has
+The queries in benchmarks/queries.txt were written with --write-queries from the default corpus.
+
+Usage: python -m benchmarks.query_latency [--pages 2000] [--queries benchmarks/queries.txt] [--repeat 5] [--shards 1] [--no-caches] [--output results.json]
+       python -m benchmarks.query_latency --write-queries benchmarks/queries.txt [--pages 2000]
+       python -m benchmarks.query_latency --compare before.json after.json
+"""
+from argparse import ArgumentParser
+from benchmarks.corpus import Corpus
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+from inverted_indexer.indexer import InvertedIndex
+from multiprocessing import get_context
+from statistics import quantiles
+from typing import Dict, List, Tuple
+from pathlib import Path
+import subprocess
+import tempfile
+import resource
+import hashlib
+import shutil
+import random
+import json
+import time
+import sys
+import re
+import io
+import os
+
+ROOT = Path(__file__).parent.parent
+QUERIES_FILE = Path(__file__).parent / "queries.txt"
+CATEGORIES = ["single", "multi", "phrase", "fallback", "none"]
+
+def read_queries(path: Path) -> List[Tuple[str, str]]:
+    """ Reads the category and query of each line of a query file, skipping blank lines and comments. """
+    with open(path, "r", encoding="utf-8") as file:
+        return [tuple(line.rstrip("\n").split("\t", 1)) for line in file if line.strip() and not line.startswith("#")]
+
+def write_queries(path: Path, corpus: Corpus, per_category: int) -> None:
+    """ Writes a query file with queries of each category drawn from the corpus. """
+    rng = random.Random(1)
+    # Phrases are taken from within a paragraph of a page that is not a near-duplicate, which would be left out of the index,
+    # after the word in bold, whose position isn't kept with the body's.
+    paragraphs = []
+    for i, (_, html) in enumerate(corpus):
+        if i not in corpus.duplicate_of:
+            paragraphs.extend(paragraph.split("</strong>")[-1].split() for paragraph in re.findall(r"<p>(.*?)</p>", html))
+    queries = []
+    for _ in range(per_category):
+        queries.append(("single", corpus.words(rng, 1)[0]))
+        queries.append(("multi", " ".join(corpus.words(rng, rng.randint(2, 4)))))
+        paragraph = rng.choice(paragraphs)
+        start = rng.randrange(len(paragraph) - 3)
+        queries.append(("phrase", f'"{" ".join(paragraph[start:start + rng.randint(2, 3)])}"'))
+        # Uncommon words are drawn for the phrases no page has, so no page has them next to each other.
+        queries.append(("fallback", f'"{" ".join(rng.sample(corpus.vocabulary[5000:], 3))}"'))
+        queries.append(("none", " ".join("".join(rng.choice("qwjy") for _ in range(rng.randint(4, 7))) for _ in range(rng.randint(1, 2)))))
+    queries.sort(key=lambda query: CATEGORIES.index(query[0]))
+    with open(path, "w", encoding="utf-8") as file:
+        file.write(f"# {per_category} queries of each category, drawn from a corpus of {corpus.num_pages} pages with seed {corpus.seed}.\n")
+        for category, query in queries:
+            file.write(f"{category}\t{query}\n")
+
+def percentiles(times: List[float]) -> Dict[str, float]:
+    p50, p95, p99 = (quantiles(times, n=100, method="inclusive")[i] for i in (49, 94, 98))
+    return {"mean_ms": sum(times) / len(times) * 1000, "p50_ms": p50 * 1000, "p95_ms": p95 * 1000, "p99_ms": p99 * 1000}
+
+def peak_rss() -> int:
+    """ Returns the most memory this process has held, in bytes. """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+def drop_page_cache(folder: Path) -> None:
+    """ Asks the OS to drop the files of the index from its page cache, where it can, so they are read from disk again. """
+    if not hasattr(os, "posix_fadvise"):
+        return
+    for path in folder.rglob("*"):
+        if path.is_file():
+            fd = os.open(path, os.O_RDONLY)
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+            os.close(fd)
+
+def replay(index_folder: Path, queries: List[Tuple[str, str]], repeat: int, caches: bool) -> Dict:
+    """ Searches the queries once with the index just opened, then repeat more times, in the process this is called in.
+    Returns the time, postings decoded and results of each search, and the memory of the process.
+    """
+    from shared.postings import PostingsList
+    from start_search_engine import SearchEngine
+
+    # Every block decoded from an index file, rather than read from the cache, is counted.
+    decoded = [0]
+    block = PostingsList.block
+    def counting_block(self, number):
+        ids, values = block(self, number)
+        decoded[0] += len(ids)
+        return ids, values
+    PostingsList.block = counting_block
+
+    baseline = peak_rss()
+    drop_page_cache(index_folder)
+    start = time.perf_counter()
+    engine = SearchEngine(refresh=False, index_folder=index_folder, processes=False, results_cache=0, **({} if caches else {"postings_cache": 0}))
+    opened = time.perf_counter() - start
+
+    passes = []
+    for _ in range(1 + repeat):
+        times, counts, results = [], [], []
+        for _, query in queries:
+            decoded[0] = 0
+            start = time.perf_counter()
+            _, doc_ids = engine.find(query)
+            times.append(time.perf_counter() - start)
+            counts.append(decoded[0])
+            results.append(doc_ids)
+        passes.append((times, counts, results))
+    engine.close()
+    return {"open_seconds": opened, "passes": passes, "rss_before_open": baseline, "peak_rss": peak_rss()}
+
+def summarize(queries: List[Tuple[str, str]], passes: List[Tuple[List[float], List[int], List[List[int]]]]) -> Dict:
+    """ Returns the latency and postings decoded of the cold and warm searches of the given queries. """
+    cold_times, cold_counts, _ = passes[0]
+    warm_times = [t for times, _, _ in passes[1:] for t in times]
+    warm_counts = [c for _, counts, _ in passes[1:] for c in counts]
+    summary = {"queries": len(queries), "cold": percentiles(cold_times), "warm": percentiles(warm_times) if warm_times else None}
+    summary["postings_decoded_per_query"] = {
+        "cold": sum(cold_counts) / len(cold_counts),
+        "warm": sum(warm_counts) / len(warm_counts) if warm_counts else None,
+    }
+    summary["results_per_query"] = sum(len(results) for results in passes[0][2]) / len(queries)
+    return summary
+
+def run(num_pages: int, queries_file: Path, repeat: int, num_shards: int, caches: bool) -> Dict:
+    folder = Path(tempfile.mkdtemp())
+    corpus = Corpus(num_pages)
+    corpus.write_segments(folder / "pages")
+    start = time.perf_counter()
+    with redirect_stdout(io.StringIO()):
+        indexer = InvertedIndex(folder / "pages", restart=True, num_workers=2, num_shards=num_shards, index_folder=folder / "indices")
+        indexer.start()
+        indexer.merger.join()
+    build = time.perf_counter() - start
+
+    queries = read_queries(queries_file)
+    with ProcessPoolExecutor(1, mp_context=get_context("spawn")) as executor:
+        searched = executor.submit(replay, folder / "indices", queries, repeat, caches).result()
+    passes = searched["passes"]
+
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    report = {
+        "commit": commit,
+        "corpus": {"pages": num_pages, "seed": corpus.seed},
+        "index": {
+            "shards": num_shards,
+            "build_seconds": build,
+            "bytes": sum(path.stat().st_size for path in (folder / "indices").rglob("*") if path.is_file()),
+            "open_seconds": searched["open_seconds"],
+        },
+        "query_file": str(queries_file),
+        "repeat": repeat,
+        "caches": caches,
+        "memory": {"rss_before_open_mb": searched["rss_before_open"] / 2**20, "peak_rss_mb": searched["peak_rss"] / 2**20},
+        "all": summarize(queries, passes),
+        "categories": {},
+        # The doc ids of every result, so a change to the results shows up as well as a change in latency.
+        "results_digest": hashlib.sha1(json.dumps(passes[0][2]).encode("utf-8")).hexdigest(),
+    }
+    for category in CATEGORIES:
+        indices = [i for i, (query_category, _) in enumerate(queries) if query_category == category]
+        if indices:
+            report["categories"][category] = summarize(
+                [queries[i] for i in indices],
+                [([times[i] for i in indices], [counts[i] for i in indices], [results[i] for i in indices]) for times, counts, results in passes],
+            )
+    shutil.rmtree(folder)
+    return report
+
+def flatten(report: Dict, prefix="") -> Dict[str, float]:
+    """ Returns every number in a report, keyed by its path, such as categories.single.cold.p50_ms. """
+    values = {}
+    for key, value in report.items():
+        if isinstance(value, dict):
+            values.update(flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            values[f"{prefix}{key}"] = value
+    return values
+
+def compare(before: Path, after: Path) -> None:
+    """ Prints each number of two reports side by side, with how much it changed. """
+    with open(before, "r", encoding="utf-8") as file:
+        old = json.load(file)
+    with open(after, "r", encoding="utf-8") as file:
+        new = json.load(file)
+    print(f"{'':<52} {old.get('commit') or before.name:>12} {new.get('commit') or after.name:>12}")
+    old_values, new_values = flatten(old), flatten(new)
+    for key in (key for key in old_values if key in new_values):
+        a, b = old_values[key], new_values[key]
+        change = f"{(b - a) / a:+8.1%}" if a else ""
+        print(f"{key:<52} {a:12.3f} {b:12.3f} {change}")
+    same = old["results_digest"] == new["results_digest"]
+    print(f"Same results: {same}")
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--pages", type=int, default=2000)
+    parser.add_argument("--queries", type=Path, default=QUERIES_FILE)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--shards", type=int, default=1)
+    parser.add_argument("--no-caches", action="store_true", help="Search without the postings cache.")
+    parser.add_argument("--output", type=Path, help="Write the results to this file instead of printing them.")
+    parser.add_argument("--write-queries", type=Path, help="Write a query file drawn from the corpus, instead of searching.")
+    parser.add_argument("--per-category", type=int, default=40)
+    parser.add_argument("--compare", type=Path, nargs=2, metavar=("BEFORE", "AFTER"), help="Compare the results of two runs.")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+    elif args.write_queries:
+        write_queries(args.write_queries, Corpus(args.pages), args.per_category)
+    else:
+        report = json.dumps(run(args.pages, args.queries, args.repeat, args.shards, not args.no_caches), indent=2, sort_keys=True)
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as file:
+                file.write(report + "\n")
+        else:
+            print(report)
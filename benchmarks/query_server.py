@@ -0,0 +1,121 @@
+""" Measures the queries per second and latency of the search server, with searches in threads and in processes, at
+a number of clients sending queries at once, against opening the index for every query as the interface did before.
+
+The corpus is indexed with the indexer into a temporary folder. Each server is started as its own process, from the
+root of the repository, searching that folder, and each client sends its next query as soon as it has the results of
+the last one. Opening the index for every query is measured in this process, one query at a time.
+
+Usage: python -m benchmarks.query_server [--pages 2000] [--queries 400] [--clients 1 8 32] [--threads 4] [--processes 2]
+"""
+from aiohttp import ClientSession
+from argparse import ArgumentParser
+from benchmarks.corpus import Corpus
+from contextlib import redirect_stdout
+from inverted_indexer.indexer import InvertedIndex
+from start_search_engine import SearchEngine
+from statistics import quantiles
+from typing import List, Tuple
+from pathlib import Path
+import subprocess
+import tempfile
+import asyncio
+import shutil
+import random
+import socket
+import time
+import sys
+import io
+import os
+
+ROOT = Path(__file__).parent.parent
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def latency(times: List[float], elapsed: float) -> str:
+    p50, p99 = (quantiles(times, n=100)[i] for i in (49, 98))
+    return f"{len(times) / elapsed:7.1f} queries/s, p50 {p50 * 1000:7.2f}ms, p99 {p99 * 1000:7.2f}ms"
+
+async def wait_until_ready(url: str, server: subprocess.Popen) -> None:
+    async with ClientSession() as session:
+        while server.poll() is None:
+            try:
+                async with session.get(f"{url}/search", params={"q": "a"}) as response:
+                    if response.status == 200:
+                        return
+            except OSError:
+                pass
+            await asyncio.sleep(0.1)
+    raise RuntimeError("The search server exited before it was ready")
+
+async def send_queries(url: str, queries: List[str], num_clients: int) -> Tuple[List[float], float]:
+    """ Sends the queries from a number of clients at once, returning the seconds each took and the seconds for all of them. """
+    times = []
+    remaining = iter(queries)
+
+    async def client(session: ClientSession):
+        for query in remaining:
+            start = time.perf_counter()
+            async with session.get(f"{url}/search", params={"q": query}) as response:
+                await response.read()
+            times.append(time.perf_counter() - start)
+
+    async with ClientSession() as session:
+        start = time.perf_counter()
+        await asyncio.gather(*(client(session) for _ in range(num_clients)))
+        return times, time.perf_counter() - start
+
+def measure_server(name: str, args: List[str], index_folder: Path, queries: List[str], clients: List[int]) -> None:
+    port = free_port()
+    url = f"http://127.0.0.1:{port}"
+    server = subprocess.Popen([sys.executable, "start_search_server.py", "--port", str(port), "--index", str(index_folder), *args], cwd=ROOT, stdout=subprocess.DEVNULL)
+    try:
+        asyncio.run(wait_until_ready(url, server))
+        asyncio.run(send_queries(url, queries[:50], max(clients)))     # Warm up the page cache and the processes.
+        for num_clients in clients:
+            times, elapsed = asyncio.run(send_queries(url, queries, num_clients))
+            print(f"{name:>12}, {num_clients:3} clients: {latency(times, elapsed)}")
+    finally:
+        server.terminate()
+        server.wait()
+
+def measure_per_query(index_folder: Path, queries: List[str]) -> None:
+    """ Opens the index for every query and shows the results with snippets, as the interface did on each rerun. """
+    times = []
+    start = time.perf_counter()
+    for query in queries:
+        query_start = time.perf_counter()
+        engine = SearchEngine(index_folder=index_folder)
+        engine.search(query)
+        engine.snippets()
+        times.append(time.perf_counter() - query_start)
+    print(f"{'per query':>12}, {1:3} clients: {latency(times, time.perf_counter() - start)}")
+
+def main(num_pages, num_queries, clients, num_threads, num_processes):
+    folder = Path(tempfile.mkdtemp())
+    corpus = Corpus(num_pages)
+    corpus.write_segments(folder / "pages")
+    with redirect_stdout(io.StringIO()):
+        indexer = InvertedIndex(folder / "pages", restart=True, num_workers=2, index_folder=folder / "indices")
+        indexer.start()
+        indexer.merger.join()
+    print(f"{num_pages} pages, {num_queries} queries, {os.cpu_count()} CPUs")
+
+    rng = random.Random(0)
+    queries = [" ".join(corpus.words(rng, rng.randint(1, 3))) for _ in range(num_queries)]
+    measure_per_query(folder / "indices", queries[:max(20, num_queries // 10)])
+    measure_server(f"{num_threads} threads", ["-t", str(num_threads)], folder / "indices", queries, clients)
+    measure_server(f"{num_processes} processes", ["-p", str(num_processes)], folder / "indices", queries, clients)
+    shutil.rmtree(folder)
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--pages", type=int, default=2000)
+    parser.add_argument("--queries", type=int, default=400)
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--processes", type=int, default=2)
+    args = parser.parse_args()
+    main(args.pages, args.queries, args.clients, args.threads, args.processes)
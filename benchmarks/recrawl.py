@@ -0,0 +1,113 @@
+""" Measures what a refresh costs with a full restart against an incremental recrawl and index, after a fraction
+of the pages on a local HTTPS stand-in changed, were touched without changing, or were deleted.
+
+Usage: python -m benchmarks.recrawl [--hosts 10] [--pages 100] [--changed 0.05] [--touched 0.05] [--deleted 0.01]
+"""
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from benchmarks.standin import StandInServer, crawler_config
+from inverted_indexer.indexer import InvertedIndex
+from shared.pagestore import ChangeLog, PageStoreReader
+from shared.postings import INDEX_FILE, iter_postings
+from shared.segments import SegmentSet
+from web_crawler.utils.config import Config
+from web_crawler.crawler import Crawler
+from typing import Dict, List
+from pathlib import Path
+import contextlib
+import tempfile
+import logging
+import random
+import time
+import io
+import os
+
+def crawl(folder: str, seed_urls: List[str], expected: int, restart: bool, recrawl: bool) -> Dict:
+    """ Crawls until the expected number of pages were added, changed, deleted or found unchanged. """
+    logging.disable(logging.INFO)
+    os.chdir(folder)
+    cparser = crawler_config(seed_urls, str(Path(folder) / "frontier.db"))
+    cparser["CRAWLER"]["REVISITMIN"] = "0"
+    crawler = Crawler(Config(cparser), restart, 8, "thread", recrawl)
+
+    start = time.perf_counter()
+    crawler.start_async()
+    while sum(crawler.frontier.change_counts.values()) < expected:
+        if time.perf_counter() - start > 600:
+            raise TimeoutError("Crawl did not finish, see web_crawler/logs.")
+        time.sleep(0.01)
+    elapsed = time.perf_counter() - start
+    crawler.frontier.stop()
+    crawler.join()
+    return {"seconds": elapsed, **crawler.frontier.change_counts}
+
+def index(folder: str, restart: bool) -> float:
+    """ Indexes the crawled pages into the folder, returning the seconds taken. """
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        indexer = InvertedIndex(Path(folder) / "pages", restart=restart, num_workers=2, index_folder=Path(folder) / "indices")
+        indexer.start()
+        indexer.merger.join()
+    return time.perf_counter() - start
+
+def indexed_documents(folder: str) -> int:
+    """ Returns the number of distinct documents with postings in the index in the folder, less the tombstoned ones. """
+    ids = set()
+    for segment in SegmentSet(Path(folder) / "indices"):
+        for _, postings in iter_postings(segment.folder / INDEX_FILE):
+            ids.update(postings.decode()[0])
+        ids -= segment.deleted
+    return len(ids)
+
+def main(hosts, pages, changed, touched, deleted):
+    server = StandInServer(hosts, pages, latency=0.01)
+    server.start()
+    folder = tempfile.TemporaryDirectory(ignore_cleanup_errors=True)
+    try:
+        # Each crawl runs in a fresh process that trusts the stand-in's certificate.
+        def run_crawl(restart: bool, recrawl: bool, expected: int) -> Dict:
+            with ProcessPoolExecutor(1, mp_context=get_context("spawn")) as pool:
+                return pool.submit(crawl, folder.name, server.seed_urls, expected, restart, recrawl).result()
+
+        first = run_crawl(True, False, server.total_pages)
+        full_index = index(folder.name, True)
+        print(f"Crawled {server.total_pages} pages in {first['seconds']:.1f}s, indexed them in {full_index:.1f}s")
+
+        rng = random.Random(0)
+        sample = rng.sample(server.pages, int(server.total_pages * (changed + touched + deleted)))
+        num_changed, num_touched = int(server.total_pages * changed), int(server.total_pages * touched)
+        for page in sample[:num_changed]:
+            server.change(page)
+        for page in sample[num_changed:num_changed + num_touched]:
+            server.touch(page)
+        server.deleted.update(sample[num_changed + num_touched:])
+        print(f"Changed {num_changed}, touched {num_touched} and deleted {len(server.deleted)} pages")
+
+        records = sum(1 for _ in PageStoreReader(Path(folder.name) / "pages").refs())
+        refresh = run_crawl(False, True, server.total_pages)
+        saved = sum(1 for _ in PageStoreReader(Path(folder.name) / "pages").refs()) - records
+        incremental_index = index(folder.name, False)
+        print(
+            f"Recrawl: {refresh['seconds']:.1f}s, {saved} pages saved, "
+            f"{refresh.get('changed', 0)} changed, {refresh.get('deleted', 0)} deleted, {refresh.get('unchanged', 0)} unchanged"
+        )
+        print(f"Incremental index: {incremental_index:.1f}s, {indexed_documents(folder.name)} documents in the index")
+        changes = list(ChangeLog(Path(folder.name) / "pages"))
+        print(f"Change list: {len(changes)} entries, {sum(change.change != 'added' for change in changes)} from the recrawl")
+
+        full_index = index(folder.name, True)
+        print(f"Full reindex for comparison: {full_index:.1f}s, {indexed_documents(folder.name)} documents in the index")
+    finally:
+        folder.cleanup()
+        server.stop()
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--hosts", type=int, default=10)
+    parser.add_argument("--pages", type=int, default=100, help="Pages per host")
+    parser.add_argument("--changed", type=float, default=0.05, help="Fraction of pages whose content changes")
+    parser.add_argument("--touched", type=float, default=0.05, help="Fraction of pages given a new ETag without changing")
+    parser.add_argument("--deleted", type=float, default=0.01, help="Fraction of pages deleted")
+    args = parser.parse_args()
+    main(args.hosts, args.pages, args.changed, args.touched, args.deleted)
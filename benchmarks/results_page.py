@@ -0,0 +1,85 @@
+""" Measures the time to show a page of results, from the query to the snippet of each result, with snippets taken
+from the extracts in the document table, against reading and parsing each result's page for its context as before.
+
+The corpus is indexed with the indexer into a temporary folder. Both ways run the same search, which finds the path,
+url and title of each result in the document table, and is also timed alone. The old way then loaded each page from
+the page store, parsed it, and searched its text for the last word of the query it had.
+
+Usage: python -m benchmarks.results_page [--pages 2000] [--queries 200]
+"""
+from argparse import ArgumentParser
+from benchmarks.corpus import Corpus
+from contextlib import redirect_stdout
+from inverted_indexer.indexer import InvertedIndex
+from shared.documents import DOCS_FILE, RECORDS_FILE
+from shared.webpage import WebPage
+from start_search_engine import SearchEngine
+from statistics import quantiles
+from typing import List
+from pathlib import Path
+import tempfile
+import shutil
+import random
+import time
+import io
+import os
+import re
+
+
+def get_context(webpage: WebPage, tokens: List[str]) -> str:
+    """ WebPage.get_context as it was, taking the text after the last word of the query found in the page's body. """
+    context = ""
+    tokens = " ".join(tokens).split(" ")
+    if tokens and (body := webpage.get_soup().find("body")):
+        body_strings = [re.sub(r'\s+',' ', string).strip() for string in body.stripped_strings]
+        body_strings = " ".join(body_strings)
+        body_strings = " ".join(re.findall(r'\b[a-zA-Z0-9]+\b', body_strings))
+        for token in tokens:
+            pos = body_strings.lower().find(token)
+            if pos > -1:
+                context = body_strings[pos:pos+300]
+    return context
+
+def search_only(engine: SearchEngine, query: str) -> None:
+    engine.search(query)
+
+def parsed_pages(engine: SearchEngine, query: str) -> List[str]:
+    return [get_context(WebPage.from_path(path), engine.prev_tokens) for path, _, _ in engine.search(query)]
+
+def stored_extracts(engine: SearchEngine, query: str) -> List[str]:
+    engine.search(query)
+    return engine.snippets()
+
+def latency(times: List[float]) -> str:
+    p50, p95 = (quantiles(times, n=100)[i] for i in (49, 94))
+    return f"p50 {p50 * 1000:7.3f}ms, p95 {p95 * 1000:7.3f}ms, mean {sum(times) / len(times) * 1000:7.3f}ms"
+
+def main(num_pages, num_queries):
+    folder = Path(tempfile.mkdtemp())
+    corpus = Corpus(num_pages)
+    corpus.write_segments(folder / "pages")
+    with redirect_stdout(io.StringIO()):
+        indexer = InvertedIndex(folder / "pages", restart=True, num_workers=2, index_folder=folder / "indices")
+        indexer.start()
+        indexer.merger.join()
+        engine = SearchEngine(index_folder=folder / "indices")
+    size = os.path.getsize(folder / "indices" / DOCS_FILE) + os.path.getsize(folder / "indices" / RECORDS_FILE)
+    print(f"{num_pages} pages, document table of {size / 1e6:.2f}MB, {size / num_pages:.0f} bytes per page")
+
+    rng = random.Random(0)
+    queries = [" ".join(corpus.words(rng, rng.randint(1, 3))) for _ in range(num_queries)]
+    for name, results_page in (("search alone", search_only), ("parsing each page", parsed_pages), ("stored extracts", stored_extracts)):
+        times = []
+        for query in queries:
+            start = time.perf_counter()
+            results_page(engine, query)
+            times.append(time.perf_counter() - start)
+        print(f"{name:>18}: {latency(times)} per page of results")
+    shutil.rmtree(folder)
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--pages", type=int, default=2000)
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+    main(args.pages, args.queries)
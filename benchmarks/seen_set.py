@@ -0,0 +1,99 @@
+""" Measures memory per url and add throughput of the frontier's seen sets against a dict of url states.
+
+Usage: python -m benchmarks.seen_set [--urls 1000000] [--duplicates 4]
+"""
+from argparse import ArgumentParser
+from benchmarks.standin import crawler_config
+from web_crawler.crawler.seen import FingerprintSet, ScalableBloomFilter
+from web_crawler.crawler.frontier import Frontier
+from web_crawler.utils.config import Config
+from typing import Callable, List
+import tracemalloc
+import tempfile
+import logging
+import random
+import sys
+import time
+import os
+
+def generate_urls(num_urls: int) -> List[str]:
+    """ Returns distinct urls shaped like the ones found while crawling. """
+    rng = random.Random(0)
+    sections = ["news", "people", "research", "courses", "events", "wiki", "seminars", "projects"]
+    return [
+        f"https://{rng.choice(sections)}{i % 500}.ics.uci.edu/{rng.choice(sections)}/{i}/index.php?id={rng.randrange(10 ** 6)}"
+        for i in range(num_urls)
+    ]
+
+class DictSeenSet:
+    """ The frontier's original dict mapping each url to its state. """
+    def __init__(self):
+        self.urls = {}
+
+    def add(self, url: str) -> bool:
+        if url in self.urls:
+            return False
+        self.urls[url] = {"downloaded": False, "length": 0}
+        return True
+
+def measure(create: Callable, urls: List[str], stream: List[str]):
+    """ Returns the bytes per url of the filled seen set, the adds per second over the stream, and the urls wrongly seen. """
+    tracemalloc.start()
+    seen = create()
+    missed = sum(not seen.add(url) for url in urls)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    seen = create()
+    start = time.perf_counter()
+    for url in stream:
+        seen.add(url)
+    return size / len(urls), len(stream) / (time.perf_counter() - start), missed
+
+def measure_frontier(seen_set: str, stream: List[str]) -> float:
+    """ Returns Frontier.add_url calls per second over the stream. """
+    with tempfile.TemporaryDirectory() as folder:
+        os.chdir(folder)
+        cparser = crawler_config(["https://seed.example/"], os.path.join(folder, "frontier.db"))
+        cparser["CRAWLER"]["SEENSET"] = seen_set
+        frontier = Frontier(Config(cparser), True)
+        start = time.perf_counter()
+        for url in stream:
+            frontier.add_url(url)
+        elapsed = time.perf_counter() - start
+        frontier.close()
+    return len(stream) / elapsed
+
+def main(num_urls, duplicates):
+    logging.disable(logging.INFO)
+    urls = generate_urls(num_urls)
+    # Most links found while crawling were found before, so each url is added several times.
+    stream = urls * duplicates
+    random.Random(1).shuffle(stream)
+    print(f"{num_urls} urls, {len(stream)} adds")
+
+    seen_sets = {
+        "dict": DictSeenSet,
+        "fingerprint": FingerprintSet,
+        "bloom 0.1%": lambda: ScalableBloomFilter(0.001),
+        "bloom 1%": lambda: ScalableBloomFilter(0.01),
+    }
+    # The url strings were allocated before measuring, but the dict keeps every one of them alive.
+    string_size = sum(sys.getsizeof(url) for url in urls) / len(urls)
+    for name, create in seen_sets.items():
+        bytes_per_url, adds_per_second, missed = measure(create, urls, stream)
+        bytes_per_url += string_size if name == "dict" else 0
+        print(f"{name:>12}: {bytes_per_url:6.1f} bytes/url, {adds_per_second:9.0f} adds/s, {missed} new urls wrongly seen")
+
+    # End to end, the seen set keeps repeated urls from reaching the save file.
+    sample = urls[:num_urls // 10] * duplicates
+    random.Random(2).shuffle(sample)
+    for seen_set in ("store", "fingerprint", "bloom"):
+        print(f"Frontier.add_url with {seen_set:>11}: {measure_frontier(seen_set, sample):9.0f} adds/s")
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--urls", type=int, default=1000000)
+    parser.add_argument("--duplicates", type=int, default=4, help="Times each url is added")
+    args = parser.parse_args()
+    main(args.urls, args.duplicates)
@@ -0,0 +1,156 @@
+""" Measures the segmented index: how soon new and changed pages are searchable when indexed as a new segment, compared
+to rebuilding the whole index, and query latency and merge time as segments pile up.
+
+The corpus is first indexed in one run, into a temporary folder. It is then saved again in batches, each indexed by
+its own run into a new segment, without merging in the background, and a search engine opened after the first run
+picks up each segment without restarting. Queries are searched at a few segment counts, then after merging by tier,
+and must return the same results as the single run. Finally some pages are changed, and the changed pages are indexed
+once as a new segment, tombstoning their old versions, and once by rebuilding. Tombstoned pages count towards the
+number of pages with each token until they are merged away, so the results only match the rebuilt index once every
+segment is merged.
+
+Usage: python -m benchmarks.segments [--pages 2000] [--batch 100] [--changed 5] [--queries 200]
+"""
+from argparse import ArgumentParser
+from benchmarks.corpus import Corpus
+from contextlib import redirect_stdout
+from inverted_indexer.indexer import InvertedIndex
+from inverted_indexer.indexer.merge import merge_segments, merge_tiers
+from itertools import chain
+from shared.pagestore import ChangeLog, PageStoreReader, PageStoreWriter
+from shared.segments import Manifest
+from start_search_engine import SearchEngine
+from statistics import quantiles
+from typing import Dict, List, Tuple
+from pathlib import Path
+import tempfile
+import shutil
+import random
+import time
+import io
+import os
+
+def index(folder: Path, restart: bool) -> float:
+    """ Runs the indexer on the pages in the folder, into the folder's indices, without merging segments afterwards,
+    returning the seconds until its segment is searchable. The indexer knows which pages it indexed by their paths relative to where it runs.
+    """
+    cwd = os.getcwd()
+    os.chdir(folder)
+    start = time.perf_counter()
+    with redirect_stdout(io.StringIO()):
+        indexer = InvertedIndex(Path("pages"), restart=restart, num_workers=2, index_folder=folder / "indices")
+        indexer.merge_segments = lambda: None
+        indexer.start()
+    os.chdir(cwd)
+    return time.perf_counter() - start
+
+def merge_all(index_folder: Path) -> None:
+    """ Merges every segment of the index into one, as the merge policy would once they reach the same tier. """
+    manifest = Manifest.read(index_folder)
+    names, name = manifest.names(), manifest.new_segment()
+    deleted = set(chain.from_iterable(segment["deleted"] for segment in manifest.segments))
+    manifest.replace(names, name, merge_segments(index_folder, names, name, deleted))
+    manifest.commit(index_folder)
+
+def relative(ref: str) -> str:
+    """ The reference to a page as the crawler records it, relative to where it runs. """
+    return str(Path("pages") / Path(ref).name)
+
+def search_all(engine: SearchEngine, queries: List[str]) -> Tuple[Dict[str, List[str]], List[float]]:
+    """ Returns the paths of each query's results, and the seconds each query took. """
+    results, times = {}, []
+    for query in queries:
+        start = time.perf_counter()
+        results[query] = [path for path, _, _ in engine.search(query)]
+        times.append(time.perf_counter() - start)
+    return results, times
+
+def latency(times: List[float]) -> str:
+    p50, p95 = (quantiles(times, n=100)[i] for i in (49, 94))
+    return f"p50 {p50 * 1000:7.3f}ms, p95 {p95 * 1000:7.3f}ms"
+
+def main(num_pages, batch, num_changed, num_queries):
+    folder = Path(tempfile.mkdtemp())
+    pages = folder / "pages"
+    corpus = Corpus(num_pages)
+    documents = list(corpus)
+    rng = random.Random(0)
+    queries = [" ".join(corpus.words(rng, rng.randint(1, 3))) for _ in range(num_queries)]
+    queries += [f'"{query}"' for query in queries[:num_queries // 4] if " " in query]
+
+    # The pages are saved the same way both times, so their paths, and the results of each query, are the same.
+    corpus.write_segments(pages)
+    full = index(folder, restart=True)
+    with redirect_stdout(io.StringIO()):
+        engine = SearchEngine(index_folder=folder / "indices")
+    expected, times = search_all(engine, queries)
+    print(f"One run: indexed {num_pages} pages in {full:6.1f}s, 1 segment: {latency(times)}")
+
+    shutil.rmtree(pages)
+    runs = []
+    for start in range(0, num_pages, batch):
+        writer = PageStoreWriter(pages)
+        for url, html in documents[start:start + batch]:
+            writer.write(url, html)
+        writer.close()
+        runs.append(index(folder, restart=not start))
+        count = len(runs)
+        if count == 1:
+            with redirect_stdout(io.StringIO()):
+                engine = SearchEngine(index_folder=folder / "indices")
+        if count & (count - 1) == 0 or start + batch >= num_pages:
+            results, times = search_all(engine, queries)
+            assert len(engine.segments) == count, f"{len(engine.segments)} segments open after {count} runs"
+            same = results == expected if start + batch >= num_pages else "-"
+            print(f"{count:4} segments, {engine.segments.num_documents:6} documents: {latency(times)}, same results as one run: {same}")
+    print(f"Runs of {batch} pages: {sum(runs) / len(runs):6.2f}s on average until searchable")
+
+    start = time.perf_counter()
+    with redirect_stdout(io.StringIO()):
+        merge_tiers(folder / "indices")
+    merged = time.perf_counter() - start
+    results, times = search_all(engine, queries)
+    assert results == expected, "Merged segments returned different results"
+    print(f"Merged by tier into {len(engine.segments)} segments in {merged:6.2f}s: {latency(times)}, same results as one run: True")
+
+    # Changed pages are saved again with a word of their body swapped, and recorded in the change list as the crawler does.
+    writer, changes = PageStoreWriter(pages), ChangeLog(pages)
+    refs = [relative(ref) for ref, _ in PageStoreReader(pages).refs()]
+    old_refs = set()
+    for i in rng.sample(range(num_pages), num_changed):
+        url, html = documents[i]
+        changes.append(url, relative(writer.write(url, html.replace("<p>", "<p>segmentedindexbenchmark ", 1))), refs[i])
+        old_refs.add(refs[i])
+    writer.close()
+    changes.close()
+
+    incremental = index(folder, restart=False)
+    found = [path for path, _, _ in engine.search("segmentedindexbenchmark")]
+    results, _ = search_all(engine, queries)
+    stale = sum(path in old_refs for paths in results.values() for path in paths)
+    print(f"{num_changed} changed pages searchable in {incremental:6.2f}s as a new segment, {len(found)} of them found by their new word, "
+          f"{stale} old versions in results, {engine.segments.num_documents} documents")
+    # Merging every segment drops the tombstoned pages, and leaves the same index as rebuilding it.
+    start = time.perf_counter()
+    merge_all(folder / "indices")
+    merged = time.perf_counter() - start
+    merged_results, _ = search_all(engine, queries)
+
+    rebuild = index(folder, restart=True)
+    with redirect_stdout(io.StringIO()):
+        engine = SearchEngine(index_folder=folder / "indices")
+    rebuilt, _ = search_all(engine, queries)
+    # Tombstoned pages still count towards the number of pages with each token until they are merged away, which can reorder close results.
+    same = sum(rebuilt[query] == results[query] for query in queries)
+    print(f"Rebuilding the index took {rebuild:6.2f}s, same results as with the new segment for {same} of {len(queries)} queries, "
+          f"and as after merging every segment in {merged:6.2f}s for {sum(rebuilt[query] == merged_results[query] for query in queries)}")
+    shutil.rmtree(folder)
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--pages", type=int, default=2000)
+    parser.add_argument("--batch", type=int, default=100)
+    parser.add_argument("--changed", type=int, default=5)
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+    main(args.pages, args.batch, args.changed, args.queries)
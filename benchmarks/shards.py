@@ -0,0 +1,104 @@
+""" Measures the latency of searching an index split into a number of shards, each searched by a process of its own,
+and checks that every number of shards gives the results of one index.
+
+The corpus is indexed with the indexer into a temporary folder once for each number of shards. Shards are searched
+in processes of their own, and again in this process as stand-ins, where each shard's work is timed on its own. The
+critical path of a query is its time with each step of the shards taking as long as the slowest shard's, which is how
+long it would take with a core for every shard, so it shows how a search scales past the cores this machine has.
+
+Usage: python -m benchmarks.shards [--pages 2000] [--queries 1000] [--shards 1 2 4 8]
+"""
+from argparse import ArgumentParser
+from benchmarks.corpus import Corpus
+from contextlib import redirect_stdout
+from inverted_indexer.indexer import InvertedIndex
+from start_search_engine import SearchEngine
+from statistics import quantiles
+from typing import Dict, List, Tuple
+from pathlib import Path
+import tempfile
+import shutil
+import random
+import time
+import io
+
+def latency(times: List[float]) -> str:
+    p50, p99 = (quantiles(times, n=100)[i] for i in (49, 98))
+    return f"p50 {p50 * 1000:6.2f}ms, p99 {p99 * 1000:7.2f}ms"
+
+def timed(method, times: Dict[Tuple[str, int], float], key: Tuple[str, int]):
+    """ Wraps a method of a shard's search engine to record how long each call took. """
+    def call(*args):
+        start = time.perf_counter()
+        try:
+            return method(*args)
+        finally:
+            times[key] = time.perf_counter() - start
+    return call
+
+def replay(engine: SearchEngine, queries: List[str]) -> List[float]:
+    times = []
+    for query in queries:
+        start = time.perf_counter()
+        engine.find(query)
+        times.append(time.perf_counter() - start)
+    return times
+
+def critical_path(engine: SearchEngine, queries: List[str]) -> List[float]:
+    """ Returns the time of each query, counting only the slowest shard of each step, for a search engine with stand-in shards. """
+    shard_times: Dict[Tuple[str, int], float] = {}
+    for i, shard in enumerate(engine.shards):
+        for method in ("statistics", "rank"):
+            setattr(shard.engine, method, timed(getattr(shard.engine, method), shard_times, (method, i)))
+    times = []
+    for query in queries:
+        shard_times.clear()
+        start = time.perf_counter()
+        engine.find(query)
+        elapsed = time.perf_counter() - start
+        slowest = sum(max((t for (method, _), t in shard_times.items() if method == step), default=0) for step in ("statistics", "rank"))
+        times.append(elapsed - sum(shard_times.values()) + slowest)
+    return times
+
+def main(num_pages, num_queries, shard_counts):
+    folder = Path(tempfile.mkdtemp())
+    corpus = Corpus(num_pages)
+    corpus.write_segments(folder / "pages")
+
+    rng = random.Random(0)
+    queries = [" ".join(corpus.words(rng, rng.randint(1, 3))) for _ in range(num_queries)]
+    queries = [f'"{query}"' if " " in query and rng.random() < 0.2 else query for query in queries]
+    print(f"{num_pages} pages, {num_queries} queries")
+
+    expected = None
+    for num_shards in shard_counts:
+        with redirect_stdout(io.StringIO()):
+            indexer = InvertedIndex(folder / "pages", restart=True, num_workers=2, num_shards=num_shards, index_folder=folder / "indices")
+            indexer.start()
+            indexer.merger.join()
+
+        # The results cache is left out, so every query is searched. The queries are searched once before they are timed.
+        results = {}
+        for processes in (True, False):
+            engine = SearchEngine(results_cache=0, index_folder=folder / "indices", processes=processes)
+            results[processes] = [engine.find(query) for query in queries]
+            times = replay(engine, queries)
+            line = f"{num_shards} shard(s), {'processes' if processes else 'stand-ins'}: {latency(times)}"
+            if not processes:
+                line += f", critical path {latency(critical_path(engine, queries))}"
+            print(line)
+            engine.close()
+
+        expected = expected or results[True]
+        same = results[True] == expected and results[False] == expected
+        print(f"{num_shards} shard(s), same results as {shard_counts[0]} shard(s): {same}")
+        assert same, f"Searching {num_shards} shards gave different results"
+    shutil.rmtree(folder)
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--pages", type=int, default=2000)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4, 8])
+    args = parser.parse_args()
+    main(args.pages, args.queries, args.shards)
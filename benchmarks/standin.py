@@ -0,0 +1,132 @@
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from configparser import ConfigParser
+from threading import Thread
+from pathlib import Path
+from typing import Dict, List, Set, Tuple
+import subprocess
+import tempfile
+import time
+import ssl
+import os
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """ Serves a synthetic site where page i links to pages 2i+1 and 2i+2 and to the same page on the next host.
+    Pages have an ETag, and can be changed, touched (given a new ETag without changing) or deleted.
+    """
+    protocol_version = "HTTP/1.1"  # Keep connections alive between requests.
+
+    def do_GET(self):
+        server: StandInServer = self.server.standin
+        time.sleep(server.latency)
+        if not self.path.startswith("/p/"):
+            self.send_error(404)
+            return
+        page = int(self.path[3:])
+        key = (self.server.server_port, page)
+        if key in server.deleted:
+            self.send_error(404)
+            return
+        version, etag_version = server.versions.get(key, (0, 0))
+        etag = f'"{page}-{version}-{etag_version}"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        links = [f"/p/{child}" for child in (2 * page + 1, 2 * page + 2) if child < server.pages_per_host]
+        links.append(f"{server.next_host(self.server.server_port)}/p/{page}")
+
+        words = " ".join(server.words[(page + version + i) % len(server.words)] for i in range(server.words_per_page))
+        body = (
+            f"<html><head><title>Page {page}</title></head><body><h1>Page {page}</h1><p>{words}</p>"
+            + "".join(f'<a href="{link}">{link}</a>' for link in links)
+            + "</body></html>"
+        ).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class StandInServer:
+    """ A local HTTPS stand-in for a set of hosts, one server per port.
+
+    The crawler normalizes every url to https, so the servers use a self-signed certificate
+    that is trusted through the REQUESTS_CA_BUNDLE and SSL_CERT_FILE environment variables.
+    These are read when the default certificates are first loaded, so crawlers should run
+    in processes spawned after start().
+    """
+
+    def __init__(self, num_hosts=20, pages_per_host=50, latency=0.02, words_per_page=300):
+        self.num_hosts = num_hosts
+        self.pages_per_host = pages_per_host
+        self.latency = latency  # Seconds the server waits before responding, standing in for network delay.
+        self.words_per_page = words_per_page
+        self.words = [f"word{i}" for i in range(1000)]
+        self.folder = tempfile.TemporaryDirectory()
+        self.servers: List[ThreadingHTTPServer] = []
+        self.versions: Dict[Tuple[int, int], Tuple[int, int]] = {}   # The content and ETag version of each (port, page).
+        self.deleted: Set[Tuple[int, int]] = set()
+
+    @property
+    def total_pages(self) -> int:
+        return self.num_hosts * self.pages_per_host
+
+    @property
+    def seed_urls(self) -> List[str]:
+        return [f"https://127.0.0.1:{server.server_port}/p/0" for server in self.servers]
+
+    @property
+    def pages(self) -> List[Tuple[int, int]]:
+        return [(server.server_port, page) for server in self.servers for page in range(self.pages_per_host)]
+
+    def change(self, page: Tuple[int, int]) -> None:
+        version, etag_version = self.versions.get(page, (0, 0))
+        self.versions[page] = (version + 1, etag_version)
+
+    def touch(self, page: Tuple[int, int]) -> None:
+        version, etag_version = self.versions.get(page, (0, 0))
+        self.versions[page] = (version, etag_version + 1)
+
+    def next_host(self, port: int) -> str:
+        ports = [server.server_port for server in self.servers]
+        return f"https://127.0.0.1:{ports[(ports.index(port) + 1) % len(ports)]}"
+
+    def create_certificate(self) -> ssl.SSLContext:
+        cert, key = Path(self.folder.name) / "cert.pem", Path(self.folder.name) / "key.pem"
+        subprocess.run([
+            "openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+            "-keyout", str(key), "-out", str(cert), "-subj", "/CN=127.0.0.1", "-addext", "subjectAltName=IP:127.0.0.1"
+        ], check=True, capture_output=True)
+        os.environ["REQUESTS_CA_BUNDLE"] = os.environ["SSL_CERT_FILE"] = str(cert)
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(cert, key)
+        return context
+
+    def start(self) -> None:
+        context = self.create_certificate()
+        for _ in range(self.num_hosts):
+            server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+            server.daemon_threads = True
+            server.socket = context.wrap_socket(server.socket, server_side=True, do_handshake_on_connect=False)  # Handshake in the handler thread.
+            server.standin = self
+            self.servers.append(server)
+            Thread(target=server.serve_forever, daemon=True).start()
+
+    def stop(self) -> None:
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+        self.folder.cleanup()
+
+def crawler_config(seed_urls: List[str], save_file: str, time_delay=0.0) -> ConfigParser:
+    """ Returns a crawler config that seeds every stand-in host. An empty root domain allows every host. """
+    cparser = ConfigParser()
+    cparser["IDENTIFICATION"] = {"USERAGENT": "BENCHMARK_CRAWLER"}
+    cparser["CRAWLER"] = {"SEEDURL": ",".join(seed_urls), "ROOTDOMAINS": "", "POLITENESS": str(time_delay)}
+    cparser["LOCAL PROPERTIES"] = {"SAVE": save_file}
+    return cparser
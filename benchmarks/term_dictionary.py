@@ -0,0 +1,129 @@
+""" Compares loading the index of the index and the index of crawled into dicts against opening them with mmap,
+in the time a fresh search engine process takes to be ready, its memory, and the time per lookup.
+
+The dictionaries are synthetic: unigrams and bigrams of generated words, with made-up offsets, at the size of
+the given number of terms and documents and at a multiple of it. Cold starts drop the page cache first, which
+needs root; otherwise they are reported with a warm cache.
+
+Usage: python -m benchmarks.term_dictionary [--terms 1000000] [--docs 55000] [--scale 20]
+"""
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from benchmarks.corpus import generate_vocabulary
+from shared.dictionary import DICTIONARY_FILE, OFFSETS_FILE, OffsetTable, TermDictionary, TermDictionaryWriter
+from typing import Dict, List
+from pathlib import Path
+import tempfile
+import random
+import time
+import os
+
+def write_dictionaries(folder: Path, num_terms: int, num_docs: int, seed=0) -> List[str]:
+    """ Writes both versions of both dictionaries, returning a sample of the terms. Terms are generated in order. """
+    rng = random.Random(seed)
+    # The generated words run out at around 160,000, so larger dictionaries have more bigrams per word.
+    vocabulary = generate_vocabulary(min(100000, max(1, num_terms // 10)), rng)
+    bigrams = num_terms // len(vocabulary) - 1
+    sample, count, offset = [], 0, 0
+    dictionary = TermDictionaryWriter(folder / DICTIONARY_FILE)
+    with open(folder / "index_of_index.txt", "w") as text:
+        for word in vocabulary:
+            # A bigram sorts after its first word and before any longer word starting with it, since " " sorts before letters.
+            terms = [word] + [f"{word} {second}" for second in sorted(set(rng.sample(vocabulary, min(len(vocabulary), rng.randint(0, 2 * bigrams)))))]
+            for term in terms:
+                text.write(f"{term},{offset}\n")
+                dictionary.add(term, offset)
+                if rng.random() < 0.001:
+                    sample.append(term)
+                offset += rng.randint(20, 2000)
+                count += 1
+    dictionary.close()
+
+    offsets = OffsetTable(folder / OFFSETS_FILE, writable=True)
+    with open(folder / "index_of_crawled.txt", "w") as text:
+        position = 0
+        for id in range(num_docs):
+            text.write(f"{id},{position}\n")
+            offsets[id] = position
+            position += rng.randint(80, 300)
+    offsets.close()
+    print(f"{count} terms and {num_docs} documents: text {sum(os.path.getsize(folder / file) for file in ('index_of_index.txt', 'index_of_crawled.txt')) / 1e6:.1f}MB, "
+          f"binary {sum(os.path.getsize(folder / file) for file in (DICTIONARY_FILE, OFFSETS_FILE)) / 1e6:.1f}MB")
+    return sample
+
+def rss() -> int:
+    """ Returns the resident memory of this process in bytes. """
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) * 1024
+    return 0
+
+def read_index_files(path: Path) -> Dict[str, int]:
+    """ The search engine's original loading, which read each file into a dict. """
+    index_dict = {}
+    with open(path, "r") as file:
+        for line in file:
+            key, position = line.split(",")
+            index_dict[key] = int(position)
+    return index_dict
+
+def open_search_engine(folder: Path, loader: str, terms: List[str], num_docs: int) -> Dict:
+    """ Runs in a fresh process: loads both dictionaries the way the search engine would, then looks up terms and documents. """
+    before = rss()
+    start = time.perf_counter()
+    if loader == "dict":
+        index_of_index = read_index_files(folder / "index_of_index.txt")
+        index_of_crawled = read_index_files(folder / "index_of_crawled.txt")
+        doc_key = str
+    else:
+        index_of_index = TermDictionary(folder / DICTIONARY_FILE)
+        index_of_crawled = OffsetTable(folder / OFFSETS_FILE)
+        doc_key = int
+    ready = time.perf_counter() - start
+    ready_rss = rss() - before
+
+    rng = random.Random(1)
+    docs = [doc_key(rng.randrange(num_docs)) for _ in range(len(terms))]
+    start = time.perf_counter()
+    for term, doc in zip(terms, docs):
+        assert index_of_index.get(term) is not None and index_of_crawled.get(doc) is not None
+    lookup = (time.perf_counter() - start) / len(terms)
+    # Pages of a memory-mapped file count towards the process once they are read, but are shared with the page cache.
+    return {"ready": ready, "lookup": lookup, "ready_rss": ready_rss, "rss": rss() - before}
+
+def drop_caches() -> bool:
+    try:
+        os.sync()
+        with open("/proc/sys/vm/drop_caches", "w") as f:
+            f.write("3")
+        return True
+    except OSError:
+        return False
+
+def main(num_terms, num_docs, scale):
+    for multiple in (1, scale):
+        folder = tempfile.TemporaryDirectory()
+        terms = write_dictionaries(Path(folder.name), num_terms * multiple, num_docs * multiple)
+        for loader in ("dict", "mmap"):
+            results = []
+            for cold in (True, False):
+                dropped = drop_caches() if cold else False
+                with ProcessPoolExecutor(1, mp_context=get_context("spawn")) as pool:
+                    result = pool.submit(open_search_engine, Path(folder.name), loader, terms, num_docs * multiple).result()
+                cache = "cold" if dropped else "warm"
+                results.append(
+                    f"{cache} {result['ready'] * 1000:8.1f}ms and {result['ready_rss'] / 1e6:6.1f}MB ready, "
+                    f"{result['lookup'] * 1e6:5.1f}us/lookup, {result['rss'] / 1e6:6.1f}MB after {len(terms)} lookups"
+                )
+            print(f"  {loader:>4}: {results[0]} | {results[1]}")
+        folder.cleanup()
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--terms", type=int, default=1000000, help="Approximate number of terms in the index")
+    parser.add_argument("--docs", type=int, default=55000)
+    parser.add_argument("--scale", type=int, default=20, help="Multiple of the index size to measure as well")
+    args = parser.parse_args()
+    main(args.terms, args.docs, args.scale)
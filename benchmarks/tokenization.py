@@ -0,0 +1,82 @@
+""" Compares the indexer's tokenization of a page, tokenizing each field once with cached stems, against tokenizing
+each field twice as before, in CPU time per page, and checks that both give the same postings and field lengths.
+
+The old way tokenized the visible text, headings and title of a page twice each, once stemmed with a new stemmer.
+Both ways are given the fields of each page as the crawler parses them, which are taken beforehand. The stem cache is
+cleared before the new way runs.
+
+Usage: python -m benchmarks.tokenization [--pages 1000] [--source pages/]
+"""
+from argparse import ArgumentParser
+from benchmarks.corpus import Corpus, read_pages
+from nltk.stem import PorterStemmer
+from shared.parser import ParsedPage
+from shared.posting import Posting
+from shared.postings import encode_positions, pack_fields
+from shared.tokenizer import stem
+from typing import Callable, Dict, List, Tuple
+import time
+import re
+
+def tokenize_with_positions(text: List[str], stem=False) -> Dict[str, List[int]]:
+    stemmer = PorterStemmer()
+    positions: Dict[str, List[int]] = {}
+    position = 0
+    for string in text:
+        tokens: List[str] = [token.lower() for token in re.findall(r'\b[a-zA-Z0-9]+\b', string) if not token.isnumeric() or len(token) <= 4]
+        if stem:
+            tokens = [stemmer.stem(token) for token in tokens]
+        for token in tokens:
+            positions.setdefault(token, []).append(position)
+            position += 1
+        position += 1
+    return positions
+
+def count_tokens(text: List[str]) -> Tuple[Dict[str, List[int]], int]:
+    positions = tokenize_with_positions(text)
+    length = sum(len(token_positions) for token_positions in positions.values())
+    for token, token_positions in tokenize_with_positions(text, stem=True).items():
+        if token not in positions:
+            positions[token] = token_positions
+    return positions, length
+
+def old_postings(text: List[str], headings: List[str], title: str, id: int) -> Tuple[Dict[str, Posting], Tuple[int, int, int]]:
+    """ Posting.get_postings as it was, tokenizing the text of each field twice. """
+    fields, lengths = zip(*(count_tokens(field) for field in (text, headings, [title])))
+    tokens = set().union(*fields)
+    return {token: Posting(id, pack_fields([len(field.get(token, ())) for field in fields]), encode_positions(fields[0].get(token, ()))) for token in tokens}, lengths
+
+def measure(get_postings: Callable, pages: List[ParsedPage]) -> Tuple[float, List]:
+    """ Returns the CPU milliseconds per page, and the postings and lengths of each page. """
+    start = time.process_time()
+    results = [get_postings(page.text, page.headings, page.title, id) for id, page in enumerate(pages)]
+    return (time.process_time() - start) / len(pages) * 1000, results
+
+def comparable(results: List) -> List:
+    return [({token: (posting.value, posting.positions) for token, posting in postings.items()}, tuple(lengths)) for postings, lengths in results]
+
+def main(num_pages, source):
+    pages = read_pages(source, num_pages) if source else list(Corpus(num_pages))
+    print(f"{len(pages)} pages, {sum(len(html) for _, html in pages) / len(pages) / 1000:.1f}KB on average")
+    start = time.process_time()
+    parsed = [ParsedPage(html.encode(), url) for url, html in pages]
+    print(f"{'parsing':>30}: {(time.process_time() - start) / len(pages) * 1000:6.2f}ms cpu/page")
+
+    old_time, old_results = measure(old_postings, parsed)
+    stem.cache_clear()
+    new_time, new_results = measure(Posting.get_postings, parsed)
+    cache = stem.cache_info()
+    warm_time, _ = measure(Posting.get_postings, parsed)
+    print(f"{'twice, new stemmer':>30}: {old_time:6.2f}ms cpu/page")
+    print(f"{'once, cached stems':>30}: {new_time:6.2f}ms cpu/page, {warm_time:6.2f}ms with every stem cached, "
+          f"{cache.hits / max(1, cache.hits + cache.misses):.1%} of stems cached the first time, {cache.currsize} stems")
+    same = comparable(old_results) == comparable(new_results)
+    print(f"Same postings and lengths for every page: {same}")
+    assert same, "The tokenizers gave different postings"
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--pages", type=int, default=1000)
+    parser.add_argument("--source", type=str, default=None, help="A crawler pages folder to read pages from instead of the synthetic corpus")
+    args = parser.parse_args()
+    main(args.pages, args.source)
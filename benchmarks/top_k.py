@@ -0,0 +1,81 @@
+""" Compares the search engine's top k with Block-Max WAND against decoding and adding up every posting, in latency
+and postings decoded, and checks both give the same results for every query.
+
+The corpus is indexed with the indexer into a temporary folder. Queries are one to three words picked by frequency
+from the corpus, tokenized by the search engine.
+
+Usage: python -m benchmarks.top_k [--pages 5000] [--queries 300]
+"""
+from argparse import ArgumentParser
+from benchmarks.corpus import Corpus
+from inverted_indexer.indexer import InvertedIndex
+from shared.postings import PostingsList
+from shared.segments import Segment
+from shared.topk import score_all, top_k
+from start_search_engine import SearchEngine
+from statistics import mean, quantiles
+from typing import List
+from pathlib import Path
+import contextlib
+import tempfile
+import random
+import time
+import io
+
+decoded = 0                                 # Postings decoded so far, counted by wrapping PostingsList.block.
+decode_block = PostingsList.block
+
+def counting_block(self, block):
+    global decoded
+    ids, values = decode_block(self, block)
+    decoded += len(ids)
+    return ids, values
+
+def query_postings(engine: SearchEngine, segment: Segment, query: str) -> List[PostingsList]:
+    """ The postings the search engine would score for the query. """
+    return list(engine.get_postings(segment, engine.tokenize(query)).values())
+
+def main(num_pages, num_queries):
+    folder = tempfile.TemporaryDirectory()
+    corpus = Corpus(num_pages)
+    corpus.write_segments(Path(folder.name) / "pages")
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        indexer = InvertedIndex(Path(folder.name) / "pages", restart=True, num_workers=2, index_folder=Path(folder.name) / "indices")
+        indexer.start()
+        indexer.merger.join()
+    print(f"Indexed {num_pages} pages in {time.perf_counter() - start:.1f}s")
+
+    engine = SearchEngine(index_folder=Path(folder.name) / "indices")
+    segment = next(iter(engine.segments))       # A new index is one segment.
+    rng = random.Random(0)
+    queries = [" ".join(corpus.words(rng, rng.randint(1, 3))) for _ in range(num_queries)]
+    queries = [(query, postings, engine.ranking.scorers(postings, segment.lengths)) for query in queries if (postings := query_postings(engine, segment, query))]
+    PostingsList.block = counting_block
+    global decoded
+    for k in (5, 10, 100):
+        times = {"exhaustive": [], "wand": []}
+        counts = {"exhaustive": 0, "wand": 0}
+        for query, postings, scorers in queries:
+            results = []
+            for name, method in (("exhaustive", score_all), ("wand", top_k)):
+                decoded = 0
+                start = time.perf_counter()
+                results.append(method(postings, scorers, k))
+                times[name].append(time.perf_counter() - start)
+                counts[name] += decoded
+            assert results[0] == results[1], f"Different top {k} for {query!r}: {results[0]} and {results[1]}"
+        for name in times:
+            p50, p95 = (quantiles(times[name], n=100)[i] for i in (49, 94))
+            print(f"k={k:<3} {name:>10}: mean {mean(times[name]) * 1000:7.3f}ms, p50 {p50 * 1000:7.3f}ms, p95 {p95 * 1000:7.3f}ms, "
+                  f"{counts[name] / len(queries):9.1f} postings decoded per query")
+    PostingsList.block = decode_block
+    print(f"Same results for all {len(queries)} queries.")
+    folder.cleanup()
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--pages", type=int, default=5000)
+    parser.add_argument("--queries", type=int, default=300)
+    args = parser.parse_args()
+    main(args.pages, args.queries)
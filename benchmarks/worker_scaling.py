@@ -0,0 +1,54 @@
+""" Measures how indexing scales with the number of worker processes, with documents sent to workers and results sent
+back one at a time as before, and in bounded chunks.
+
+The corpus is indexed with the indexer into a temporary folder. Pages are short by default, so the cost of sending
+each document and its results between processes shows. Sending one document at a time is done by setting the chunk
+size to 1 and leaving the input queue unbounded, as every document was queued up front before. The CPU time of the
+main process is the time spent queuing documents and saving results.
+
+Usage: python -m benchmarks.worker_scaling [--pages 2000] [--words 100] [--workers 1 2 4 8 16 32]
+"""
+from argparse import ArgumentParser
+from benchmarks.corpus import Corpus
+from contextlib import redirect_stdout
+from inverted_indexer import indexer
+from inverted_indexer.indexer import InvertedIndex
+from typing import List, Tuple
+from pathlib import Path
+import tempfile
+import shutil
+import time
+import io
+import os
+
+def build(pages: Path, num_workers: int, chunk_size: int, queue_chunks: int) -> Tuple[float, float]:
+    """ Indexes the pages, returning the seconds taken until the index is saved and the CPU seconds of the main process. """
+    indexer.CHUNK_SIZE, indexer.QUEUE_CHUNKS = chunk_size, queue_chunks
+    start, cpu = time.perf_counter(), time.process_time()
+    with redirect_stdout(io.StringIO()):
+        index = InvertedIndex(pages, restart=True, num_workers=num_workers, index_folder=pages.parent / "indices")
+        index.merge_segments = lambda: None
+        index.start()
+    return time.perf_counter() - start, time.process_time() - cpu
+
+def main(num_pages: int, words: int, counts: List[int]):
+    folder = Path(tempfile.mkdtemp())
+    Corpus(num_pages, words_per_page=words).write_segments(folder / "pages")
+    print(f"{num_pages} pages of {words} words, {os.cpu_count()} CPUs")
+    defaults = indexer.CHUNK_SIZE, indexer.QUEUE_CHUNKS
+    for num_workers in counts:
+        line = []
+        for name, chunk_size, queue_chunks in (("one at a time", 1, 0), (f"chunks of {defaults[0]}", *defaults)):
+            elapsed, cpu = build(folder / "pages", num_workers, chunk_size, queue_chunks)
+            line.append(f"{name} {num_pages / elapsed:6.1f} documents/s ({cpu:5.2f}s main CPU)")
+        print(f"{num_workers:3} workers: " + ", ".join(line))
+    indexer.CHUNK_SIZE, indexer.QUEUE_CHUNKS = defaults
+    shutil.rmtree(folder)
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--pages", type=int, default=2000)
+    parser.add_argument("--words", type=int, default=100)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    args = parser.parse_args()
+    main(args.pages, args.words, args.workers)
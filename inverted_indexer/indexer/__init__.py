@@ -1,43 +1,77 @@
 from multiprocessing import Process, Queue, Value
-from typing import Set, List, Tuple, TextIO
+from queue import Full
+from threading import Thread
+from typing import Dict, Iterator, Set, List, Tuple, TextIO
 from pathlib import Path
-from inverted_indexer.indexer.worker import Worker
-import platform
+from inverted_indexer.indexer.worker import MEMORY_BUDGET, Worker
+from shared.pagestore import ChangeLog, PageStoreReader
+from shared.simhash import SimHashIndex
+from inverted_indexer.indexer.merge import combine, merge_range, merge_shards, split_ranges
+from concurrent.futures import ProcessPoolExecutor
+from shared.dictionary import LENGTHS_FILE, LengthTable, write_lengths
+from shared.documents import DOCS_FILE, RECORDS_FILE, DocTable
+from shared.segments import Manifest
+from shared.shards import shard_folder, shard_folders
 import shutil
-import math
 import os
 		
-OS_WINDOWS = platform.system() == "Windows"		# Flag for if OS is Windows.
+CHUNK_SIZE = 32									# Number of documents sent to a worker at once. Workers send back the results of a chunk together.
+QUEUE_CHUNKS = 4								# Number of chunks waiting in the input queue for each worker, so the whole corpus is not queued up front.
 
 class InvertedIndex:
-	def __init__(self, source: Path, restart=True, num_workers=1) -> None:
+	def __init__(self, source: Path, restart=True, num_workers=1, memory_budget=MEMORY_BUDGET, num_shards=1, index_folder: Path = None, partial_folder: Path = None) -> None:
 		parent = Path(__file__).parent.parent
 		self.source = source                      		                # Folder path containg documents to index.
-		self.index_folder = parent / Path("indices")					# Folder path for indices.
-		self.partial_index_folder = parent / Path("partial_indices")	# Folder path for partial indices.
-		self.index_save_path = Path("index.txt")        		# File path for inverted index.
-		self.crawled_save_path = Path("crawled.txt")    		# File path for names of crawled files.
+		self.index_folder = Path(index_folder or parent / "indices")	# Folder path for indices.
+		self.partial_index_folder = Path(partial_folder or self.index_folder.parent / "partial_indices")	# Folder path for partial indices, beside the indices.
+		self.fingerprints_save_path = Path("fingerprints.txt")	# File path for the SimHash fingerprint of each crawled file.
+
+		# Pages are split into shards by their domain, each indexed into its own folder, with its own partial indices.
+		# One shard is indexed into the index folder itself.
+		self.num_shards = max(1, num_shards)
+		self.shard_indices = [shard_folder(self.index_folder, shard, self.num_shards) for shard in range(self.num_shards)]
+		self.shard_partials = [shard_folder(self.partial_index_folder, shard, self.num_shards) for shard in range(self.num_shards)]
 
 		self.workers: List[Process] = []				# List of worker processes.
 		self.num_workers = max(1, min(100, num_workers))
+		self.memory_budget = memory_budget				# Bytes of postings each worker holds in memory before writing a partial index.
 		self.finished_workers = 0						# The number of workers that finished processing.
-		self.q_in: Queue[Tuple[str, int]] = Queue()		# Queue storing tuples of (file_path, doc_id) for workers to tokenize and process.
-		self.q_out: Queue[Tuple[str, int]] = Queue()	# Queue storing tuples of (file_path, doc_id, title) for the main process to save to file.
+		self.q_in: Queue[List[Tuple[str, int]]] = Queue(QUEUE_CHUNKS * self.num_workers)	# Queue storing chunks of (file_path, doc_id) for workers to tokenize and process.
+		self.q_out: Queue[List[Tuple]] = Queue()		# Queue storing lists of (doc_id, file_path, url, title, ...) for the main process to save to file.
+		self.feeder: Thread = None						# Thread putting chunks of documents in the input queue as workers take them.
 		self.running = Value("i", 1)					# Flag to indicate to workers whether to keep working or not.
 		
 		self.crawled: Set[str] = set()				# Set of crawled files to keep track of which files don't need to be crawled again.
-		self.crawled_file: TextIO = None			# File to the crawled save file.
-		self.index_of_crawled_file: TextIO = None	# File to the index of the crawled save file.
-
-		# If the restart flag was selected or the crawled save file doesn't exist, start indexing from nothing. Otherwise, read the crawled save file.
-		if restart or not Path(f"{self.index_folder}/{self.crawled_save_path}").exists():
+		self.superseded: Set[int] = set()			# Ids of indexed documents that were changed or deleted by a later crawl.
+		self.duplicates: Set[int] = set()			# Ids of indexed documents that are near-duplicates of an earlier document.
+		self.fingerprints: SimHashIndex = None		# Fingerprints of the documents kept in the index, shared by every worker.
+		self.new_fingerprints: List[Tuple[int, int]] = []	# Ids and fingerprints of the documents indexed in this run, checked for near-duplicates when saving.
+		self.documents: List[DocTable] = []			# Path, url, title and text extract of each document indexed, for each shard.
+		self.lengths: List[LengthTable] = []		# Number of words in each field of each document indexed since the last segment was written, for each shard.
+		self.fingerprints_file: TextIO = None		# File to the fingerprints save file.
+		self.merger: Process = None					# Process merging the segments of the index in the background.
+
+		# If the restart flag was selected or the document table doesn't exist, start indexing from nothing. Otherwise, read the document table.
+		if restart or not self.check_shards():
 			self.create_save_files()
 		else:
 			self.read_save_files()
 
-		# Open the crawled save file and the index for it. These can be written into while the workers are working.
-		self.crawled_file = open(f"{self.index_folder}/{self.crawled_save_path}", "a", encoding="utf-8")
-		self.index_of_crawled_file = open(f"{self.index_folder}/index_of_{self.crawled_save_path}", "a", encoding="utf-8")
+		# Open the document table of each shard. They can be written into while the workers are working.
+		for folder in self.shard_partials:
+			os.makedirs(folder, exist_ok=True)
+		self.documents = [DocTable(folder, writable=True) for folder in self.shard_indices]
+		self.lengths = [LengthTable(folder / LENGTHS_FILE, writable=True) for folder in self.shard_partials]
+		self.fingerprints_file = open(f"{self.index_folder}/{self.fingerprints_save_path}", "a", encoding="utf-8")
+
+	def check_shards(self) -> bool:
+		""" Returns whether there is an index to add to. An index split into another number of shards can't be added to. """
+		shards = len(shard_folders(self.index_folder))
+		if not shards and not (self.index_folder / DOCS_FILE).exists():
+			return False
+		if shards != (self.num_shards if self.num_shards > 1 else 0) or not (self.shard_indices[0] / DOCS_FILE).exists():
+			raise ValueError(f"The index in {self.index_folder} has {shards or 1} shard(s), not {self.num_shards}. Index with --restart to split it again.")
+		return True
 
 	def create_save_files(self):
 		""" Initializes the directory for partial indices, and creates new save files. """
@@ -48,24 +82,62 @@ class InvertedIndex:
 				shutil.rmtree(folder)
 			os.makedirs(folder)
 
-		# Open a new file for the crawled save file, and a new index file for it.
-		for file in (f"{self.index_folder}/{self.crawled_save_path}", f"{self.index_folder}/index_of_{self.crawled_save_path}"):
+		# Open new files for the document table and its records of each shard, and the fingerprints save file.
+		for folder in self.shard_indices:
+			os.makedirs(folder, exist_ok=True)
+		for file in (*(folder / name for folder in self.shard_indices for name in (DOCS_FILE, RECORDS_FILE)), f"{self.index_folder}/{self.fingerprints_save_path}"):
 			with open(file, "w"):
 				pass
 
 	def read_save_files(self) -> None:
-		""" Read the crawled save file to get the pages that have already been crawled. """
+		""" Read the document table to get the pages that have already been crawled. """
 		
-		# Each line of the crawled save file is a file path for a document already crawled.
-		with open(f"{self.index_folder}/{self.crawled_save_path}", "r", encoding="utf-8") as file:
-			for file_path in file:
-				if file_path.startswith(self.source.name):
-					self.crawled.add(file_path.strip())
+		# Each document in the table of each shard has the file path of a page already crawled.
+		for folder in self.shard_indices:
+			documents = DocTable(folder)
+			for _, document in documents:
+				if document.path.startswith(self.source.name):
+					self.crawled.add(document.path)
+			documents.close()
+
+	def load_fingerprints(self) -> None:
+		""" Rebuilds the fingerprints of the documents indexed before, once the superseded documents are known.
+		Fingerprints are added in the order of their ids, so each document is checked against the same earlier documents
+		as before, unless the document it duplicated has since been superseded.
+		"""
+		self.fingerprints = SimHashIndex()
+		path = Path(f"{self.index_folder}/{self.fingerprints_save_path}")
+		if not path.exists():
+			return
+
+		# Each line of the fingerprints save file is of the form <id>,<fingerprint>, in the order workers sent them back.
+		with open(path, "r", encoding="utf-8") as file:
+			for id, fingerprint in sorted(tuple(map(int, line.split(","))) for line in file):
+				if id not in self.superseded:
+					self.check_duplicate(id, fingerprint)
+
+	def check_new_duplicates(self) -> int:
+		""" Checks the documents indexed in this run for near-duplicates in the order of their ids, whichever worker finished first.
+		Returns the number of near-duplicates found among them.
+		"""
+		before = len(self.duplicates)
+		for id, fingerprint in sorted(self.new_fingerprints):
+			self.check_duplicate(id, fingerprint)
+		self.new_fingerprints = []
+		return len(self.duplicates) - before
+
+	def check_duplicate(self, id: int, fingerprint: int) -> None:
+		""" Adds the document's fingerprint, or marks it as a duplicate if an earlier document is nearly the same. """
+		if fingerprint and self.fingerprints.add(fingerprint, id) is not None:
+			self.duplicates.add(id)
+
 	def start(self) -> None:
 		""" Starts indexing. """
 		try:
 			self.spawn_processes()		
-			self.enqueue_documents()	# Documents get enqueued for workers to process
+			documents = self.find_documents()
+			self.feeder = Thread(target=self.enqueue_documents, args=(documents,), daemon=True)
+			self.feeder.start()			# Documents get enqueued for workers to process, as fast as the workers take them.
 			self.dequeue_documents()	# Documents that finished processing get saved to file.
 		except KeyboardInterrupt:
 			pass
@@ -73,15 +145,29 @@ class InvertedIndex:
 		self.running.value = 0			# Signal to workers to stop working.
 		self.dequeue_documents()		# Output queue needs to be empty for workers to exit.
 		self.join_workers()				# Join workers first to free up resources.
+		if self.feeder:
+			self.feeder.join()			# The feeder stops once it sees the workers stopping.
 		self.empty_input_queue()		# Input queue needs to be empty for the main process to exit.
 		self.save_to_file()
-		self.index_index()
+		self.close()
+		self.merge_segments()
+
+	def close(self) -> None:
+		""" Closes the save files, so everything written to them is in the files. """
+		for file in (*self.documents, *self.lengths, self.fingerprints_file):
+			file.close()
+
+	def merge_segments(self) -> None:
+		""" Starts merging the segments of the index, or of each of its shards, in the background. The new segments can already be searched. """
+		print("Merging segments in the background...")
+		self.merger = Process(target=merge_shards, args=(self.shard_indices,))
+		self.merger.start()
 
 	def spawn_processes(self) -> None:
 		""" Create workers and spawn a process for each one. """
 		
 		for id in range(self.num_workers):
-			worker = Worker(id, self.partial_index_folder, self.q_in, self.q_out, self.running)
+			worker = Worker(id, self.partial_index_folder, self.q_in, self.q_out, self.running, self.memory_budget, self.num_shards)
 			p = Process(target=worker)
 			self.workers.append(p)
 			p.start()
@@ -92,36 +178,76 @@ class InvertedIndex:
 			worker.join()
 		print(f"All workers joined.")
 
-	def enqueue_documents(self) -> None:
-		""" Iterates through the documents and adds them to the input queue. """
-
-		# Iterate through every .json file in the source folder, starting the id at the number of documents already crawled.
-		id = len(self.crawled)
-		for id, file_path in enumerate(self.source.rglob("*.json")):
-
-			# Skip the file if it has been crawled previously.
-			if str(file_path) in self.crawled or os.path.getsize(file_path) > 10000000:
+	def iter_documents(self) -> Iterator[Tuple[str, int]]:
+		""" Yields the path and size of every document in the source folder. 
+		Pages in the crawler's page store are read one segment at a time, in the order they were saved.
+		JSON files are still supported for folders that have not been migrated into segments. Once a folder has segments,
+		its JSON files are left out, since migrating copies them into the segments and they would be indexed twice.
+		"""
+		migrated = False
+		for ref in PageStoreReader(self.source).refs():
+			migrated = True
+			yield ref
+		if migrated:
+			return
+		for file_path in self.source.rglob("*.json"):
+			yield str(file_path), os.path.getsize(file_path)
+
+	def find_documents(self) -> List[Tuple[str, int]]:
+		""" Returns the path and assigned id of every document to index, and marks the indexed documents that were replaced since. """
+
+		# Pages the crawler changed or deleted since they were saved are listed in its change list.
+		# Old versions are not indexed, and the ones indexed before are dropped from the index.
+		superseded = set(ChangeLog(self.source).superseded())
+
+		# Iterate through every document in the source folder, each with the id of its place in the folder.
+		documents = []
+		for id, (file_path, size) in enumerate(self.iter_documents()):
+
+			# Skip the file if it has been crawled previously, or was replaced.
+			if file_path in superseded:
+				if file_path in self.crawled:
+					self.superseded.add(id)
+				continue
+			if file_path in self.crawled or size > 10000000:
 				continue
 
-			# Enqueue the file path with its assigned id.
-			self.q_in.put((file_path, id))
-			id += 1
+			# Keep the file path with its assigned id.
+			documents.append((file_path, id))
+		return documents
+
+	def enqueue_documents(self, documents: List[Tuple[str, int]]) -> None:
+		""" Adds the documents to the input queue in chunks, waiting while it is full. Runs in its own thread while the main process dequeues. """
+		for start in range(0, len(documents), CHUNK_SIZE):
+			if not self.put_chunk(documents[start:start + CHUNK_SIZE]):
+				return
 
 		# Enqueue None values to signal to the workers there is no work left to be done.
 		for _ in range(len(self.workers)):
-			self.q_in.put(None)
+			self.put_chunk(None)
+
+	def put_chunk(self, chunk: List[Tuple[str, int]]) -> bool:
+		""" Puts a chunk in the input queue once there is room. Returns False if the workers were stopped first. """
+		while self.running.value:
+			try:
+				self.q_in.put(chunk, timeout=0.1)
+				return True
+			except Full:
+				pass
+		return False
 
 	def dequeue_documents(self) -> None:
-		""" Dequeues the documents processed by the workers and updates the crawled save file. """
+		""" Dequeues the documents processed by the workers and adds them to the document table. """
 
-		file_position = os.path.getsize(f"{self.index_folder}/{self.crawled_save_path}")	# Start the file position at the size of the crawled save file.
+		if self.fingerprints is None:
+			self.load_fingerprints()
 
 		# The main process keeps checking the queue until all of its workers have finished.
 		while self.finished_workers < len(self.workers):
 
-			# If the item from the queue is not None, process the document and id. A None value means a worker has finished.
-			if doc_info := self.q_out.get():
-				file_position += self.update_crawled_list(*doc_info, file_position)
+			# If the item from the queue is not None, save the documents in it. A None value means a worker has finished.
+			if results := self.q_out.get():
+				self.update_documents(results)
 			else:
 				self.finished_workers += 1
 
@@ -133,87 +259,80 @@ class InvertedIndex:
 			self.q_in.get()
 		print("Cleared input queue.")
 
-	def update_crawled_list(self, id: int, file_path: Path, url: str, title: str, file_position: int) -> int:
-		""" Updates the crawled save file, as well as the index for it. 
+	def update_documents(self, results: List[Tuple[int, Path, str, str, int, Tuple[int, int, int], bytes, int]]) -> None:
+		""" Updates the document table with a worker's results for a chunk of documents.
 		
 		Arguments:\n
-		file_path -- The document path to be written to the crawled save file. \n
-		id -- The document id. \n
-		file_position -- The current position in the crawled save file. \n
-
-		Return: The number of bytes written to the crawled save file.
+		results -- The id, file path, url, title, fingerprint, lengths, extract and shard of each document. The fingerprint is the SimHash of the
+		document's text, used to drop near-duplicates, the lengths are the number of words in its body, headings and title, and the
+		extract is the start of its text, compressed, for snippets. \n
 		"""
 
-		# Write the file path of this document to the crawled save file.
-		line = f"{file_path}\n{url}\n{title.replace("\n", " ")}\n"
-		self.crawled_file.write(line)
-		self.crawled.add(file_path.name)
-
-		# Each line of the index of crawled is of the form: 
-		# 	<id>,<file_position>
-		# ex.
-		#	3,8753
-		#   27,16536
-		# The file path of document id 3 can be found at byte 8753 in the crawled save file.
-		# The file path of document id 27 can be found at byte 16536.
-		self.index_of_crawled_file.write(f"{id},{file_position}\n")
-		return len(line.encode("utf-8")) + OS_WINDOWS * line.count("\n")
+		documents: List[Dict[int, Tuple[str, str, str, bytes]]] = [{} for _ in self.documents]
+		lengths: List[Dict[int, Tuple[int, int, int]]] = [{} for _ in self.lengths]
+		fingerprints: List[str] = []
+		for id, file_path, url, title, fingerprint, document_lengths, extract, shard in results:
+			# The file path, url, title and extract of each document are written to its slot of its shard's document table.
+			documents[shard][id] = (str(file_path), url, title, extract)
+			lengths[shard][id] = document_lengths
+			self.crawled.add(str(file_path))
+
+			fingerprints.append(f"{id},{fingerprint}\n")
+			self.new_fingerprints.append((id, fingerprint))
+
+		# A chunk's documents have consecutive ids, so the slots of each shard's documents are written together.
+		for table, shard_documents in zip(self.documents, documents):
+			table.update(shard_documents)
+		for table, shard_lengths in zip(self.lengths, lengths):
+			table.update(shard_lengths)
+		self.fingerprints_file.write("".join(fingerprints))
 		
 	def save_to_file(self) -> None:
-		""" Combine the partial indices into one file. """
+		""" Combine the partial indices into a new segment of the index, and tombstone the documents replaced since they were indexed. """
 		print("Saving to file. Do not quit...")
-
-		# Since the partial indices are in alphabetical order, we are essentially merging n sorted lists.
-		indices = [open(f"{self.partial_index_folder}/{file}") for file in os.listdir(self.partial_index_folder)]	# Open every partial index.
-		lines = [index.readline().strip() for index in indices]														# Read the first line from every file.
-
-		# Get the first token and list of postings from each file.
-		tokens: List[str] = [None for _ in indices]
-		postings_strings: List[str] = [None for _ in indices]
-		for i, line in enumerate(lines):
-			tokens[i], postings_strings[i] = line.split(":", 1) if line else (None, None)	
-
-		with open(f"{self.index_folder}/index.txt", "w") as index:
-			while any(token for token in tokens):						# Loop until the end of every file has been reached.											
-				min_token = min(token for token in tokens if token)		# The minimum token alphabetically out of all the documents.
-				postings: List[List[str, str]] = []						# A list containing pairs of strings. The first string is the doc id, and the second is the frequency. 
-
-				# For each token that is the minimum token, add its postings to one list.
-				for i, token in enumerate(tokens):
-					if token == min_token:
-						lines[i] = indices[i].readline().strip()		# For each file that had the minimum token, read the next line.
-						postings += [p.split(",", 1) for p in postings_strings[i].split(";")]
-						tokens[i], postings_strings[i] = lines[i].split(":", 1) if lines[i] else (None, None)
-
-				# Skip n-grams that have less than a certain number of postings.
-				if min_token.find(" ") > -1 and len(postings) < 10:
-					continue
-
-				# Calculate tf-idf for each posting and write to the main index.
-				index.write(f"{min_token}:")									# Write the token.
-				idf = math.log(len(self.crawled) / len(postings))
-				for i in range(len(postings)):
-					doc_id, tf = postings[i]
-					tf_idf = (1 + math.log(int(tf))) * idf
-					index.write(f"{";" if i else ""}{doc_id},{tf_idf:.3f}")		# Write the posting.
-				index.write("\n")
-
+		indexed = len(self.new_fingerprints)
+		found = self.check_new_duplicates()
+		dropped = self.superseded | self.duplicates	# Ids of documents left out of the index.
+		print(f"Dropping {found} near-duplicate documents of the {indexed} indexed ({found / max(1, indexed):.1%}).")
+		for shard in range(self.num_shards):
+			self.save_shard(shard, dropped)
 		print("Saved to file.")
-	
-	def index_index(self) -> None:
-		""" Reads through the index and creates an index for that index. """
-
-		file_position = 0
-		with open(f"{self.index_folder}/{self.index_save_path}", "r") as index, open(f"{self.index_folder}/index_of_{self.index_save_path}", "w") as index_of_index:
-			for line in index:
-				# Each line of the index of index is of the form: 
-				# 	<token>,<file_position>
-				# ex.
-				#	research,0
-				#   computer,2376
-				# The token "research" can be found at byte 0 of the index.
-				# The token "computer" can be found at byte 2376.
-
-				token = line.split(":", 1)[0]
-				index_of_index.write(f"{token},{file_position}\n")
-				file_position += len(line) + OS_WINDOWS * line.count("\n")
+
+	def save_shard(self, shard: int, dropped: Set[int]) -> None:
+		""" Combine the partial indices of a shard into a new segment of it, and tombstone the documents in it replaced since they were indexed. """
+		index_folder, partial_index_folder = self.shard_indices[shard], self.shard_partials[shard]
+		manifest = Manifest.read(index_folder)
+
+		# Documents in earlier segments that were changed or deleted by a later crawl are tombstoned in them, until they are merged away.
+		print(f"Tombstoned {manifest.delete(index_folder, self.superseded)} replaced documents.")
+
+		# The tokens are split into ranges, which are merged in separate processes and then put together.
+		# Each range is a merge of n sorted lists, since the partial indices are in alphabetical order.
+		paths = sorted(partial_index_folder.glob("*.dat"))
+		lengths = {id: document_lengths for id, document_lengths in self.lengths[shard].items() if id not in dropped}
+		if paths and lengths:
+			name = manifest.new_segment()
+			segment_folder = index_folder / name
+			os.makedirs(segment_folder)
+			ranges = split_ranges(paths, self.num_workers)
+			outputs = [segment_folder / f"range-{i:02}.bin" for i in range(len(ranges))]
+			if len(ranges) > 1:
+				with ProcessPoolExecutor(len(ranges)) as pool:
+					futures = [pool.submit(merge_range, paths, low, high, dropped, output) for (low, high), output in zip(ranges, outputs)]
+					num_tokens = sum(future.result() for future in futures)
+			else:
+				num_tokens = merge_range(paths, None, None, dropped, outputs[0])
+			combine(outputs, segment_folder)
+			write_lengths(segment_folder / LENGTHS_FILE, lengths)	# The search engine ranks documents with the average length of each field.
+			manifest.add(name, len(lengths))
+			print(f"Merged {num_tokens} tokens in {len(ranges)} ranges into {name}, with {len(lengths)} documents.")
+
+		# The search engine picks up the new segment once the manifest is replaced, so the documents in it are written out first.
+		self.documents[shard].flush()
+		manifest.commit(index_folder)
+
+		# The partial indices are in the new segment now.
+		self.lengths[shard].close()
+		shutil.rmtree(partial_index_folder)
+		os.makedirs(partial_index_folder)
+		self.lengths[shard] = LengthTable(partial_index_folder / LENGTHS_FILE, writable=True)
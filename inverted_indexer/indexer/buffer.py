@@ -0,0 +1,54 @@
+from array import array
+from itertools import accumulate
+from shared.posting import Posting
+from typing import Dict, Iterator, List, Tuple
+
+TOKEN_OVERHEAD = 120		# Estimated bytes taken by each token besides its characters: its string object and its slot in the table of ids.
+
+class PostingsBuffer:
+	""" The postings a worker holds in memory until it writes them to a partial index, in columns of arrays instead of an object per posting.
+	Each token is given an id the first time it is seen. Each posting is then its token id, doc id and packed field frequencies, 4 bytes each,
+	and the length of its positions, which are appended to one buffer of bytes. Postings are grouped by token when they are written out,
+	and stay in the order they were added, which is the order of their doc ids, since a worker is handed documents in order.
+	"""
+
+	def __init__(self):
+		self.token_ids: Dict[str, int] = {}		# Id of each token, in the order they were first seen.
+		self.token_bytes = 0					# Estimated bytes taken by the tokens and their ids.
+		self.tokens = array("I")				# Token id of each posting.
+		self.ids = array("I")					# Doc id of each posting.
+		self.values = array("I")				# Packed frequencies of the token in each field of the document, for each posting.
+		self.lengths = array("I")				# Length of the encoded positions of each posting.
+		self.positions = bytearray()			# Encoded positions of every posting, one after another.
+
+	def add(self, postings: Dict[str, Posting]) -> None:
+		""" Adds the postings of a document. """
+		for token, posting in postings.items():
+			if (token_id := self.token_ids.get(token)) is None:
+				token_id = self.token_ids[token] = len(self.token_ids)
+				self.token_bytes += len(token) + TOKEN_OVERHEAD
+			self.tokens.append(token_id)
+			self.ids.append(posting.id)
+			self.values.append(posting.value)
+			self.lengths.append(len(posting.positions))
+			self.positions += posting.positions
+
+	def __len__(self) -> int:
+		return len(self.ids)
+
+	def nbytes(self) -> int:
+		""" Returns the estimated bytes of memory the postings take. """
+		return self.token_bytes + 4 * (len(self.tokens) + len(self.ids) + len(self.values) + len(self.lengths)) + len(self.positions)
+
+	def __iter__(self) -> Iterator[Tuple[str, List[int], List[int], List[bytes]]]:
+		""" Yields each token in alphabetical order, with the doc ids, values and positions of its postings. """
+		groups: List[List[int]] = [[] for _ in self.token_ids]
+		for i, token_id in enumerate(self.tokens):
+			groups[token_id].append(i)
+		ends = list(accumulate(self.lengths))
+		for token, token_id in sorted(self.token_ids.items()):
+			group = groups[token_id]
+			yield token, [self.ids[i] for i in group], [self.values[i] for i in group], [self.positions[ends[i] - self.lengths[i]:ends[i]] for i in group]
+
+	def clear(self) -> None:
+		self.__init__()
@@ -0,0 +1,145 @@
+from bisect import bisect_right
+from itertools import chain, repeat
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+from shared.dictionary import DICTIONARY_FILE, LENGTHS_FILE, LengthTable, TermDictionary, TermDictionaryWriter, write_lengths
+from shared.postings import INDEX_FILE, READ_BUFFER, IndexWriter, PostingsList, iter_postings, merge_postings
+from shared.segments import SEGMENT_PREFIX, Manifest
+import shutil
+import math
+import os
+
+SAMPLE_INTERVAL = 1024		# Every this many tokens, a merged partial index records the token and its offset.
+MERGE_FACTOR = 4			# Segments of a tier are merged into one once there are this many of them.
+FLOOR_DOCUMENTS = 1000		# Segments with fewer documents than this are all in the lowest tier.
+MAX_DELETED = 0.3			# Segments with more of their documents tombstoned than this are merged on their own, dropping them.
+
+def samples_path(path: Path) -> Path:
+	""" Returns the path of the sampled tokens of a partial index. """
+	return path.with_suffix(".samples")
+
+def write_samples(path: Path, samples: List[Tuple[str, int]]) -> None:
+	""" Writes the sampled tokens of a partial index. Each line is of the form <offset> <token>. """
+	with open(samples_path(path), "w", encoding="utf-8") as file:
+		for token, offset in samples:
+			file.write(f"{offset} {token}\n")
+
+def read_samples(path: Path) -> List[Tuple[str, int]]:
+	""" Reads the sampled tokens of a partial index, which are empty if it has none. """
+	if not samples_path(path).exists():
+		return []
+	with open(samples_path(path), "r", encoding="utf-8") as file:
+		return [(token, int(offset)) for offset, token in (line.rstrip("\n").split(" ", 1) for line in file)]
+
+def split_ranges(paths: List[Path], num_ranges: int) -> List[Tuple[Optional[str], Optional[str]]]:
+	""" Splits the tokens of the partial indices into ranges holding about as many sampled tokens each.
+	Each range is a pair of the first token in it and the first token after it, with None meaning no bound.
+	"""
+	tokens = sorted(set(token for path in paths for token, _ in read_samples(path)))
+	bounds = sorted(set(tokens[len(tokens) * i // num_ranges] for i in range(1, num_ranges))) if tokens else []
+	edges = [None] + bounds + [None]
+	return list(zip(edges, edges[1:]))
+
+def read_range(path: Path, low: Optional[str], high: Optional[str]) -> Iterator[Tuple[str, PostingsList]]:
+	""" Yields the entries of a partial index from low up to high, starting from the last sampled token before low. """
+	samples = read_samples(path) if low is not None else []
+	position = bisect_right([token for token, _ in samples], low) if samples else 0
+	for token, postings in iter_postings(path, samples[position - 1][1] if position else 0):
+		if high is not None and token >= high:
+			break
+		if low is None or token >= low:
+			yield token, postings
+
+def merge_range(paths: List[Path], low: Optional[str], high: Optional[str], dropped: Set[int], output: Path) -> int:
+	""" Merges the tokens from low up to high of every partial index into an index at output, keeping the term frequencies and positions of each posting.
+	Returns the number of tokens written.
+	"""
+	index = IndexWriter(output, output.with_suffix(".dict"), quantize=False)
+	for token, parts in merge_postings(read_range(path, low, high) for path in paths):
+
+		# Add the postings to one list, without the documents that were replaced or duplicated. Positions are copied without being decoded.
+		decoded = [(*postings.decode(), postings.positions()) for postings in parts]
+		has_positions = all(positions is not None for _, _, positions in decoded)
+		postings: List[Tuple[int, int, bytes]] = sorted(p for p in chain.from_iterable(zip(ids, tfs, positions or repeat(b"")) for ids, tfs, positions in decoded) if p[0] not in dropped)	# Doc id, term frequencies and positions, ordered by doc id.
+
+		# Skip tokens that only appeared in documents that were dropped.
+		if not postings:
+			continue
+
+		# The postings are scored by the search engine, so changing the ranking does not need a re-index.
+		index.write(token, [doc_id for doc_id, _, _ in postings], [tf for _, tf, _ in postings], [positions for _, _, positions in postings] if has_positions else None)
+	index.close()
+	return index.count
+
+def combine(outputs: List[Path], folder: Path) -> None:
+	""" Concatenates the index of each range into the index in the folder, and their dictionaries into one with offsets into the whole index. """
+	dictionary = TermDictionaryWriter(folder / DICTIONARY_FILE)
+	position = 0
+	with open(folder / INDEX_FILE, "wb") as index:
+		for output in outputs:
+			with open(output, "rb") as file:
+				shutil.copyfileobj(file, index, READ_BUFFER)
+			part = TermDictionary(output.with_suffix(".dict"))
+			for token, offset in part:
+				dictionary.add(token, position + offset)
+			part.close()
+			position += os.path.getsize(output)
+			os.remove(output)
+			os.remove(output.with_suffix(".dict"))
+	dictionary.close()
+
+def tier(documents: int) -> int:
+	""" Returns the tier of a segment by its number of documents. Each tier's segments are MERGE_FACTOR times larger than the one's below it. """
+	return 0 if documents < FLOOR_DOCUMENTS else 1 + int(math.log(documents / FLOOR_DOCUMENTS, MERGE_FACTOR))
+
+def select_merge(manifest: Manifest) -> List[str]:
+	""" Returns the names of the segments to merge next, which are the oldest of the lowest full tier, or none if no tier is full. """
+	tiers: Dict[int, List[str]] = {}
+	for segment in manifest.segments:
+		if len(segment["deleted"]) > MAX_DELETED * segment["documents"]:
+			return [segment["name"]]
+		tiers.setdefault(tier(segment["documents"] - len(segment["deleted"])), []).append(segment["name"])
+	for level in sorted(tiers):
+		if len(tiers[level]) >= MERGE_FACTOR:
+			return tiers[level][:MERGE_FACTOR]
+	return []
+
+def merge_segments(folder: Path, names: List[str], name: str, deleted: Set[int]) -> int:
+	""" Merges segments of the index into a new segment, without their tombstoned documents. Returns the number of documents in it. """
+	output = folder / name
+	os.makedirs(output)
+	merge_range([folder / segment / INDEX_FILE for segment in names], None, None, deleted, output / "range-00.bin")
+	combine([output / "range-00.bin"], output)
+
+	lengths = {}
+	for segment in names:
+		table = LengthTable(folder / segment / LENGTHS_FILE)
+		lengths.update((id, document_lengths) for id, document_lengths in table.items() if id not in deleted)
+		table.close()
+	write_lengths(output / LENGTHS_FILE, lengths)
+	return len(lengths)
+
+def remove_unlisted(folder: Path) -> None:
+	""" Deletes the segments that are not in the manifest, which were merged away or left unfinished. """
+	names = set(Manifest.read(folder).names())
+	for path in folder.glob(f"{SEGMENT_PREFIX}*"):
+		if path.name not in names:
+			shutil.rmtree(path, ignore_errors=True)
+
+def merge_tiers(folder: Path) -> None:
+	""" Merges segments of the index until no tier is full, committing each merge to the manifest so searches move on to it.
+	Segments merged away are deleted the next time this runs, since search engines may still be reading them.
+	"""
+	remove_unlisted(folder)
+	while names := select_merge(manifest := Manifest.read(folder)):
+		name = manifest.new_segment()
+		deleted = set(chain.from_iterable(segment["deleted"] for segment in manifest.segments if segment["name"] in names))
+		documents = merge_segments(folder, names, name, deleted)
+		manifest.replace(names, name, documents)
+		manifest.commit(folder)
+		print(f"Merged {len(names)} segments into {name}, with {documents} documents.")
+
+def merge_shards(folders: List[Path]) -> None:
+	""" Merges the segments of each shard of the index in turn. """
+	for folder in folders:
+		merge_tiers(folder)
@@ -1,33 +1,41 @@
 from pathlib import Path
 from shared.posting import Posting
-from typing import Dict, List
+from inverted_indexer.indexer.buffer import PostingsBuffer
+from shared.postings import iter_postings, merge_postings, write_entry, write_postings
+from inverted_indexer.indexer.merge import SAMPLE_INTERVAL, samples_path, write_samples
+from itertools import chain
+from typing import List, Tuple
 import os
 from multiprocessing import Queue, Value
 import signal
 import ctypes
 from shared.webpage import WebPage
+from shared.simhash import simhash
+from shared.documents import compress_extract
+from shared.shards import shard_folder, shard_of
 
 def is_valid_html(content: str) -> bool:
 	""" Ensure the JSON file has the "content" field and contains HTML tags. """
 	return '<html' in content[:1024].lower()
 
+MEMORY_BUDGET = 64 * 1024 * 1024		# Default bytes of postings a worker holds in memory before writing them to a partial index.
+
 class Worker:
-	def __init__(self, worker_id: int, folder: Path, q_in: Queue, q_out: Queue, running: ctypes.c_int):
+	def __init__(self, worker_id: int, folder: Path, q_in: Queue, q_out: Queue, running: ctypes.c_int, memory_budget=MEMORY_BUDGET, num_shards=1):
 		self.worker_id = worker_id
 		self.folder = folder		# Folder to create partial indices in.
-		self.q_in = q_in			# Queue to receive documents to process.
-		self.q_out = q_out			# Queue to send back processed documents.
+		self.folders = [shard_folder(folder, shard, num_shards) for shard in range(num_shards)]	# Folder of the partial indices of each shard.
+		self.q_in = q_in			# Queue to receive chunks of documents to process.
+		self.q_out = q_out			# Queue to send back the processed documents of each chunk.
 		self.running = running
 
-		self.postings: Dict[str, List[Posting]] = {}    # Map of tokens to lists of Postings that contain that token.
-		self.posting_count: int = 0						# The current number of postings.
+		self.postings = [PostingsBuffer() for _ in self.folders]	# The postings of each shard's documents processed since the last partial index.
+		self.memory_budget = memory_budget				# Bytes of postings to hold in memory before writing them to a partial index.
+		self.results: List[Tuple] = []					# Details of the documents processed since the last results were sent back.
 		self.index_count = 0							# The current number of partial indices.
 
-		self.page_hashes: Dict[int, str] = {}
-		self.duplicate_pages: Dict[str, int] = {}
-
-		# Count the number of partial indices associated with this worker id.
-		for file in os.listdir(self.folder):
+		# Count the number of partial indices associated with this worker id. Every shard has as many of them.
+		for file in os.listdir(self.folders[0]):
 			if file.startswith(f"w{self.worker_id:02}"):
 				self.index_count += 1
 
@@ -42,105 +50,85 @@ class Worker:
 
 	def run(self):
 		# Run until the main thread signals to stop, or if a None Value is encountered.
-		while self.running.value and (doc_and_id := self.q_in.get()):
-			self.process_document(*doc_and_id)
-
-			# If there are more than 100,000 postings stored in memory, write them to a partial index.
-			if self.posting_count > 100000:
-				self.create_partial_index()
+		while self.running.value and (chunk := self.q_in.get()):
+			for file_path, id in chunk:
+				# Documents left when the main thread signals to stop are indexed next time.
+				if not self.running.value:
+					break
+				self.process_document(file_path, id)
+
+				# If the postings stored in memory take up more than the memory budget, write them to a partial index.
+				if sum(postings.nbytes() for postings in self.postings) > self.memory_budget:
+					self.create_partial_index()
+			self.send_results()
 
 	def exit(self):
 		""" Called when the worker exits due to reaching the end of the queue or from KeyboardInterrupt. """
 
+		self.send_results()				# Send back the documents processed so far, since their postings are written next.
 		self.create_partial_index()		# Write the rest of the postings to a partial index.
 		self.merge_indices()			# Merge this workers indices.
-		#self.print_duplicate()      # write out duplicate webpages and their paths to a file 
 		self.q_out.put(None)			# Signal to the main process that this worker is done.
 		print(f"Worker {self.worker_id} exited.")
 
+	def send_results(self) -> None:
+		""" Sends the details of the documents processed since the last results to the main process, in one message. """
+		if self.results:
+			self.q_out.put(self.results)
+			self.results = []
+
 	def create_partial_index(self) -> None:
 		""" Write the tokens and postings stored in memory into a partial index. """
 
-		with open(f"{self.folder}/w{self.worker_id:02}-i{self.index_count}.dat", "w") as index:
-			for token, postings in sorted(self.postings.items()):
-				# Each line of the index is of the form: 
-				# 	<token>:<id_1>,<tf-idf_1>;<id_2>,<tf-idf_2>;<id_3>,<tf-idf_3>;
-				# ex.
-				#	research:0,3;4,2;7,3;
-				#   computer:0,12;3,8;4,9;
-				# The token "research" is found in documents 0, 4, 7 with tf-idfs of 3, 2, 3 respectively.
-				# The token "computer" is found in documents 0, 3, 4 with tf-idfs of 12, 8, 9.
-				line = f"{token}:" + ";".join(f"{p.id},{p.tf_idf}" for p in postings) + "\n"
-				index.write(line)
+		# Each entry of the index is a token followed by its postings in the binary format from shared.postings.
+		# The values are the term frequencies in each field, which the search engine scores with the length of each document,
+		# and each posting keeps the positions of its token for phrase queries.
+		for folder, postings in zip(self.folders, self.postings):
+			with open(f"{folder}/w{self.worker_id:02}-i{self.index_count}.dat", "wb") as index:
+				for token, ids, values, positions in postings:
+					write_postings(index, token, ids, values, quantize=False, positions=positions)
+			postings.clear()
 
 		# Update relevant variables.
-		self.postings = {}
-		self.posting_count = 0
 		self.index_count += 1
 
 	def merge_indices(self) -> None:
-		""" Combine the partial indices into one file. """
+		""" Combine the partial indices of each shard into one file. """
 		print(f"Worker {self.worker_id:02} - Merging indices...")
+		for folder in self.folders:
+			self.merge_folder(folder)
+		print(f"Worker {self.worker_id:02} - Merged indices.")
+
+	def merge_folder(self, folder: Path) -> None:
+		""" Combine the partial indices in the folder into one file. """
 
 		# Since the partial indices are in alphabetical order, we are essentially merging n sorted lists.
-		indices = [open(f"{self.folder}/{file}") for file in os.listdir(self.folder) if file.startswith(f"w{self.worker_id:02}")]	# Open every partial index belonging to this worker.
-		lines = [index.readline().strip() for index in indices]																	# Read the first line from every file.
-
-		# Get the first token and list of postings from each file.
-		tokens: List[str] = [None for _ in indices]
-		postings_strings: List[str] = [None for _ in indices]
-		for i, line in enumerate(lines):
-			tokens[i], postings_strings[i] = line.split(":", 1) if line else (None, None)	
-
-		with open(f"{self.folder}/w{self.worker_id:02}.dat", "w") as index:
-			while any(token for token in tokens):						# Loop until the end of every file has been reached.											
-				min_token = min(token for token in tokens if token)		# The minimum token alphabetically out of all the documents.
-				postings: List[List[str, str]] = []						# A list containing pairs of strings. The first string is the doc id, and the second is the frequency. 
-
-				# For each token that is the minimum token, add its postings strings to one list.
-				postings: List[str] = []
-				for i, token in enumerate(tokens):
-					if token == min_token:
-						lines[i] = indices[i].readline().strip()		# For each file that had the minimum token, read the next line.
-						postings.append(postings_strings[i])
-						tokens[i], postings_strings[i] = lines[i].split(":", 1) if lines[i] else (None, None)
-				index.write(f"{min_token}:" + ";".join(postings) + "\n")
-
-		for file in indices:
-			file.close()
-		for file in os.listdir(self.folder):
+		paths = list(folder.glob(f"w{self.worker_id:02}-*.dat"))	# Every partial index belonging to this worker.
+		output = folder / f"w{self.worker_id:02}.dat"
+		samples = []													# Every SAMPLE_INTERVAL-th token and its offset, for splitting up the final merge.
+		offset = 0
+
+		with open(output, "wb") as index:
+			for count, (token, parts) in enumerate(merge_postings(iter_postings(path) for path in paths)):
+				if count % SAMPLE_INTERVAL == 0:
+					samples.append((token, offset))
+
+				# Postings found in one file are copied as they are. Otherwise, each file holds a run of this worker's documents,
+				# so ordering the files' postings by their first id keeps the ids in order.
+				if len(parts) == 1:
+					offset += write_entry(index, token, parts[0].to_bytes())
+					continue
+				parts = sorted(((*postings.decode(), postings.positions()) for postings in parts), key=lambda part: part[0][0])
+				positions = None if any(part[2] is None for part in parts) else list(chain.from_iterable(part[2] for part in parts))
+				offset += write_postings(index, token, list(chain.from_iterable(part[0] for part in parts)), list(chain.from_iterable(part[1] for part in parts)), quantize=False, positions=positions)
+		write_samples(output, samples)
+
+		for file in os.listdir(folder):
 			if file.startswith(f"w{self.worker_id:02}-"):
-				os.remove(f"{self.folder}/{file}")
-		os.rename(f"{self.folder}/w{self.worker_id:02}.dat", f"{self.folder}/w{self.worker_id:02}-0.dat")
-		print(f"Worker {self.worker_id:02} - Merged indices.")
+				os.remove(f"{folder}/{file}")
+		os.rename(output, folder / f"w{self.worker_id:02}-0.dat")
+		os.rename(samples_path(output), samples_path(folder / f"w{self.worker_id:02}-0.dat"))
 
-
-	def is_duplicate(self, page_hash: str, page_path) -> bool:
-		if page_hash in self.page_hashes.keys():
-			return True
-		self.page_hashes[page_hash] = page_path
-		return False
-	
-	def compute_hash(self,page_content: List[str]) : 
-		raw_text = ' '.join(page_content)
-
-		""" this function will return a hash value for a given document 
-		for each character in the hash we multily by the prime 
-		+ ord(char) gives us the ascii value of the character
-
-		% 2^32 to make sure it says within a 32 bit unsigned (no negative) integer and sets the range 
-		# so lets us have hash values in the range  0 - 8,388,607
-
-		we multiply by 31 (prime) becuase it less likely produces patterns (so no accidental matches)
-		and lets us produce a unique hash number 
-		"""
-
-		hash_value = 0
-		prime = 31  # A small prime number for multiplication
-		for char in raw_text:
-			hash_value = (hash_value * prime + ord(char)) % (2**32)  # Use a large prime modulus to avoid overflow
-		return hash_value
-	
 	def process_document(self, file_path: Path, id: int) -> None:
 		""" Processing the given document, extracting the postings from it. """
 
@@ -151,21 +139,14 @@ class Worker:
 		if not webpage or not is_valid_html(webpage.content):
 			return
 		
-		text_content = webpage.get_text()
-		page_hash = self.compute_hash(text_content)
-
-		if self.is_duplicate(page_hash, file_path):
-			self.duplicate_pages[file_path] = page_hash
-			return
-
-		# Add all postings from that file to this worker's own dict.
-		for token, posting in Posting.get_postings(webpage.soup, id).items():
-			self.postings.setdefault(token, []).append(posting)
-			self.posting_count += 1
-		self.q_out.put((id, file_path, webpage.url, webpage.title))
+		# Add all postings from that file to this worker's own dict, for the shard of its domain.
+		# The title, headings and text are the ones the crawler saved with the page, or taken from it the same way if it was saved without them.
+		postings, lengths = Posting.get_postings(webpage.text, webpage.headings, webpage.title, id)
+		shard = shard_of(webpage.url, len(self.folders))
+		self.postings[shard].add(postings)
+
+		# Near-duplicates are found by the main process, which compares the fingerprints from every worker.
+		# The start of the text is kept in the document table, so the search engine shows snippets without reading the page.
+		text = webpage.text
+		self.results.append((id, file_path, webpage.url, webpage.title or webpage.url, simhash(text), lengths, compress_extract(text), shard))
 		print(f"Worker {self.worker_id:02} - {id} - {file_path}")
-
-	def print_duplicate(self):
-		for key,value in self.duplicate_pages.items():
-			print(f"duplicate page found for {key} and {self.page_hashes[value]}")
-
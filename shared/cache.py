@@ -0,0 +1,86 @@
+""" A least recently used cache bounded by the bytes of its entries, which the search engine keeps its most read postings
+and the results of its most frequent queries in between searches.
+
+Entries belong to one generation of the index, and the cache is emptied when the generation changes, so nothing read
+from segments merged away, or scored with the statistics of older segments, is returned. A cache can also admit an
+entry only once its key has been missed before, so that keys looked up once, which are most of them in a skewed log of
+queries, don't evict the ones looked up again and again, and aren't worth the work of decoding them to keep.
+"""
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Dict, Hashable, Optional
+
+ENTRY_BYTES = 200               # Bytes counted for each entry besides its value, for its key and its place in the cache.
+REMEMBERED_MISSES = 65536       # Keys missed once that are remembered, when entries are admitted on their second miss.
+
+class LRUCache:
+    """ Values with their size in bytes, evicting the least recently used when they add up to more than the budget.
+    Searches in threads share one cache, so it is locked while it changes.
+    """
+
+    def __init__(self, budget: int, admit_on_second_miss=False):
+        self.budget = budget
+        self.admit_on_second_miss = admit_on_second_miss
+        self.entries: OrderedDict[Hashable, Any] = OrderedDict()
+        self.sizes: Dict[Hashable, int] = {}
+        self.missed: OrderedDict[Hashable, int] = OrderedDict()    # Number of misses of keys not in the cache, least recent first.
+        self.bytes = 0
+        self.generation = None
+        self.hits = self.misses = self.evictions = self.invalidations = 0
+        self.lock = Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """ Returns the value of the key, or None if it is not in the cache. """
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            self.misses += 1
+            if self.admit_on_second_miss:
+                self.missed[key] = self.missed.pop(key, 0) + 1
+                if len(self.missed) > REMEMBERED_MISSES:
+                    self.missed.popitem(last=False)
+            return None
+
+    def admits(self, key: Hashable) -> bool:
+        """ Returns whether a value for the key would be kept, so the caller only prepares values that will be. """
+        return self.budget > 0 and (not self.admit_on_second_miss or self.missed.get(key, 0) > 1)
+
+    def put(self, key: Hashable, value: Any, size: int) -> bool:
+        """ Keeps the value, evicting the least recently used values to make room. Returns whether it was kept. """
+        size += ENTRY_BYTES
+        with self.lock:
+            if size > self.budget or key in self.entries:
+                return False
+            self.missed.pop(key, None)
+            while self.bytes + size > self.budget:
+                evicted, _ = self.entries.popitem(last=False)
+                self.bytes -= self.sizes.pop(evicted)
+                self.evictions += 1
+            self.entries[key] = value
+            self.sizes[key] = size
+            self.bytes += size
+            return True
+
+    def set_generation(self, generation: Hashable) -> None:
+        """ Empties the cache if its entries are from another generation of the index. """
+        with self.lock:
+            if generation == self.generation:
+                return
+            if self.entries:
+                self.invalidations += 1
+            self.entries.clear()
+            self.sizes.clear()
+            self.missed.clear()
+            self.bytes = 0
+            self.generation = generation
+
+    def stats(self) -> Dict[str, Any]:
+        """ Returns the hit rate and memory use of the cache. """
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries), "bytes": self.bytes, "budget": self.budget,
+            "hits": self.hits, "misses": self.misses, "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions, "invalidations": self.invalidations,
+        }
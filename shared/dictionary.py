@@ -0,0 +1,253 @@
+""" On-disk lookup tables for the index, opened with mmap so the search engine starts without loading them.
+
+The term dictionary maps each token to the offset of its postings in index.bin. Tokens are sorted and front-coded
+in blocks of BLOCK_SIZE, each token stored as the length of the prefix it shares with the token before it, its
+remaining bytes and its offset. A table of block offsets at the end of the file is binary searched by the first
+token of each block, then the block holding the token is scanned.
+
+The offset table maps each doc id to the offset of its details in crawled.txt, in an 8-byte slot per id holding the
+offset plus one. The indexer no longer writes it, since documents are kept in the document table of shared.documents,
+and it is only kept to convert older indices.
+
+The length table, doc_lengths.bin in each segment, holds the number of tokens in the body, headings and title of each
+document, for ranking at query time. It starts with a header of the segment's first doc id, its number of documents
+and the average length of each field, followed by a fixed-width slot per doc id from the first, capped at what the
+slot holds. Slots of ids the segment does not have are zero. While indexing, the main process keeps the lengths in a
+writable table in the partial indices folder, starting from doc id 0 with an empty header, and the segment's table
+is written from it once the segment is built.
+"""
+from pathlib import Path
+from typing import BinaryIO, Dict, Iterator, Optional, Tuple
+import struct
+import mmap
+import os
+
+BLOCK_SIZE = 16                             # Tokens per front-coded block.
+TERM_HEADER = struct.Struct("<BH")          # Length of the prefix shared with the previous token, and of the rest of the token.
+TERM_OFFSET = struct.Struct("<Q")           # Offset of the token's postings.
+BLOCK_OFFSET = struct.Struct("<Q")          # Offset of a block in the dictionary.
+FOOTER = struct.Struct("<QQ")               # Offset of the block table and number of tokens.
+LENGTHS_HEADER = struct.Struct("<QQddd")    # First doc id, number of documents, and the average length of their body, headings and title.
+DOC_LENGTHS = struct.Struct("<IHH")         # Number of tokens in the body, headings and title of a document.
+DICTIONARY_FILE = "index_of_index.bin"
+OFFSETS_FILE = "index_of_crawled.bin"
+LENGTHS_FILE = "doc_lengths.bin"
+
+def open_mmap(path: Path) -> Tuple[BinaryIO, mmap.mmap]:
+    file = open(path, "rb")
+    return file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(path) else b""
+
+def write_slots(file: BinaryIO, start: int, slot: struct.Struct, values: Dict[int, Tuple]) -> None:
+    """ Writes the values of ids into their fixed-width slots after start, with one write for each run of consecutive ids. """
+    run, first, previous = bytearray(), 0, None
+    for id in sorted(values):
+        if run and id != previous + 1:
+            file.seek(start + first * slot.size)
+            file.write(run)
+            run = bytearray()
+        if not run:
+            first = id
+        run += slot.pack(*values[id])
+        previous = id
+    if run:
+        file.seek(start + first * slot.size)
+        file.write(run)
+
+class TermDictionaryWriter:
+    """ Writes a term dictionary, given tokens in alphabetical order. """
+
+    def __init__(self, path: Path):
+        self.file = open(path, "wb")
+        self.blocks = []                    # Offset of each block.
+        self.count = 0
+        self.previous = b""
+        self.position = 0
+
+    def add(self, token: str, offset: int) -> None:
+        term = token.encode("utf-8")
+        if self.count % BLOCK_SIZE == 0:
+            self.blocks.append(self.position)
+            prefix = 0                      # The first token of a block is stored whole, so blocks can be read on their own.
+        else:
+            prefix = min(len(os.path.commonprefix((self.previous, term))), 255)
+        entry = TERM_HEADER.pack(prefix, len(term) - prefix) + term[prefix:] + TERM_OFFSET.pack(offset)
+        self.file.write(entry)
+        self.position += len(entry)
+        self.previous = term
+        self.count += 1
+
+    def close(self) -> None:
+        table = self.position
+        self.file.write(b"".join(BLOCK_OFFSET.pack(block) for block in self.blocks))
+        self.file.write(FOOTER.pack(table, self.count))
+        self.file.close()
+
+class TermDictionary:
+    """ Looks up the postings offset of a token, reading only a few blocks of the dictionary. """
+
+    def __init__(self, path: Path):
+        self.file, self.data = open_mmap(path)
+        self.table, self.count = FOOTER.unpack_from(self.data, len(self.data) - FOOTER.size) if self.data else (0, 0)
+        self.num_blocks = -(-self.count // BLOCK_SIZE)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def first_term(self, block: int) -> bytes:
+        position = BLOCK_OFFSET.unpack_from(self.data, self.table + block * BLOCK_OFFSET.size)[0]
+        _, length = TERM_HEADER.unpack_from(self.data, position)
+        start = position + TERM_HEADER.size
+        return self.data[start:start + length]
+
+    def read_block(self, block: int) -> Iterator[Tuple[bytes, int]]:
+        """ Yields each token in the block as bytes, with its offset. """
+        position = BLOCK_OFFSET.unpack_from(self.data, self.table + block * BLOCK_OFFSET.size)[0]
+        term = b""
+        for _ in range(min(BLOCK_SIZE, self.count - block * BLOCK_SIZE)):
+            prefix, length = TERM_HEADER.unpack_from(self.data, position)
+            position += TERM_HEADER.size
+            term = term[:prefix] + self.data[position:position + length]
+            position += length
+            yield term, TERM_OFFSET.unpack_from(self.data, position)[0]
+            position += TERM_OFFSET.size
+
+    def get(self, token: str, default=None) -> Optional[int]:
+        """ Returns the postings offset of the token, or the default if it is not in the index. """
+        term = token.encode("utf-8")
+
+        # Find the last block whose first token is not after the token.
+        low, high = 0, self.num_blocks
+        while low < high:
+            middle = (low + high) // 2
+            if self.first_term(middle) <= term:
+                low = middle + 1
+            else:
+                high = middle
+        if not low:
+            return default
+
+        for other, offset in self.read_block(low - 1):
+            if other == term:
+                return offset
+            if other > term:
+                break
+        return default
+
+    def __contains__(self, token: str) -> bool:
+        return self.get(token) is not None
+
+    def __iter__(self) -> Iterator[Tuple[str, int]]:
+        """ Yields every token in alphabetical order, with its offset. """
+        for block in range(self.num_blocks):
+            for term, offset in self.read_block(block):
+                yield term.decode("utf-8"), offset
+
+    def close(self) -> None:
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.file.close()
+
+class OffsetTable:
+    """ Offsets stored in an 8-byte slot per id, so the offset of an id is read without the others.
+    Slots hold the offset plus one, leaving zero for ids that were never written.
+    """
+
+    def __init__(self, path: Path, writable=False):
+        self.path = path
+        self.writable = writable
+        if writable:
+            self.file = open(path, "r+b" if os.path.exists(path) else "w+b")
+            self.data = b""
+        else:
+            self.file, self.data = open_mmap(path)
+
+    def __setitem__(self, id: int, offset: int) -> None:
+        self.file.seek(id * BLOCK_OFFSET.size)
+        self.file.write(BLOCK_OFFSET.pack(offset + 1))
+
+    def update(self, offsets: Dict[int, int]) -> None:
+        """ Writes the offset of each id, with one write for each run of consecutive ids. """
+        write_slots(self.file, 0, BLOCK_OFFSET, {id: (offset + 1,) for id, offset in offsets.items()})
+
+    def get(self, id: int, default=None) -> Optional[int]:
+        position = id * BLOCK_OFFSET.size
+        if position + BLOCK_OFFSET.size > len(self.data):
+            return default
+        offset = BLOCK_OFFSET.unpack_from(self.data, position)[0]
+        return offset - 1 if offset else default
+
+    def flush(self) -> None:
+        self.file.flush()
+
+    def close(self) -> None:
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.file.close()
+
+class LengthTable:
+    """ The length of each field of each document in a slot per id, after a header of statistics for its documents.
+    A writable table starts from doc id 0, and its header is left empty.
+    """
+
+    def __init__(self, path: Path, writable=False):
+        self.path = path
+        self.writable = writable
+        if writable:
+            new = not os.path.exists(path)
+            self.file = open(path, "w+b" if new else "r+b")
+            if new:
+                self.file.write(LENGTHS_HEADER.pack(0, 0, 0, 0, 0))
+            self.data = b""
+        else:
+            self.file, self.data = open_mmap(path)
+        # First doc id, documents in the table, and the average length of each field.
+        self.first, self.num_documents, *self.averages = LENGTHS_HEADER.unpack_from(self.data) if len(self.data) >= LENGTHS_HEADER.size else (0, 0, 0, 0, 0)
+
+    def __setitem__(self, id: int, lengths: Tuple[int, int, int]) -> None:
+        self.file.seek(LENGTHS_HEADER.size + id * DOC_LENGTHS.size)
+        self.file.write(DOC_LENGTHS.pack(*cap(lengths)))
+
+    def update(self, lengths: Dict[int, Tuple[int, int, int]]) -> None:
+        """ Writes the lengths of each id, with one write for each run of consecutive ids. """
+        write_slots(self.file, LENGTHS_HEADER.size, DOC_LENGTHS, {id: cap(document_lengths) for id, document_lengths in lengths.items()})
+
+    def __getitem__(self, id: int) -> Tuple[int, int, int]:
+        position = LENGTHS_HEADER.size + (id - self.first) * DOC_LENGTHS.size
+        if id < self.first or position + DOC_LENGTHS.size > len(self.data):
+            return 0, 0, 0
+        return DOC_LENGTHS.unpack_from(self.data, position)
+
+    def __contains__(self, id: int) -> bool:
+        return any(self[id])
+
+    def items(self) -> Iterator[Tuple[int, Tuple[int, int, int]]]:
+        """ Yields the doc id and lengths of every document in the table. Slots of documents that were never indexed are empty. """
+        if self.writable:
+            self.file.flush()
+            self.file.seek(LENGTHS_HEADER.size)
+            data = self.file.read()
+        else:
+            data = self.data[LENGTHS_HEADER.size:]
+        for id, lengths in enumerate(DOC_LENGTHS.iter_unpack(data), self.first):
+            if any(lengths):
+                yield id, lengths
+
+    def close(self) -> None:
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.file.close()
+
+def cap(lengths: Tuple[int, int, int]) -> Tuple[int, int, int]:
+    """ Caps each length at the largest its slot holds. """
+    return min(lengths[0], 0xFFFFFFFF), *(min(length, 0xFFFF) for length in lengths[1:])
+
+def write_lengths(path: Path, lengths: Dict[int, Tuple[int, int, int]]) -> None:
+    """ Writes the doc table of a segment, given the lengths of each of its documents. """
+    first = min(lengths, default=0)
+    totals = [sum(field) for field in zip(*lengths.values())] or [0, 0, 0]
+    slots = bytearray(DOC_LENGTHS.size * (max(lengths, default=-1) - first + 1))
+    for id, document_lengths in lengths.items():
+        DOC_LENGTHS.pack_into(slots, (id - first) * DOC_LENGTHS.size, *cap(document_lengths))
+    with open(path, "wb") as file:
+        file.write(LENGTHS_HEADER.pack(first, len(lengths), *(total / max(1, len(lengths)) for total in totals)))
+        file.write(slots)
@@ -0,0 +1,187 @@
+""" The document table of the index: the path, url and title of each document, and an extract of its text for snippets.
+
+Each doc id has a fixed-width slot in docs.bin, holding the offset of its record in documents.dat plus one, leaving
+zero for ids that were never written, and the length of each part of the record. A record is the path, url and title
+of the document in UTF-8, then the first EXTRACT_LENGTH characters of its visible text, one string per line, compressed
+with zlib. The search engine opens both files with mmap, so a page of results reads only the slots and records of its
+results, and takes their snippets from the extracts without reading or parsing the pages.
+
+An index whose documents are listed in crawled.txt, as older versions of the indexer saved them, can be converted.
+Each page is read once to take its extract. The documents are found through the binary offset table of crawled.txt,
+so an index with text postings is converted with python -m shared.postings convert instead, which converts its
+postings and offsets first and then its documents. This command is for an index whose postings are already binary.
+
+Usage: python -m shared.documents convert [inverted_indexer/indices/] [--delete]
+"""
+from argparse import ArgumentParser
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+from shared.dictionary import BLOCK_OFFSET, OFFSETS_FILE, OffsetTable, open_mmap, write_slots
+from shared.tokenizer import WORD, normalize, stem
+from shared.webpage import WebPage
+import struct
+import mmap
+import zlib
+import os
+
+DOC_SLOT = struct.Struct("<QIIII")          # Offset of the record plus one, and the bytes of its path, url, title and extract.
+EXTRACT_LENGTH = 8192                       # Characters of each document's text kept for snippets.
+COMPRESSION_LEVEL = 6
+SNIPPET_WORDS = 30                          # Words in a snippet.
+LEADING_WORDS = 5                           # Words of a snippet before the first word of the query in it.
+DOCS_FILE = "docs.bin"
+RECORDS_FILE = "documents.dat"
+
+class Document(NamedTuple):
+    path: str
+    url: str
+    title: str
+
+def compress_extract(text: List[str]) -> bytes:
+    """ Returns the extract of a document's visible text, compressed. Strings have their whitespace collapsed, so they are kept one per line. """
+    return zlib.compress("\n".join(text)[:EXTRACT_LENGTH].encode("utf-8"), COMPRESSION_LEVEL)
+
+def snippet(text: str, tokens: List[str], length=SNIPPET_WORDS) -> str:
+    """ Returns the run of words of the text with the most words of the query, with those words in bold.
+    A word of the text is a word of the query if it or its stem is one of the query's tokens. Words are told apart by their stem.
+    """
+    words = WORD.findall(text)
+    tokens = set(tokens)
+    matches: List[Tuple[int, str]] = []         # Position and stem of each word of the query in the text.
+    for i, word in enumerate(words):
+        if (token := normalize(word)) and (token in tokens or stem(token) in tokens):
+            matches.append((i, stem(token)))
+
+    # Slide a window of the snippet's length over the matches, keeping the one with the most different words of the query.
+    first, most, counts, left = 0, 0, Counter(), 0
+    for position, token_stem in matches:
+        counts[token_stem] += 1
+        while position - matches[left][0] >= length:
+            counts[matches[left][1]] -= 1
+            if not counts[matches[left][1]]:
+                del counts[matches[left][1]]
+            left += 1
+        if len(counts) > most:
+            first, most = matches[left][0], len(counts)
+
+    start = max(0, min(first - LEADING_WORDS, len(words) - length)) if matches else 0
+    end = min(len(words), start + length)
+    bold = {position for position, _ in matches}
+    snippet_words = [f"**{words[i]}**" if i in bold else words[i] for i in range(start, end)]
+    return ("... " if start else "") + " ".join(snippet_words) + (" ..." if end < len(words) else "")
+
+class DocTable:
+    """ The path, url, title and extract of each document, in a slot per doc id and a file of records.
+    A writable table appends records, and writes their slots, as documents are indexed.
+    """
+
+    def __init__(self, folder: Path, writable=False):
+        self.folder = folder
+        self.writable = writable
+        if writable:
+            self.file = open(folder / DOCS_FILE, "r+b" if os.path.exists(folder / DOCS_FILE) else "w+b")
+            self.records_file = open(folder / RECORDS_FILE, "ab")
+            self.position = self.records_file.tell()     # Offset of the next record.
+            self.data = self.records = b""
+        else:
+            self.file, self.data = open_mmap(folder / DOCS_FILE)
+            self.records_file, self.records = open_mmap(folder / RECORDS_FILE)
+
+    def update(self, documents: Dict[int, Tuple[str, str, str, bytes]]) -> None:
+        """ Writes the path, url, title and compressed extract of each id, with one write for the records and one for each run of consecutive ids. """
+        records, slots = bytearray(), {}
+        for id, (path, url, title, extract) in sorted(documents.items()):
+            parts = [part.encode("utf-8") for part in (path, url, title)] + [extract]
+            slots[id] = (self.position + len(records) + 1, *map(len, parts))
+            records += b"".join(parts)
+        self.records_file.write(records)
+        self.position += len(records)
+        write_slots(self.file, 0, DOC_SLOT, slots)
+
+    def slot(self, id: int) -> Optional[Tuple[int, int, int, int, int]]:
+        position = id * DOC_SLOT.size
+        if id < 0 or position + DOC_SLOT.size > len(self.data):
+            return None
+        slot = DOC_SLOT.unpack_from(self.data, position)
+        return slot if slot[0] else None
+
+    def get(self, id: int) -> Optional[Document]:
+        """ Returns the path, url and title of a document. """
+        if not (slot := self.slot(id)):
+            return None
+        offset, path_length, url_length, title_length, _ = slot
+        start = offset - 1
+        path = self.records[start:start + path_length].decode("utf-8")
+        url = self.records[start + path_length:start + path_length + url_length].decode("utf-8")
+        title = self.records[start + path_length + url_length:start + path_length + url_length + title_length].decode("utf-8")
+        return Document(path, url, title)
+
+    def extract(self, id: int) -> str:
+        """ Returns the extract of a document's text, one string per line. """
+        if not (slot := self.slot(id)):
+            return ""
+        offset, *lengths = slot
+        start = offset - 1 + sum(lengths[:3])
+        return zlib.decompress(self.records[start:start + lengths[3]]).decode("utf-8") if lengths[3] else ""
+
+    def __iter__(self) -> Iterator[Tuple[int, Document]]:
+        """ Yields the id and document of every document in the table. """
+        for id in range(len(self.data) // DOC_SLOT.size):
+            if document := self.get(id):
+                yield id, document
+
+    def flush(self) -> None:
+        self.records_file.flush()
+        self.file.flush()
+
+    def close(self) -> None:
+        for data in (self.data, self.records):
+            if isinstance(data, mmap.mmap):
+                data.close()
+        self.records_file.close()
+        self.file.close()
+
+def convert(folder: Path, delete=False) -> int:
+    """ Converts the crawled.txt of an older index in the folder into a document table, with extracts from the pages it lists.
+    Needs the binary offset table of crawled.txt, which shared.postings.convert writes before calling this.
+    Returns the number of documents converted.
+    """
+    folder = Path(folder)
+    offsets = OffsetTable(folder / OFFSETS_FILE)
+    table = DocTable(folder, writable=True)
+    count = 0
+    with open(folder / "crawled.txt", "r", encoding="utf-8") as crawled:
+        documents = {}
+        for id in range(len(offsets.data) // BLOCK_OFFSET.size):
+            if (offset := offsets.get(id)) is None:
+                continue
+            # Each document is its file path, url and title on a line each.
+            crawled.seek(offset)
+            path, url, title = (crawled.readline().strip() for _ in range(3))
+            try:
+                extract = compress_extract(WebPage.from_path(path).get_text())
+            except (OSError, ValueError):
+                extract = b""
+            documents[id] = (path, url, title, extract)
+            if len(documents) >= 1000:
+                table.update(documents)
+                count += len(documents)
+                documents = {}
+        table.update(documents)
+        count += len(documents)
+    table.close()
+    offsets.close()
+
+    if delete:
+        for file in ("crawled.txt", OFFSETS_FILE):
+            os.remove(folder / file)
+    return count
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("command", choices=["convert"])
+    parser.add_argument("folder", nargs="?", default="inverted_indexer/indices")
+    parser.add_argument("--delete", action="store_true", default=False, help="Delete crawled.txt and its index after converting them")
+    args = parser.parse_args()
+    print(f"Converted {convert(Path(args.folder), args.delete)} documents into {Path(args.folder) / DOCS_FILE}.")
@@ -0,0 +1,225 @@
+""" An append-only store of compressed webpages, replacing one JSON file per page.
+
+Pages are kept in segment files, each holding zlib-compressed JSON records back to back. Next to each
+segment is an index of fixed-width (offset, length) entries, one per record, appended after the record.
+A page is referred to by "<segment path>#<offset>,<length>", which is enough to read it without the index.
+
+The crawler also appends each page it adds, changes or finds deleted to a change list in the same folder,
+so the indexer can drop the versions of pages that were replaced.
+
+Usage: python -m shared.pagestore migrate [pages/] [--delete]
+"""
+from argparse import ArgumentParser
+from threading import Lock
+from pathlib import Path
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple
+import msgspec
+import struct
+import time
+import zlib
+import os
+
+INDEX_ENTRY = struct.Struct("<QI")          # Offset and length of a record in its segment.
+SEGMENT_SIZE = 256 * 1024 * 1024            # Segments are rotated once they reach this many bytes.
+CHANGE_LIST = "changes.jsonl"               # File name of the change list in a pages folder.
+COMPRESSION_LEVEL = 1                       # Fastest zlib level, so compressing pages does not slow down the crawler.
+
+encoder = msgspec.json.Encoder()
+
+def is_record_ref(path) -> bool:
+    return "#" in str(path)
+
+def parse_ref(ref: str) -> Tuple[str, int, int]:
+    segment, position = ref.rsplit("#", 1)
+    offset, length = position.split(",")
+    return segment, int(offset), int(length)
+
+def encode_record(url: str, content: str, encoding: str = "utf-8", **fields) -> bytes:
+    """ Returns the compressed record of a page. Records can be encoded in other processes and appended by the writer. """
+    return zlib.compress(encoder.encode({"url": url, "content": content, "encoding": encoding, **fields}), COMPRESSION_LEVEL)
+
+class PageStoreWriter:
+    """ Appends pages to the newest segment of a folder. Can be shared by the crawler's threads. """
+
+    def __init__(self, folder: Path, segment_size: int = SEGMENT_SIZE):
+        self.folder = Path(folder)
+        self.segment_size = segment_size
+        self.lock = Lock()
+        self.folder.mkdir(parents=True, exist_ok=True)
+
+        segments = list_segments(self.folder)
+        self.segment_number = int(segments[-1].stem.split("-")[1]) if segments else 0
+        self.segment: BinaryIO = None
+        self.index: BinaryIO = None
+        self.open_segment()
+
+    def open_segment(self) -> None:
+        """ Opens the current segment for appending, dropping any record that was not fully indexed. """
+        segment_path = self.folder / f"segment-{self.segment_number:05}.dat"
+        index_path = segment_path.with_suffix(".idx")
+        entries = read_index(index_path) if index_path.exists() else []
+        end = entries[-1][0] + entries[-1][1] if entries else 0
+
+        self.segment = open(segment_path, "ab")
+        self.segment.truncate(end)
+        self.index = open(index_path, "ab")
+        self.index.truncate(len(entries) * INDEX_ENTRY.size)
+        self.segment_path = segment_path
+        self.position = end
+
+    def write(self, url: str, content: str, encoding: str = "utf-8", **fields) -> str:
+        """ Appends a page and returns the reference to it. Extra fields, like title and text, are stored with it. """
+        return self.write_record(encode_record(url, content, encoding, **fields))
+
+    def write_record(self, record: bytes) -> str:
+        """ Appends a record made by encode_record and returns the reference to it. """
+        with self.lock:
+            if self.position and self.position + len(record) > self.segment_size:
+                self.close()
+                self.segment_number += 1
+                self.open_segment()
+            offset = self.position
+            self.segment.write(record)
+            self.segment.flush()
+            self.index.write(INDEX_ENTRY.pack(offset, len(record)))
+            self.index.flush()
+            self.position += len(record)
+            return f"{self.segment_path}#{offset},{len(record)}"
+
+    def close(self) -> None:
+        self.segment.close()
+        self.index.close()
+
+class PageStoreReader:
+    """ Reads pages from the segments of a folder. """
+
+    def __init__(self, folder: Path):
+        self.folder = Path(folder)
+        self.files: Dict[str, BinaryIO] = {}
+
+    def refs(self) -> Iterator[Tuple[str, int]]:
+        """ Yields the reference and compressed size of every page, in the order they were written. """
+        for segment in list_segments(self.folder):
+            for offset, length in read_index(segment.with_suffix(".idx")):
+                yield f"{segment}#{offset},{length}", length
+
+    def scan(self) -> Iterator[Tuple[str, bytes]]:
+        """ Yields the reference and JSON of every page, reading each segment sequentially. """
+        for segment in list_segments(self.folder):
+            with open(segment, "rb", buffering=1024 * 1024) as f:
+                position = 0
+                for offset, length in read_index(segment.with_suffix(".idx")):
+                    if offset != position:
+                        f.seek(offset)
+                    position = offset + length
+                    yield f"{segment}#{offset},{length}", zlib.decompress(f.read(length))
+
+    def read(self, ref: str) -> bytes:
+        """ Returns the JSON of the referenced page. """
+        segment, offset, length = parse_ref(ref)
+        if not (f := self.files.get(segment)):
+            f = self.files[segment] = open(segment, "rb")
+        return zlib.decompress(os.pread(f.fileno(), length, offset))
+
+    def close(self) -> None:
+        for f in self.files.values():
+            f.close()
+        self.files = {}
+
+class Change(msgspec.Struct):
+    url: str
+    change: str                         # "added", "changed" or "deleted".
+    ref: Optional[str] = None           # Reference to the page's new version, unless it was deleted.
+    previous: Optional[str] = None      # Reference to the version it replaced, unless it was added.
+    time: float = 0
+
+class ChangeLog:
+    """ An append-only list of the pages added, changed and deleted by each crawl, one JSON object per line. """
+
+    def __init__(self, folder: Path):
+        self.path = Path(folder) / CHANGE_LIST
+        self.lock = Lock()
+        self.file = None
+
+    def append(self, url: str, ref: Optional[str], previous: Optional[str]) -> Change:
+        """ Records a page's new version, replacing the previous one. A missing ref means the page was deleted. """
+        change = Change(url, "deleted" if not ref else "changed" if previous else "added", ref, previous, time.time())
+        line = encoder.encode(change) + b"\n"
+        with self.lock:
+            if self.file is None:
+                self.file = open(self.path, "ab")
+            self.file.write(line)
+            self.file.flush()
+        return change
+
+    def __iter__(self) -> Iterator[Change]:
+        if not self.path.exists():
+            return
+        decoder = msgspec.json.Decoder(Change)
+        with open(self.path, "rb") as f:
+            for line in f:
+                # A line cut short by a crash is ignored.
+                if line.endswith(b"\n"):
+                    yield decoder.decode(line)
+
+    def superseded(self) -> Iterator[str]:
+        """ Yields the references of every page version that was changed or deleted since. """
+        for change in self:
+            if change.previous:
+                yield change.previous
+
+    def close(self) -> None:
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+def list_segments(folder: Path) -> List[Path]:
+    return sorted(Path(folder).glob("segment-*.dat"))
+
+def read_index(path: Path) -> List[Tuple[int, int]]:
+    with open(path, "rb") as f:
+        data = f.read()
+    # Ignore a partially written entry at the end of the index.
+    return list(INDEX_ENTRY.iter_unpack(data[:len(data) - len(data) % INDEX_ENTRY.size]))
+
+reader = PageStoreReader(".")   # Shared reader for looking up pages by reference.
+
+def read_record(ref: str) -> bytes:
+    return reader.read(ref)
+
+def migrate(folder: Path, delete=False) -> int:
+    """ Moves the JSON files under a pages folder into segments in the same folder. Returns the number of pages moved.
+    Pages whose url is already in the segments, such as from an earlier run that was stopped, are not written again.
+    """
+    folder = Path(folder)
+    urls = {msgspec.json.decode(record)["url"] for _, record in PageStoreReader(folder).scan()}
+    writer = PageStoreWriter(folder)
+    count = 0
+    for path in sorted(folder.rglob("*.json")):
+        with open(path, "rb") as f:
+            page = msgspec.json.decode(f.read())
+        if page["url"] in urls:
+            continue
+        urls.add(page["url"])
+        writer.write(**page)
+        count += 1
+        if count % 1000 == 0:
+            print(f"Migrated {count} pages.")
+    writer.close()
+
+    # Only remove the files once every page has been written.
+    if delete:
+        for path in folder.rglob("*.json"):
+            os.remove(path)
+        for directory in sorted(folder.iterdir(), reverse=True):
+            if directory.is_dir() and not any(directory.iterdir()):
+                directory.rmdir()
+    return count
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("command", choices=["migrate"])
+    parser.add_argument("folder", nargs="?", default="pages")
+    parser.add_argument("--delete", action="store_true", default=False, help="Delete the JSON files after migrating them")
+    args = parser.parse_args()
+    print(f"Migrated {migrate(Path(args.folder), args.delete)} pages into segments.")
@@ -0,0 +1,37 @@
+from typing import List
+from urllib.parse import urldefrag, urljoin
+import lxml.html
+import lxml.etree
+import re
+
+class ParsedPage:
+    """ A webpage parsed once with lxml, providing its title, outlinks, visible text and the text of its headings. """
+
+    def __init__(self, content: bytes, url: str):
+        self.url = url
+        self.title = ""
+        self.links: List[str] = []
+        self.text: List[str] = []
+        self.headings: List[str] = []
+
+        try:
+            tree = lxml.html.fromstring(content)
+        except (lxml.etree.ParserError, ValueError):
+            return
+
+        # The last title tag is the page's title.
+        titles = tree.xpath("//title")
+        self.title = titles[-1].text_content().strip() if titles else ""
+
+        # Links in 'a' tags, resolved against the page url and without fragments.
+        self.links = [urldefrag(urljoin(url, href))[0] for href in tree.xpath("//a/@href")]
+
+        # Visible text is every text node outside of these tags, with whitespace collapsed.
+        for element in tree.xpath("//style|//script|//code|//head"):
+            if element.getparent() is not None:
+                element.drop_tree()
+        strings = (string.strip() for string in tree.itertext())
+        self.text = [re.sub(r'\s+', ' ', string) for string in strings if string]
+
+        # The visible text of each h1, h2 and h3 tag. A heading inside another counts towards each of them.
+        self.headings = [re.sub(r'\s+', ' ', heading.text_content()).strip() for heading in tree.xpath("//h1|//h2|//h3")]
@@ -1,42 +1,35 @@
-from typing import Dict, Self
+from typing import Dict, List, Self, Tuple
 from shared.tokenizer import *
-from bs4 import BeautifulSoup
+from shared.postings import encode_positions, pack_fields
 
 class Posting: 
-    @staticmethod
-    def get_postings(soup: BeautifulSoup, id: int) -> Dict[str, Self]:
-        # Returns a dict of tokens to postings for this file.
-        # Extract text from webpage content.
-        text = extract_text(soup)
-        # Tokenize text.
-        frequencies = tokenize_with_ngrams(text)
-        for token, count in tokenize_with_ngrams(text, stem=True).items():
-            if token not in frequencies:
-                frequencies[token] = count
+    __slots__ = ("id", "value", "positions")
 
-        # Add emphasis on important html tags.
-        weights = [("title", 100000), ("h1", 10000), ("h2", 1000), ("h3", 100), ("strong", 10)]
-        for tag_type, weight in weights:
-            for tag in soup.find_all(tag_type):
-                tag_string = [" ".join([s.lower() for s in re.findall(r'\b[a-zA-Z0-9]+\b', tag.text)])]
-                tokens = tokenize_with_ngrams(tag_string) | tokenize_with_ngrams(tag_string, stem=True)
-                for token in frequencies:
-                    if token in tokens:
-                        frequencies[token] += weight-1
+    @staticmethod
+    def get_postings(text: List[str], headings: List[str], title: str, id: int) -> Tuple[Dict[str, Self], Tuple[int, int, int]]:
+        # Returns a dict of tokens to postings for this file, and the number of words in its body, headings and title.
+        # Each posting holds the frequency of its token in each of these fields, packed into one integer, and its positions in the body.
+        # The fields are the visible text, headings and title of the page, as parsed by the crawler.
+        (positions, headings, title), lengths = count_fields(text, headings, title)
 
         # Create postings for each token and return dict.
-        return {token: Posting(id, frequency) for token, frequency in frequencies.items()}
+        tokens = set().union(positions, headings, title)
+        return {
+            token: Posting(id, pack_fields((len(positions.get(token, ())), headings.get(token, 0), title.get(token, 0))), encode_positions(positions.get(token, ())))
+            for token in tokens
+        }, lengths
 
-    def __init__(self, id: int, tf_idf: float) -> Self: 
+    def __init__(self, id: int, value: float, positions: bytes = b"") -> Self: 
         self.id = id
-        self.tf_idf = tf_idf
+        self.value = value          # The packed frequencies of the token in each field, or its tf-idf in the old text index.
+        self.positions = positions  # The positions of the token in the body, encoded by shared.postings.
 
     def __str__(self) -> str:
-        return f"{self.id},{self.tf_idf:.3f}"
+        return f"{self.id},{self.value:.3f}"
         
     @classmethod
     def from_string(cls: Self, string: str) -> Self:
         data = string.split(",")
         id = int(data[0])
-        tf_idf = float(data[1])
-        return cls(id, tf_idf)
\ No newline at end of file
+        value = float(data[1])
+        return cls(id, value)
\ No newline at end of file
@@ -0,0 +1,391 @@
+""" A binary format for postings lists, replacing lines of "token:id,score;id,score;..." text.
+
+Each token's entry is its length-prefixed name, a header, a skip entry per block, and the blocks themselves.
+A block holds up to BLOCK_SIZE postings: a width byte and the doc ids as differences from the previous id,
+then a width byte and the values. Widths are 1, 2 or 4 bytes, the smallest that fits the block, so decoding
+a block is one copy into an array. Values are either scores quantized to 16 bits against the token's highest
+score, or integers holding the token's term frequency in each field of the document, packed into FIELD_BITS.
+Skip entries hold each block's last doc id, offset and highest value, or highest frequency of each field, so a
+reader can jump to the block holding a doc id without decoding the ones before it.
+
+Integer lists can also hold the positions of the token in the body of each document, after the values of each
+block: a width byte and the length of each posting's positions in bytes, then the positions as differences from
+the previous position, in variable-length bytes of 7 bits each. Blocks without them end after their values, so
+searches that don't need positions never read them, and merges copy each posting's positions without decoding them.
+
+The indexer writes the index into index.bin, and the byte offset of each token into a term dictionary.
+
+An index written by older versions of the indexer, as index.txt and crawled.txt, can be converted. Converting it
+converts its crawled.txt into a document table as well, as python -m shared.documents convert does.
+
+Usage: python -m shared.postings convert [inverted_indexer/indices/] [--delete]
+"""
+from argparse import ArgumentParser
+from array import array
+from itertools import accumulate, chain, groupby
+from operator import itemgetter
+from pathlib import Path
+from typing import BinaryIO, Iterable, Iterator, List, Optional, Sequence, Tuple
+import heapq
+from shared.dictionary import DICTIONARY_FILE, OFFSETS_FILE, OffsetTable, TermDictionaryWriter
+import struct
+import mmap
+import sys
+import os
+
+BLOCK_SIZE = 128                            # Postings per block.
+TOKEN_LENGTH = struct.Struct("<H")          # Length of the token's name in bytes.
+LIST_HEADER = struct.Struct("<IIf")         # Bytes after the header, number of postings, and the score scale (0 for integers).
+SKIP_ENTRY = struct.Struct("<IIf")          # Last doc id, offset from the first block, and highest value of a block.
+FIELD_SKIP_ENTRY = struct.Struct("<III")    # The same for integer values, with the highest of each field of the block packed together.
+SCALE = struct.Struct("<f")                 # The score scale as the header stores it.
+TYPECODES = {1: "B", 2: "H", 4: "I"}        # Array typecodes for each width.
+QUANTIZED_MAX = 65535                       # Scores are stored as multiples of the token's highest score / QUANTIZED_MAX.
+READ_BUFFER = 1024 * 1024                   # Bytes read at a time, so merging many files reads each in large chunks.
+SINGLE_BLOCKS = {                           # Blocks of one posting, keyed by the widths of the doc id and value.
+    (id_width, value_width): struct.Struct(f"<B{TYPECODES[id_width]}B{TYPECODES[value_width]}")
+    for id_width in TYPECODES for value_width in TYPECODES
+}
+FIELD_BITS = (20, 8, 4)                     # Bits of the body, heading and title frequencies in an integer value, from the lowest.
+INDEX_FILE = "index.bin"
+
+def width_of(value: int) -> int:
+    return 1 if value < 0x100 else 2 if value < 0x10000 else 4
+
+def pack(values: Sequence[int], width: int) -> bytes:
+    packed = array(TYPECODES[width], values)
+    if sys.byteorder == "big":
+        packed.byteswap()
+    return bytes((width,)) + packed.tobytes()
+
+def unpack(data, start: int, count: int) -> Tuple[array, int]:
+    # Returns the array packed at start, and the position after it.
+    width = data[start]
+    values = array(TYPECODES[width])
+    values.frombytes(data[start + 1:start + 1 + count * width])
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values, start + 1 + count * width
+
+def pack_fields(frequencies: Sequence[int]) -> int:
+    """ Packs a frequency for each field into one integer, capping each at the largest its bits hold. """
+    value, shift = 0, 0
+    for frequency, bits in zip(frequencies, FIELD_BITS):
+        value |= min(frequency, (1 << bits) - 1) << shift
+        shift += bits
+    return value
+
+def unpack_fields(value: int) -> Tuple[int, ...]:
+    fields, shift = [], 0
+    for bits in FIELD_BITS:
+        fields.append((value >> shift) & ((1 << bits) - 1))
+        shift += bits
+    return tuple(fields)
+
+def field_maxima(values: Iterable[int]) -> int:
+    """ Returns the highest of each field of the values, packed together. """
+    values = list(values)
+    top = max(values, default=0)
+    # Most values only have a body frequency, and then the highest value is the highest of each field.
+    if top < 1 << FIELD_BITS[0]:
+        return top
+    return pack_fields([max(fields) for fields in zip(*map(unpack_fields, values))])
+
+def encode_positions(positions: Iterable[int]) -> bytes:
+    """ Encodes increasing positions as the differences between them, in variable-length bytes. """
+    encoded, previous = bytearray(), 0
+    for position in positions:
+        gap = position - previous
+        previous = position
+        while gap >= 0x80:
+            encoded.append(gap & 0x7F | 0x80)
+            gap >>= 7
+        encoded.append(gap)
+    return bytes(encoded)
+
+def decode_positions(data: bytes) -> List[int]:
+    if not data:
+        return []
+    # Positions of frequent tokens are usually less than 128 apart, so every gap after the first is one byte.
+    first = 0
+    while data[first] & 0x80:
+        first += 1
+    if data[first + 1:].isascii():
+        return list(accumulate(data[first + 1:], initial=sum((byte & 0x7F) << 7 * i for i, byte in enumerate(data[:first + 1]))))
+
+    positions, position, gap, shift = [], 0, 0, 0
+    for byte in data:
+        gap |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            position += gap
+            positions.append(position)
+            gap, shift = 0, 0
+    return positions
+
+def pack_positions(positions: Sequence[bytes]) -> bytes:
+    """ Packs the encoded positions of each posting of a block after the length of each. """
+    lengths = [len(encoded) for encoded in positions]
+    return pack(lengths, width_of(max(lengths))) + b"".join(positions)
+
+def encode_postings(ids: Sequence[int], values: Sequence[float], quantize=True, positions: Sequence[bytes] = None) -> bytes:
+    """ Encodes a postings list, given its doc ids in increasing order and a value for each.
+    Values are quantized to 16 bits if quantize is set, and are otherwise stored as non-negative integers,
+    optionally along with the encoded positions of each posting.
+    """
+    top = max(values, default=0)
+    scale = top / QUANTIZED_MAX if quantize and top > 0 else 1.0 if quantize else 0.0
+    # The scale is rounded as the header stores it, so the skip entries hold exactly the highest value each block decodes to.
+    scale = SCALE.unpack(SCALE.pack(scale))[0]
+    stored = [round(value / scale) for value in values] if quantize else values
+
+    # Most tokens are found in one document, so their block is packed in one go.
+    if len(ids) == 1:
+        id_width, value_width = width_of(ids[0]), 2 if quantize else width_of(stored[0])
+        skip = SKIP_ENTRY.pack(ids[0], 0, stored[0] * scale) if quantize else FIELD_SKIP_ENTRY.pack(ids[0], 0, stored[0])
+        body = skip + SINGLE_BLOCKS[id_width, value_width].pack(id_width, ids[0], value_width, stored[0])
+        if positions is not None:
+            body += pack_positions(positions)
+        return LIST_HEADER.pack(len(body), 1, scale) + body
+
+    skips, blocks, offset, previous = [], [], 0, 0
+    for start in range(0, len(ids), BLOCK_SIZE):
+        block_ids = ids[start:start + BLOCK_SIZE]
+        block_values = stored[start:start + BLOCK_SIZE]
+        deltas = [id - before for before, id in zip(chain((previous,), block_ids), block_ids)]
+        block = pack(deltas, width_of(max(deltas))) + pack(block_values, 2 if quantize else width_of(max(block_values)))
+        if positions is not None:
+            block += pack_positions(positions[start:start + BLOCK_SIZE])
+        skips.append(SKIP_ENTRY.pack(block_ids[-1], offset, max(block_values) * scale) if quantize else FIELD_SKIP_ENTRY.pack(block_ids[-1], offset, field_maxima(block_values)))
+        blocks.append(block)
+        offset += len(block)
+        previous = block_ids[-1]
+
+    body = b"".join(skips) + b"".join(blocks)
+    return LIST_HEADER.pack(len(body), len(ids), scale) + body
+
+class PostingsList:
+    """ A decoder for one token's postings, yielding arrays of doc ids and values a block at a time. """
+
+    def __init__(self, data, count: int, scale: float):
+        self.data = data                    # The skip entries and blocks.
+        self.count = count
+        self.num_blocks = -(-count // BLOCK_SIZE)
+        self.scale = scale
+        self.blocks_start = self.num_blocks * SKIP_ENTRY.size
+
+    @classmethod
+    def from_bytes(cls, data, start=0) -> "PostingsList":
+        """ Reads the postings list encoded at start. """
+        length, count, scale = LIST_HEADER.unpack_from(data, start)
+        start += LIST_HEADER.size
+        return cls(data[start:start + length], count, scale)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def to_bytes(self) -> bytes:
+        """ Returns the encoded postings list, so it can be copied to another file without decoding it. """
+        return LIST_HEADER.pack(len(self.data), self.count, self.scale) + self.data
+
+    def skip(self, block: int) -> Tuple[int, int, float]:
+        """ Returns the last doc id, offset and highest value of the block, or the highest of each field for integer values. """
+        return (SKIP_ENTRY if self.scale else FIELD_SKIP_ENTRY).unpack_from(self.data, block * SKIP_ENTRY.size)
+
+    def max_value(self) -> float:
+        """ Returns the highest value in the list, or the highest of each field for integer values, from the skip entries. """
+        if not self.scale:
+            return field_maxima(entry[2] for entry in FIELD_SKIP_ENTRY.iter_unpack(self.data[:self.blocks_start]))
+        return max((entry[2] for entry in SKIP_ENTRY.iter_unpack(self.data[:self.blocks_start])), default=0)
+
+    def find_block(self, id: int, low=0) -> int:
+        """ Returns the first block from low whose last doc id is at least id, or the number of blocks if there is none. """
+        high = self.num_blocks
+        while low < high:
+            middle = (low + high) // 2
+            if self.skip(middle)[0] < id:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def block(self, block: int) -> Tuple[array, array]:
+        """ Decodes the doc ids and values of the block. """
+        count = min(BLOCK_SIZE, self.count - block * BLOCK_SIZE)
+        previous = self.skip(block - 1)[0] if block else 0
+        deltas, start = unpack(self.data, self.blocks_start + self.skip(block)[1], count)
+        ids = array("I", accumulate(deltas, initial=previous))
+        del ids[0]
+        values, _ = unpack(self.data, start, count)
+        if self.scale:
+            values = array("f", map(self.scale.__mul__, values))
+        elif values.typecode != "I":
+            values = array("I", values)
+        return ids, values
+
+    def block_positions(self, block: int) -> Optional[List[bytes]]:
+        """ Returns the encoded positions of each posting of the block, or None if the list has no positions. """
+        count = min(BLOCK_SIZE, self.count - block * BLOCK_SIZE)
+        start = self.blocks_start + self.skip(block)[1]
+        end = self.blocks_start + self.skip(block + 1)[1] if block + 1 < self.num_blocks else len(self.data)
+        # The positions start after the doc ids and values, whose widths are their first byte.
+        start += 2 + count * (self.data[start] + self.data[start + 1 + count * self.data[start]])
+        if start == end:
+            return None
+        lengths, start = unpack(self.data, start, count)
+        offsets = list(accumulate(lengths, initial=start))
+        return [bytes(self.data[begin:stop]) for begin, stop in zip(offsets, offsets[1:])]
+
+    def positions(self) -> Optional[List[bytes]]:
+        """ Returns the encoded positions of every posting, or None if the list has no positions. """
+        if not self.num_blocks or (first := self.block_positions(0)) is None:
+            return None
+        return first + list(chain.from_iterable(self.block_positions(block) for block in range(1, self.num_blocks)))
+
+    def __iter__(self) -> Iterator[Tuple[array, array]]:
+        for block in range(self.num_blocks):
+            yield self.block(block)
+
+    def decode(self) -> Tuple[array, array]:
+        """ Decodes every doc id and value. """
+        ids, values = array("I"), array("f" if self.scale else "I")
+        for block_ids, block_values in self:
+            ids.extend(block_ids)
+            values.extend(block_values)
+        return ids, values
+
+class DecodedPostingsList(PostingsList):
+    """ A postings list with its skip entries, blocks and positions decoded up front, for postings read by many searches. """
+
+    def __init__(self, postings: PostingsList):
+        super().__init__(postings.data, postings.count, postings.scale)
+        self.skips = [PostingsList.skip(self, block) for block in range(self.num_blocks)]
+        self.highest = PostingsList.max_value(self)
+        self.blocks = [PostingsList.block(self, block) for block in range(self.num_blocks)]
+        self.positions_of_blocks = [PostingsList.block_positions(self, block) for block in range(self.num_blocks)]
+        # Bytes held, counting the encoded list and the decoded arrays, and each encoded position as a bytes object.
+        self.size = sys.getsizeof(self.data) + sum(
+            sum(map(sys.getsizeof, block)) + (sys.getsizeof(positions) + sum(map(sys.getsizeof, positions)) if positions else 0)
+            for block, positions in zip(self.blocks, self.positions_of_blocks)
+        )
+
+    def skip(self, block: int) -> Tuple[int, int, float]:
+        return self.skips[block]
+
+    def max_value(self) -> float:
+        return self.highest
+
+    def block(self, block: int) -> Tuple[array, array]:
+        return self.blocks[block]
+
+    def block_positions(self, block: int) -> Optional[List[bytes]]:
+        return self.positions_of_blocks[block]
+
+def write_entry(file: BinaryIO, token: str, encoded: bytes) -> int:
+    """ Writes a token and its encoded postings to the file, returning the number of bytes written. """
+    name = token.encode("utf-8")
+    return file.write(TOKEN_LENGTH.pack(len(name)) + name + encoded)
+
+def write_postings(file: BinaryIO, token: str, ids: Sequence[int], values: Sequence[float], quantize=True, positions: Sequence[bytes] = None) -> int:
+    """ Encodes and writes a token and its postings to the file, returning the number of bytes written. """
+    return write_entry(file, token, encode_postings(ids, values, quantize, positions))
+
+def iter_postings(path: Path, start=0) -> Iterator[Tuple[str, PostingsList]]:
+    """ Reads every token and its postings from a file, from the entry at start, in the order they were written. """
+    with open(path, "rb", buffering=READ_BUFFER) as file:
+        file.seek(start)
+        while header := file.read(TOKEN_LENGTH.size):
+            name_length = TOKEN_LENGTH.unpack(header)[0]
+            entry = file.read(name_length + LIST_HEADER.size)
+            length, count, scale = LIST_HEADER.unpack_from(entry, name_length)
+            yield entry[:name_length].decode("utf-8"), PostingsList(file.read(length), count, scale)
+
+def merge_postings(indices: Iterable[Iterator[Tuple[str, PostingsList]]]) -> Iterator[Tuple[str, List[PostingsList]]]:
+    """ Merges the entries of files in alphabetical order, yielding each token with its postings from every file that
+    has it, in the order the files were given. A heap keeps the next token of each file, so each token costs O(log k).
+    """
+    for token, entries in groupby(heapq.merge(*indices, key=itemgetter(0)), key=itemgetter(0)):
+        yield token, [postings for _, postings in entries]
+
+class IndexReader:
+    """ Reads tokens and their postings from an index by their byte offset, without loading the index. """
+
+    def __init__(self, path: Path):
+        self.file = open(path, "rb")
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(path) else b""
+
+    def read(self, offset: int) -> Tuple[str, PostingsList]:
+        length = TOKEN_LENGTH.unpack_from(self.data, offset)[0]
+        start = offset + TOKEN_LENGTH.size
+        return bytes(self.data[start:start + length]).decode("utf-8"), PostingsList.from_bytes(self.data, start + length)
+
+    def close(self) -> None:
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.file.close()
+
+class IndexWriter:
+    """ Writes an index and the offset of each of its tokens, given tokens in alphabetical order.
+    Values are quantized scores if quantize is set, and are otherwise integers.
+    """
+
+    def __init__(self, path: Path, dictionary_path: Path, quantize=True):
+        self.file = open(path, "wb")
+        self.quantize = quantize
+        self.dictionary = TermDictionaryWriter(dictionary_path)
+        self.offset = 0
+        self.count = 0
+
+    def write(self, token: str, ids: Sequence[int], values: Sequence[float], positions: Sequence[bytes] = None) -> None:
+        self.dictionary.add(token, self.offset)
+        self.offset += write_postings(self.file, token, ids, values, self.quantize, positions)
+        self.count += 1
+
+    def close(self) -> None:
+        self.file.close()
+        self.dictionary.close()
+
+def convert(folder: Path, delete=False) -> int:
+    """ Converts a text index.txt in the folder into the binary format, along with the index of crawled.txt.
+    The search engine also needs a document table, so crawled.txt is then converted into one with shared.documents.
+    Returns the number of tokens converted.
+    """
+    folder = Path(folder)
+    writer = IndexWriter(folder / INDEX_FILE, folder / DICTIONARY_FILE)
+    count = 0
+    with open(folder / "index.txt", "r") as index:
+        for line in index:
+            token, postings_string = line.rstrip("\n").split(":", 1)
+            postings: List[Tuple[int, float]] = sorted((int(id), float(score)) for id, score in (p.split(",") for p in postings_string.split(";")))
+            writer.write(token, [id for id, _ in postings], [score for _, score in postings])
+            count += 1
+    writer.close()
+
+    # Each line of the text index of crawled.txt is of the form <id>,<file_position>.
+    if (folder / "index_of_crawled.txt").exists():
+        offsets = OffsetTable(folder / OFFSETS_FILE, writable=True)
+        with open(folder / "index_of_crawled.txt", "r") as index:
+            for line in index:
+                id, position = line.split(",")
+                offsets[int(id)] = int(position)
+        offsets.close()
+
+    # The documents are converted once their offsets are, since they are read through them.
+    if (folder / "crawled.txt").exists() and (folder / OFFSETS_FILE).exists():
+        from shared.documents import DOCS_FILE, convert as convert_documents
+        print(f"Converted {convert_documents(folder, delete)} documents into {folder / DOCS_FILE}.")
+
+    if delete:
+        for file in ("index.txt", "index_of_index.txt", "index_of_crawled.txt"):
+            if (folder / file).exists():
+                os.remove(folder / file)
+    return count
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("command", choices=["convert"])
+    parser.add_argument("folder", nargs="?", default="inverted_indexer/indices")
+    parser.add_argument("--delete", action="store_true", default=False, help="Delete the text files after converting them")
+    args = parser.parse_args()
+    print(f"Converted {convert(Path(args.folder), args.delete)} tokens into {Path(args.folder) / INDEX_FILE}.")
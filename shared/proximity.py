@@ -0,0 +1,84 @@
+""" Finds the documents containing a phrase, and scores how close together the words of a query are in documents,
+from the positions of each token in the body of each document.
+
+A phrase is found in a document if its words are at consecutive positions. Consecutive words of a query found in
+order at most WINDOW positions apart add 1 / distance² to the closeness of the pair, which is saturated like a term
+frequency and weighted by the lower idf of the two words, as in BM25TP. Words from different strings of a page are
+never next to each other, since positions skip one between strings.
+"""
+from bisect import bisect_right
+from itertools import pairwise
+from typing import List, Sequence, Tuple
+from shared.postings import PostingsList
+from shared.ranking import BM25FScorer, Ranking, StoredScorer
+from shared.topk import END, Cursor
+
+WINDOW = 5                                  # Largest distance between two words that adds to their closeness.
+
+def phrase_documents(postings: Sequence[PostingsList]) -> List[int]:
+    """ Returns the doc ids of the documents in which the tokens of the postings are one after another, in order. """
+    cursors = [Cursor(token_postings, StoredScorer(), order) for order, token_postings in enumerate(postings)]
+    # Documents are found by moving every cursor to the furthest document any of them is on, starting with the shortest lists.
+    by_length = sorted(cursors, key=lambda cursor: len(cursor.postings))
+    docs = []
+    doc = 0
+    while cursors and doc < END:
+        for cursor in by_length:
+            cursor.advance(doc)
+            if cursor.doc != doc:
+                doc = cursor.doc
+                break
+        else:
+            # The phrase starts wherever each word's position, less its place in the phrase, is the same.
+            starts = set(cursors[0].positions())
+            for offset, cursor in enumerate(cursors[1:], 1):
+                if not starts:
+                    break
+                starts.intersection_update(map((-offset).__add__, cursor.positions()))
+            if starts:
+                docs.append(doc)
+            doc += 1
+    return docs
+
+def closeness(first: Sequence[int], second: Sequence[int]) -> float:
+    """ Returns the sum of 1 / distance² of every position in second that is at most WINDOW after a position in first. """
+    total = 0.0
+    for position in first:
+        start = bisect_right(second, position)
+        for after in second[start:bisect_right(second, position + WINDOW, start)]:
+            total += 1 / (after - position) ** 2
+    return total
+
+class ProximityScorer:
+    """ Scores how close together the consecutive words of a query are in documents. Each word is given as the postings
+    and scorers of its tokens, such as the word and its stem, whose positions are taken together.
+    """
+
+    def __init__(self, ranking: Ranking, words: Sequence[Sequence[Tuple[PostingsList, BM25FScorer]]]):
+        self.k1 = ranking.k1
+        self.weight = ranking.proximity
+        self.words = [[Cursor(token_postings, StoredScorer(), order) for order, (token_postings, _) in enumerate(tokens)] for tokens in words]
+        self.idfs = [max((scorer.idf for _, scorer in tokens), default=0.0) for tokens in words]
+
+    def positions(self, cursors: Sequence[Cursor], doc: int) -> List[int]:
+        """ Returns the positions of any of the tokens of a word in the document. """
+        positions = []
+        for cursor in cursors:
+            cursor.advance(doc)
+            if cursor.doc == doc:
+                positions.extend(cursor.positions())
+        return sorted(positions)
+
+    def score(self, doc: int) -> float:
+        """ Returns the proximity score of a document, given documents in increasing order of doc id. """
+        positions = [self.positions(cursors, doc) for cursors in self.words]
+        total = 0.0
+        for (first, first_idf), (second, second_idf) in pairwise(zip(positions, self.idfs)):
+            if pair := closeness(first, second):
+                total += min(first_idf, second_idf) * pair / (self.k1 + pair)
+        return self.weight * total
+
+    def rerank(self, results: Sequence[Tuple[int, float]], k: int) -> List[Tuple[int, float]]:
+        """ Adds the proximity score of each result to its score, returning the k highest scoring, highest first. """
+        scores = [(doc, score + self.score(doc)) for doc, score in sorted(results)]
+        return sorted(scores, key=lambda item: (-item[1], item[0]))[:k]
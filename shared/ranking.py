@@ -0,0 +1,78 @@
+""" Scores postings at query time with BM25F, from the term frequency of each field stored in the index and the
+length of each field of each document, so the ranking is changed by editing ranking.ini instead of re-indexing.
+
+A token's frequency in each field is divided by the field's length normalization, 1 - b + b * length / average,
+weighted, and added up into one frequency, which is saturated as in BM25: idf * tf / (k1 + tf).
+
+Scores are worked out the same way for the highest frequencies of a block or a token, with a length of 1, which
+only makes the normalization smaller, so they are upper bounds of every score in it for the top k search.
+"""
+from configparser import ConfigParser
+from pathlib import Path
+from typing import List, Sequence
+from shared.dictionary import LengthTable
+from shared.postings import FIELD_BITS, PostingsList
+import math
+
+FIELDS = ("BODY", "HEADING", "TITLE")      # Fields in the order their frequencies are packed into FIELD_BITS.
+
+class Ranking:
+    """ The parameters of BM25F and of the proximity of query words, read from the [RANKING] section of a config file if it exists. """
+
+    def __init__(self, path: Path = Path("ranking.ini")):
+        config = ConfigParser()
+        config.read(path)
+        section = config["RANKING"] if config.has_section("RANKING") else {}
+        self.k1 = float(section.get("K1", 1.2))
+        self.weights = [float(section.get(f"{field}WEIGHT", default)) for field, default in zip(FIELDS, (1.0, 2.0, 5.0))]
+        self.b = [float(section.get(f"{field}B", default)) for field, default in zip(FIELDS, (0.75, 0.5, 0.5))]
+        self.proximity = float(section.get("PROXIMITYWEIGHT", 1.0))
+
+    def scorers(self, postings: Sequence[PostingsList], lengths: LengthTable, statistics=None, frequencies: Sequence[int] = None) -> List:
+        """ Returns a scorer for each token's postings, given the doc table of their documents. The number of documents and the
+        average length of each field are taken from statistics, and the number of documents with each token from frequencies,
+        when they are counted over more than these postings. Indices converted from the text format hold their scores already.
+        """
+        statistics = statistics or lengths
+        frequencies = frequencies or [len(token_postings) for token_postings in postings]
+        return [
+            BM25FScorer(self, statistics, lengths, frequency) if not token_postings.scale else StoredScorer()
+            for token_postings, frequency in zip(postings, frequencies)
+        ]
+
+class BM25FScorer:
+    """ Scores one token's postings, whose values are its frequencies in each field. """
+
+    def __init__(self, ranking: Ranking, statistics, lengths: LengthTable, frequency: int):
+        self.lengths = lengths
+        self.k1 = ranking.k1
+        self.idf = math.log(1 + (statistics.num_documents - frequency + 0.5) / (frequency + 0.5))
+        self.weights = ranking.weights
+        self.norms = [1 - b for b in ranking.b]
+        self.slopes = [b / average if average else 0.0 for b, average in zip(ranking.b, statistics.averages)]
+        self.masks = [(1 << bits) - 1 for bits in FIELD_BITS]
+        self.shifts = [sum(FIELD_BITS[:i]) for i in range(len(FIELD_BITS))]
+
+    def score(self, frequencies: int, lengths: Sequence[int]) -> float:
+        tf = 0.0
+        for weight, norm, slope, mask, shift, length in zip(self.weights, self.norms, self.slopes, self.masks, self.shifts, lengths):
+            if frequency := (frequencies >> shift) & mask:
+                tf += weight * frequency / (norm + slope * length)
+        return self.idf * (1 - self.k1 / (self.k1 + tf)) if tf else 0.0
+
+    def scores(self, ids: Sequence[int], values: Sequence[int]) -> List[float]:
+        """ Returns the score of each posting. """
+        return [self.score(value, self.lengths[id]) for id, value in zip(ids, values)]
+
+    def bound(self, maxima: int) -> float:
+        """ Returns the highest score of postings with the given highest frequency of each field. A field with a token is at least 1 long. """
+        return self.score(maxima, (1, 1, 1))
+
+class StoredScorer:
+    """ Scores postings whose values are their scores. """
+
+    def scores(self, ids: Sequence[int], values: Sequence[float]) -> Sequence[float]:
+        return values
+
+    def bound(self, maximum: float) -> float:
+        return maximum
@@ -0,0 +1,175 @@
+""" The index as a set of immutable segments listed in a manifest, so new pages are searchable without merging the
+whole index again.
+
+Each segment is a folder with its own index.bin, term dictionary and doc table, which holds the length of each field
+of its documents. Every run of the indexer adds a segment with the pages it indexed, and segments are merged in the
+background by size tier. Documents changed or deleted since they were indexed are tombstoned: the manifest lists
+them under the segment holding them, and they are left out of results until that segment is merged.
+
+The manifest is replaced as a whole, and its generation goes up every time it is, so a search engine can tell it
+changed and open the new segments. The number of documents, the average length of each field and the document
+frequency of each token are added up across segments when searching, so a document scores the same whichever segment
+holds it. Tombstoned documents still count towards the document frequencies until they are merged away.
+"""
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Set
+from shared.dictionary import DICTIONARY_FILE, LENGTHS_FILE, LengthTable, TermDictionary
+from shared.postings import INDEX_FILE, IndexReader, PostingsList
+import json
+import time
+import os
+
+MANIFEST_FILE = "manifest.json"
+SEGMENT_PREFIX = "segment-"
+
+class Manifest:
+    """ The segments of the index, the documents tombstoned in each, and the generation of the index. """
+
+    def __init__(self, generation=0, segments: List[Dict] = None, next_segment=0, created: int = None):
+        self.generation = generation
+        self.segments = segments or []      # The name, number of documents and tombstoned doc ids of each segment, oldest first.
+        self.next_segment = next_segment    # Number of the next segment to be written.
+        self.created = created or time.time_ns()    # When the index was started, which tells an index rebuilt from scratch from the last one.
+
+    @classmethod
+    def read(cls, folder: Path) -> "Manifest":
+        """ Reads the manifest in the folder, which is empty if there is none. """
+        if not (Path(folder) / MANIFEST_FILE).exists():
+            return cls()
+        with open(Path(folder) / MANIFEST_FILE, "r", encoding="utf-8") as file:
+            data = json.load(file)
+        return cls(data["generation"], data["segments"], data["next_segment"], data["created"])
+
+    def new_segment(self) -> str:
+        """ Returns the name of a new segment. """
+        self.next_segment += 1
+        return f"{SEGMENT_PREFIX}{self.next_segment - 1:06}"
+
+    def names(self) -> List[str]:
+        return [segment["name"] for segment in self.segments]
+
+    def add(self, name: str, documents: int) -> None:
+        self.segments.append({"name": name, "documents": documents, "deleted": []})
+
+    def replace(self, names: List[str], name: str, documents: int) -> None:
+        """ Replaces merged segments with the segment they were merged into, where the first of them was. """
+        position = self.names().index(names[0])
+        self.segments = [segment for segment in self.segments if segment["name"] not in names]
+        self.segments.insert(position, {"name": name, "documents": documents, "deleted": []})
+
+    def delete(self, folder: Path, ids: Iterable[int]) -> int:
+        """ Tombstones the documents in the segment holding each of them, returning the number newly tombstoned. """
+        ids = set(ids)
+        count = 0
+        for segment in self.segments:
+            lengths = LengthTable(Path(folder) / segment["name"] / LENGTHS_FILE)
+            deleted = set(segment["deleted"])
+            found = {id for id in ids - deleted if id in lengths}
+            lengths.close()
+            segment["deleted"] = sorted(deleted | found)
+            count += len(found)
+        return count
+
+    def commit(self, folder: Path) -> None:
+        """ Writes the manifest as the next generation of the index, replacing the last one at once. """
+        self.generation += 1
+        path = Path(folder) / MANIFEST_FILE
+        with open(path.with_suffix(".tmp"), "w", encoding="utf-8") as file:
+            json.dump({"generation": self.generation, "created": self.created, "next_segment": self.next_segment, "segments": self.segments}, file)
+        os.replace(path.with_suffix(".tmp"), path)
+
+class Segment:
+    """ One segment of the index. Its term dictionary, postings and doc table are opened with mmap. """
+
+    def __init__(self, folder: Path, deleted: Iterable[int] = ()):
+        self.folder = Path(folder)
+        self.dictionary = TermDictionary(self.folder / DICTIONARY_FILE)
+        self.index = IndexReader(self.folder / INDEX_FILE)
+        # Indices converted from the text format hold scores, and have no doc table.
+        self.lengths = LengthTable(self.folder / LENGTHS_FILE) if (self.folder / LENGTHS_FILE).exists() else None
+        self.deleted: Set[int] = set(deleted)
+
+    def postings(self, token: str) -> Optional[PostingsList]:
+        """ Returns the postings of the token, or None if it is not in the segment. """
+        if (offset := self.dictionary.get(token)) is None:
+            return None
+        return self.index.read(offset)[1]
+
+    def close(self) -> None:
+        self.dictionary.close()
+        self.index.close()
+        if self.lengths:
+            self.lengths.close()
+
+class SegmentSet:
+    """ The segments listed in the manifest of an index folder, with the statistics of their documents together. """
+
+    def __init__(self, folder: Path):
+        self.folder = Path(folder)
+        self.segments: List[Segment] = []
+        self.generation = -1
+        self.created = None                 # When the index was started. Segments of an index rebuilt since are not reused.
+        self.modified = None                # When the manifest was last replaced, to tell when to read it again.
+        self.num_documents = 0              # Documents in every segment, less the tombstoned ones.
+        self.total_documents = 0            # Documents in every segment, with the tombstoned ones, which the averages are taken over.
+        self.averages = [0.0, 0.0, 0.0]     # Average length of each field of the documents in every segment.
+        self.refresh()
+
+    def refresh(self) -> bool:
+        """ Opens segments added to the manifest since it was last read, and closes the ones merged away.
+        Returns whether the segments changed.
+        """
+        if not self.changed():
+            return False
+        path = self.folder / MANIFEST_FILE
+        if not path.exists():
+            # Indices from before segments, such as converted ones, are read as one segment in the index folder.
+            self.segments, self.generation = [Segment(self.folder)], 0
+            self.update_statistics()
+            return True
+        stat = os.stat(path)
+        self.modified = stat.st_mtime_ns, stat.st_size
+        manifest = Manifest.read(self.folder)
+        if (manifest.created, manifest.generation) == (self.created, self.generation):
+            return False
+
+        # Segments are never changed once written, so the ones still listed are kept open, unless the index was rebuilt.
+        opened = {segment.folder.name: segment for segment in self.segments} if manifest.created == self.created else {}
+        segments = []
+        for entry in manifest.segments:
+            segment = opened.pop(entry["name"], None) or Segment(self.folder / entry["name"])
+            segment.deleted = set(entry["deleted"])
+            segments.append(segment)
+        for segment in set(self.segments) - set(segments):
+            segment.close()
+        self.segments, self.generation, self.created = segments, manifest.generation, manifest.created
+        self.update_statistics()
+        return True
+
+    def changed(self) -> bool:
+        """ Returns whether the manifest may have been replaced since it was read, without opening any segments. """
+        path = self.folder / MANIFEST_FILE
+        if not path.exists():
+            return self.generation == -1 and (self.folder / INDEX_FILE).exists()
+        stat = os.stat(path)
+        return (stat.st_mtime_ns, stat.st_size) != self.modified
+
+    def update_statistics(self) -> None:
+        counts = [segment.lengths.num_documents if segment.lengths else 0 for segment in self.segments]
+        total = self.total_documents = sum(counts)
+        self.num_documents = total - sum(len(segment.deleted) for segment in self.segments)
+        self.averages = [
+            sum(count * segment.lengths.averages[field] for count, segment in zip(counts, self.segments) if segment.lengths) / max(1, total)
+            for field in range(3)
+        ]
+
+    def __iter__(self) -> Iterator[Segment]:
+        return iter(self.segments)
+
+    def __len__(self) -> int:
+        return len(self.segments)
+
+    def close(self) -> None:
+        for segment in self.segments:
+            segment.close()
+        self.segments = []
@@ -0,0 +1,81 @@
+""" Splits the index into shards by the domain of each page, so a search can be spread over processes or machines.
+
+A sharded index folder holds a folder per shard, shard-00, shard-01 and so on, each a whole index of its own, with its
+manifest, segments and document table. Pages are given to a shard by a hash of their domain, so the pages of a domain
+stay together, and documents keep the ids they would have in one index, so results are merged by doc id as well.
+
+Each shard counts the documents, field lengths and documents with each token of its own segments. A search adds them
+up over every shard before scoring, so a document scores the same in a sharded index as in a single one.
+"""
+from pathlib import Path
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+from urllib.parse import urlparse
+from shared.documents import DocTable, Document
+from shared.segments import MANIFEST_FILE
+import zlib
+import os
+
+SHARD_PREFIX = "shard-"
+
+class Statistics(NamedTuple):
+    """ The statistics documents are scored with: the number of documents, with and without the tombstoned ones, the
+    average length of each field, and the number of documents with each token of a query.
+    """
+    num_documents: int
+    total_documents: int
+    averages: List[float]
+    frequencies: Dict[str, int]
+
+    @classmethod
+    def combine(cls, shards: Iterable["Statistics"]) -> "Statistics":
+        """ Adds up the statistics of every shard. The averages are weighted by the documents they were taken over. """
+        shards = list(shards)
+        total = sum(shard.total_documents for shard in shards)
+        frequencies: Dict[str, int] = {}
+        for shard in shards:
+            for token, frequency in shard.frequencies.items():
+                frequencies[token] = frequencies.get(token, 0) + frequency
+        return cls(
+            sum(shard.num_documents for shard in shards), total,
+            [sum(shard.averages[field] * shard.total_documents for shard in shards) / max(1, total) for field in range(3)],
+            frequencies,
+        )
+
+def shard_of(url: str, num_shards: int) -> int:
+    """ Returns the shard of a page, from a hash of its domain that is the same in every process. """
+    return zlib.crc32((urlparse(url).hostname or "").encode("utf-8")) % num_shards if num_shards > 1 else 0
+
+def shard_folder(folder: Path, shard: int, num_shards: int) -> Path:
+    """ Returns the folder of a shard. An index of one shard is kept in the folder itself, as an unsharded index is. """
+    return Path(folder) / f"{SHARD_PREFIX}{shard:02}" if num_shards > 1 else Path(folder)
+
+def shard_folders(folder: Path) -> List[Path]:
+    """ Returns the folder of each shard of a sharded index, or none if the index is not sharded. """
+    return sorted(path for path in Path(folder).glob(f"{SHARD_PREFIX}*") if path.is_dir())
+
+def manifest_version(folder: Path) -> Optional[Tuple[int, int]]:
+    """ Returns when the manifest of a shard was last replaced, and its size, or None if it has none. """
+    try:
+        stat = os.stat(Path(folder) / MANIFEST_FILE)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+class ShardDocuments:
+    """ The document tables of every shard, read as one. Doc ids are unique across shards, so each is in one table. """
+
+    def __init__(self, folders: List[Path]):
+        self.tables = [DocTable(folder) for folder in folders]
+
+    def table(self, id: int) -> Optional[DocTable]:
+        return next((table for table in self.tables if table.slot(id)), None)
+
+    def get(self, id: int) -> Optional[Document]:
+        return table.get(id) if (table := self.table(id)) else None
+
+    def extract(self, id: int) -> str:
+        return table.extract(id) if (table := self.table(id)) else ""
+
+    def close(self) -> None:
+        for table in self.tables:
+            table.close()
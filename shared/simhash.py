@@ -0,0 +1,69 @@
+from hashlib import blake2b
+from typing import Dict, Iterable, List, Optional, Tuple
+import re
+
+# Tables for bytes.translate that map each byte to its k-th bit, so a bit can be counted over many bytes at once.
+BIT_TABLES = [bytes((byte >> k) & 1 for byte in range(256)) for k in range(8)]
+
+def shingles(text: List[str], size=3) -> List[bytes]:
+    # Returns the overlapping sequences of size words in the text, or the whole text if it has fewer words.
+    words = re.findall(r'[a-z0-9]+', " ".join(text).lower())
+    if len(words) < size:
+        return [" ".join(words).encode()] if words else []
+    return [" ".join(words[i:i + size]).encode() for i in range(len(words) - size + 1)]
+
+def simhash(text: List[str], size=3) -> int:
+    # Returns the 64-bit SimHash of the text's shingles. Texts that share most of their shingles have fingerprints
+    # that differ in only a few bits.
+    digests = [blake2b(shingle, digest_size=8).digest() for shingle in shingles(text, size)]
+    if not digests:
+        return 0
+
+    # Rather than adding up the 64 bits of each hash one at a time, the hashes are joined and sliced into 8 columns,
+    # one per byte, and each bit of a column is counted over every hash at once.
+    data = b"".join(digests)
+    half = len(digests) / 2
+    fingerprint = 0
+    for j in range(8):
+        column = data[j::8]
+        for k in range(8):
+            if column.translate(BIT_TABLES[k]).count(1) > half:
+                fingerprint |= 1 << (8 * (7 - j) + k)
+    return fingerprint
+
+class SimHashIndex:
+    # Finds fingerprints within a Hamming distance of each other. Fingerprints are split into bands, and two
+    # fingerprints that differ in fewer bits than there are bands must have a band in common, so only the
+    # fingerprints sharing a band with a query are compared.
+
+    def __init__(self, max_distance=7, bands=8):
+        assert max_distance < bands, "The bands must outnumber the bits that may differ."
+        self.max_distance = max_distance
+        self.bands = bands
+        self.band_bits = 64 // bands
+        self.tables: List[Dict[int, List[Tuple[int, int]]]] = [{} for _ in range(bands)]
+        self.size = 0
+
+    def band_keys(self, fingerprint: int) -> Iterable[int]:
+        mask = (1 << self.band_bits) - 1
+        return ((fingerprint >> (band * self.band_bits)) & mask for band in range(self.bands))
+
+    def find(self, fingerprint: int) -> Optional[int]:
+        # Returns the id of a fingerprint within the maximum distance, or None.
+        for table, key in zip(self.tables, self.band_keys(fingerprint)):
+            for other, id in table.get(key, ()):
+                if (fingerprint ^ other).bit_count() <= self.max_distance:
+                    return id
+        return None
+
+    def add(self, fingerprint: int, id: int) -> Optional[int]:
+        # Adds the fingerprint unless it is a near-duplicate, in which case the id of the original is returned.
+        if (original := self.find(fingerprint)) is not None:
+            return original
+        for table, key in zip(self.tables, self.band_keys(fingerprint)):
+            table.setdefault(key, []).append((fingerprint, id))
+        self.size += 1
+        return None
+
+    def __len__(self) -> int:
+        return self.size
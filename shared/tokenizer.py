@@ -1,10 +1,15 @@
-from typing import List, Dict, Tuple
+from typing import List, Dict, Optional, Tuple
 from bs4 import BeautifulSoup
 from collections import Counter
-from nltk.util import ngrams
+from functools import lru_cache
+from itertools import chain
 from nltk.stem import PorterStemmer
 import re
 
+WORD = re.compile(r'\b[a-zA-Z0-9]+\b')               # A word is a run of ascii letters and digits between non-word characters.
+STEM_CACHE_SIZE = 65536                               # Stems kept in each process, the most recently used.
+STEMMER = PorterStemmer()
+
 def extract_text(soup: BeautifulSoup) -> List[str]:
     # Given content representing a webpage, return the textual content.
 
@@ -45,22 +50,55 @@ def tokenize(text: str) -> List[str]:
         tokens.append(token.lower())
     return tokens
 
-# This runs in O(n) with respect to the size of the file since it iterates through each line of the file once, 
-# and iterates through each character of each line only once.
-def tokenize_with_ngrams(text: List[str], stem=False) -> Dict[str, int]:
-    stemmer = PorterStemmer()
-    n_grams = []
+@lru_cache(maxsize=STEM_CACHE_SIZE)
+def stem(token: str) -> str:
+    # Returns the stem of a lowercase token. Stems are cached, since the same words are stemmed on every page.
+    return STEMMER.stem(token)
+
+def normalize(word: str) -> Optional[str]:
+    # Returns a word as a lowercase token, or None if it is a number larger than 4 digits.
+    return word.lower() if not word.isnumeric() or len(word) <= 4 else None
+
+def group_stems(tokens: Dict[str, object]) -> Dict[str, List[str]]:
+    # Returns the tokens with each stem that is not itself one of the tokens.
+    stems: Dict[str, List[str]] = {}
+    for token in tokens:
+        if (token_stem := stem(token)) not in tokens:
+            stems.setdefault(token_stem, []).append(token)
+    return stems
+
+def count_fields(text: List[str], headings: List[str], title: str) -> Tuple[Tuple[Dict[str, List[int]], Dict[str, int], Dict[str, int]], Tuple[int, int, int]]:
+    # Returns the positions of each token in a page's visible text, the number of times each token is in its headings
+    # and title, and the number of words in each of these fields. Stems that differ from every token of a field are
+    # added to it, with the positions or counts of every word with that stem.
+    # The fields are the ones shared.parser.ParsedPage takes from the page, which the crawler saves with it. Positions
+    # skip one between strings, so words from different strings are never next to each other in a phrase.
+    positions: Dict[str, List[int]] = {}
+    position = 0
     for string in text:
-        tokens: List[str] = [token.lower() for token in re.findall(r'\b[a-zA-Z0-9]+\b', string) if not token.isnumeric() or len(token) <= 4]
-        if stem:
-            tokens = [stemmer.stem(token) for token in tokens]
-        for token in tokens:
-            n_grams.append((token.lower(),))
-        n_grams.extend(n_gram for n_gram in ngrams(tokens, 2) if any(not token.isnumeric() for token in n_gram))
-        n_grams.extend(n_gram for n_gram in ngrams(tokens, 3) if any(not token.isnumeric() for token in n_gram))
-    # Convert all tokens to lower case and count their frequencies.
-    frequencies = Counter(" ".join(token) for token in n_grams)
-    return frequencies
+        for word in WORD.findall(string):
+            if token := normalize(word):
+                if (token_positions := positions.get(token)) is None:
+                    positions[token] = [position]
+                else:
+                    token_positions.append(position)
+                position += 1
+        position += 1
+
+    counts: Tuple[Dict[str, int], Dict[str, int]] = ({}, {})
+    for field_counts, strings in zip(counts, (headings, [title])):
+        for string in strings:
+            for word in WORD.findall(string):
+                if token := normalize(word):
+                    field_counts[token] = field_counts.get(token, 0) + 1
+
+    lengths = (sum(map(len, positions.values())), *(sum(field_counts.values()) for field_counts in counts))
+    for token, words in group_stems(positions).items():
+        positions[token] = positions[words[0]] if len(words) == 1 else sorted(chain.from_iterable(positions[word] for word in words))
+    for field_counts in counts:
+        for token, words in group_stems(field_counts).items():
+            field_counts[token] = sum(field_counts[word] for word in words)
+    return (positions, *counts), lengths
 
 # This runs in O(n) with respect to the number of tokens since it traverses each key token in the list only once.
 def computeWordFrequencies(tokens: List[str]) -> Dict[str, int]:
@@ -0,0 +1,181 @@
+""" Finds the k highest scoring documents for a query with Block-Max WAND, without scoring every posting.
+
+Documents are visited in order of doc id, through a cursor on each token's postings. A scorer turns the values of
+a token's postings into scores, and the highest values in the skip entries of each block, and so of each token,
+into the highest scores they can have. A document can only enter the top k if the highest scores of the tokens and
+blocks that could contain it add up to more than the kth best score so far, so the cursors jump past documents that
+can't, mostly without decoding the blocks in between.
+
+Scores are summed in the order the tokens were given and ties go to the lower doc id, so the results are exactly
+those of scoring every posting. Tombstoned documents are left out as they are scored, so they never take a place in
+the top k or raise the threshold, and k does not have to grow with the number of them.
+"""
+from array import array
+from bisect import bisect_left
+from operator import attrgetter
+from typing import AbstractSet, Dict, List, Sequence, Tuple
+from shared.postings import PostingsList, decode_positions
+import heapq
+import math
+
+END = 2 ** 32                               # Past every doc id, for cursors at the end of their postings.
+NEAR = 1e-9                                 # Bounds within this fraction of the threshold are added up again in the order of the tokens.
+
+class Cursor:
+    """ A position in one token's postings. Blocks are only decoded when a document in them is needed. """
+
+    def __init__(self, postings: PostingsList, scorer, order: int):
+        self.postings = postings
+        self.scorer = scorer                # Scores the postings, and bounds the scores of a block from its skip entry.
+        self.order = order                  # Position of the token in the query, which is the order its score is added in.
+        self.max_score = scorer.bound(postings.max_value())
+        self.block = -1                     # Block that would hold the target of the last move, found from the skip entries.
+        self.last = -1                      # Last doc id of that block.
+        self.block_max = 0.0                # Highest score in that block.
+        self.decoded = -1                   # Block whose doc ids and scores are decoded.
+        self.ids, self.scores = array("I"), array("f")
+        self.position = 0                   # Position of the current document in the decoded block.
+        self.block_positions = None         # Encoded positions of each posting of the decoded block, read when first needed.
+        self.doc = -1
+        self.advance(0)
+
+    def shallow(self, target: int) -> None:
+        """ Moves to the block that would hold target, reading only the skip entries. """
+        if target > self.last:
+            self.block = self.postings.find_block(target, self.block + 1)
+            if self.block < self.postings.num_blocks:
+                self.last, _, top = self.postings.skip(self.block)
+                self.block_max = self.scorer.bound(top)
+            else:
+                self.last, self.block_max = END, 0.0
+
+    def advance(self, target: int) -> None:
+        """ Moves to the first document at or after target, which is never before a target given to shallow. """
+        self.shallow(target)
+        if self.block == self.postings.num_blocks:
+            self.doc = END
+            return
+        if self.decoded != self.block:
+            self.ids, values = self.postings.block(self.block)
+            self.scores = self.scorer.scores(self.ids, values)
+            self.decoded, self.position, self.block_positions = self.block, 0, None
+        self.position = bisect_left(self.ids, target, self.position)
+        self.doc = self.ids[self.position]
+
+    def score(self) -> float:
+        return self.scores[self.position]
+
+    def positions(self) -> List[int]:
+        """ Returns the positions of the token in the current document, which are empty if the index has none. """
+        if self.block_positions is None:
+            self.block_positions = self.postings.block_positions(self.decoded) or []
+        return decode_positions(self.block_positions[self.position]) if self.block_positions else []
+
+def exceeds(bound: float, threshold: float, cursors: Sequence[Cursor], key) -> bool:
+    """ Returns whether the key of the cursors, adding up to bound, is above the threshold when added up in the order of
+    their tokens, as scores are. Adding in another order can round differently, so bounds close to the threshold are added again.
+    """
+    if bound > threshold * (1 + NEAR):
+        return True
+    if bound < threshold * (1 - NEAR):
+        return False
+    total = 0.0
+    for cursor in sorted(cursors, key=attrgetter("order")):
+        total += key(cursor)
+    return total > threshold
+
+def top_k(postings: Sequence[PostingsList], scorers: Sequence, k: int, deleted: AbstractSet[int] = frozenset()) -> List[Tuple[int, float]]:
+    """ Returns the doc ids and total scores of the k highest scoring documents, highest first, given a scorer for each token's postings.
+    Documents in deleted are left out.
+    """
+    # When every token's postings are one block, each block is decoded by the time its cursor starts, so nothing can be skipped.
+    if all(token_postings.num_blocks <= 1 for token_postings in postings):
+        return score_all(postings, scorers, k, deleted)
+
+    cursors = [Cursor(token_postings, scorer, order) for order, (token_postings, scorer) in enumerate(zip(postings, scorers))]
+    top: List[Tuple[float, int]] = []       # Heap of the best scores with their negated doc ids, so lower doc ids win ties.
+    while k > 0:
+        cursors = sorted((cursor for cursor in cursors if cursor.doc != END), key=attrgetter("doc"))
+        threshold = top[0][0] if len(top) == k else -math.inf
+
+        # The pivot is the first cursor at which the highest scores of the cursors up to it add up to more than the threshold.
+        # Documents before the pivot's can only be in the cursors before it, so none of them can enter the top k.
+        bound = 0.0
+        for pivot, cursor in enumerate(cursors):
+            bound += cursor.max_score
+            if exceeds(bound, threshold, cursors[:pivot + 1], attrgetter("max_score")):
+                break
+        else:
+            break
+        doc = cursors[pivot].doc
+        while pivot + 1 < len(cursors) and cursors[pivot + 1].doc == doc:
+            pivot += 1
+        candidates = cursors[:pivot + 1]
+
+        # Tighten the bound with the highest scores of the blocks that would hold the pivot's document.
+        block_bound = 0.0
+        for cursor in candidates:
+            cursor.shallow(doc)
+            block_bound += cursor.block_max
+
+        if exceeds(block_bound, threshold, candidates, attrgetter("block_max")):
+            if cursors[0].doc == doc:
+                # Every cursor up to the pivot is on the document, so the documents up to the end of the first of their decoded blocks
+                # are scored together, with the cursors after the pivot that have documents there. This only adds documents that would
+                # have been skipped, which were skipped for scoring no higher than the threshold, and lose ties to the lower doc ids in it.
+                window = list(candidates)
+                limit = min(cursor.last for cursor in candidates) + 1
+                for cursor in cursors[pivot + 1:]:
+                    if cursor.doc >= limit:
+                        break
+                    window.append(cursor)
+                    limit = min(limit, cursor.ids[-1] + 1)
+                scores: Dict[int, float] = {}
+                for cursor in sorted(window, key=attrgetter("order")):
+                    end = bisect_left(cursor.ids, limit, cursor.position)
+                    for doc_id, score in zip(cursor.ids[cursor.position:end], cursor.scores[cursor.position:end]):
+                        scores[doc_id] = scores.get(doc_id, 0) + score
+                    cursor.advance(limit)
+                for doc_id, score in scores.items():
+                    if doc_id in deleted:
+                        continue
+                    if len(top) < k:
+                        heapq.heappush(top, (score, -doc_id))
+                    elif score >= top[0][0] and (score, -doc_id) > top[0]:
+                        heapq.heapreplace(top, (score, -doc_id))
+            else:
+                for cursor in candidates:
+                    if cursor.doc < doc:
+                        cursor.advance(doc)
+        else:
+            # No document before the end of the first of those blocks can enter the top k, unless a cursor after the pivot has it.
+            target = min(cursor.last for cursor in candidates) + 1
+            if pivot + 1 < len(cursors):
+                target = min(target, cursors[pivot + 1].doc)
+            max(candidates, key=attrgetter("max_score")).advance(target)
+
+    return [(-negated_id, score) for score, negated_id in sorted(top, reverse=True)]
+
+def score_all(postings: Sequence[PostingsList], scorers: Sequence, k: int, deleted: AbstractSet[int] = frozenset()) -> List[Tuple[int, float]]:
+    """ Returns the same as top_k by decoding and adding up every posting. """
+    scores: Dict[int, float] = {}
+    for token_postings, scorer in zip(postings, scorers):
+        for ids, values in token_postings:
+            for doc_id, score in zip(ids, scorer.scores(ids, values)):
+                scores[doc_id] = scores.get(doc_id, 0) + score
+    for doc_id in deleted & scores.keys():
+        del scores[doc_id]
+    return heapq.nlargest(k, scores.items(), key=lambda item: (item[1], -item[0]))
+
+def score_documents(postings: Sequence[PostingsList], scorers: Sequence, docs: Sequence[int], k: int) -> List[Tuple[int, float]]:
+    """ Returns the same as score_all, counting only the given documents, which are looked up in each token's postings. """
+    cursors = [Cursor(token_postings, scorer, order) for order, (token_postings, scorer) in enumerate(zip(postings, scorers))]
+    scores: Dict[int, float] = {}
+    for doc_id in sorted(docs):
+        score = 0
+        for cursor in cursors:
+            cursor.advance(doc_id)
+            if cursor.doc == doc_id:
+                score += cursor.score()
+        scores[doc_id] = score
+    return heapq.nlargest(k, scores.items(), key=lambda item: (item[1], -item[0]))
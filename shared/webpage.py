@@ -1,7 +1,9 @@
 from pathlib import Path
+from shared.pagestore import is_record_ref, read_record
+from shared.parser import ParsedPage
 from bs4 import BeautifulSoup
 import msgspec
-from typing import List
+from typing import List, Optional
 import re
 from openai import OpenAI
 from dotenv import load_dotenv
@@ -16,22 +18,28 @@ class WebPage(msgspec.Struct, gc=False):
 	content: str
 	encoding: str
 	title: str = ""
-	context: str = ""
+	text: List[str] = []					# Visible text saved by the crawler.
+	headings: Optional[List[str]] = None	# Text of each heading saved by the crawler, along with the title and text.
 	soup: BeautifulSoup = None
 
 	def __post_init__(self):
-		self.soup = BeautifulSoup(self.content, "lxml")
-		title = self.soup("title")
-		self.title = title[-1].text.strip() if title else self.url
+		# Pages saved without their fields are parsed the way the crawler parses them, so every page is indexed the same way.
+		if self.headings is None:
+			page = ParsedPage(self.content.encode(), self.url)
+			self.title, self.text, self.headings = page.title, page.text, page.headings
+
+	def get_soup(self) -> BeautifulSoup:
+		if self.soup is None:
+			self.soup = BeautifulSoup(self.content, "lxml")
+		return self.soup
 	
 	def get_text(self) -> List[str]:
-		[s.decompose() for s in self.soup(['style', 'script', 'code', '[document]', 'head'])]
-		return [re.sub(r'\s+',' ', string) for string in self.soup.stripped_strings if string]
+		return self.text
 	
 	def get_summary(self):
 		if not CLIENT:
 			return ""
-		body = self.soup.find("body")
+		body = self.get_soup().find("body")
 		if not body:
 			return ""
 		yield "AI Summary: "
@@ -52,23 +60,18 @@ class WebPage(msgspec.Struct, gc=False):
 			if chunk.choices[0].delta.content is not None:
 				yield chunk.choices[0].delta.content
 	
-	def get_context(self, tokens=None) -> str:
-		tokens = " ".join(tokens).split(" ")
-		if tokens and (body := self.soup.find("body")):
-			body_strings = [re.sub(r'\s+',' ', string).strip() for string in body.stripped_strings]
-			body_strings = " ".join(body_strings)
-			body_strings = " ".join(re.findall(r'\b[a-zA-Z0-9]+\b', body_strings))
-			for token in tokens:
-				pos = body_strings.lower().find(token)
-				if pos > -1:
-					self.context = body_strings[pos:pos+300]
-		return self.context
-	
 	@classmethod
 	def from_path(cls, path: Path):
+		""" Loads a webpage from a JSON file, or from a reference to a page in the page store. """
+		if is_record_ref(path):
+			return cls.from_bytes(read_record(str(path)))
 		with open(path, "r", encoding="utf-8") as f:
 			return decoder.decode(f.read())
 
+	@classmethod
+	def from_bytes(cls, data: bytes):
+		return decoder.decode(data)
+
 decoder = msgspec.json.Decoder(type=WebPage)
 
 if __name__ == "__main__":
@@ -3,18 +3,23 @@ from argparse import ArgumentParser
 from web_crawler.utils.config import Config
 from web_crawler.crawler import Crawler
 
-def main(config_file, restart, n):
+def main(config_file, restart, n, mode, parsers=None, recrawl=False):
     cparser = ConfigParser()
     cparser.read(config_file)
     config = Config(cparser)
-    crawler = Crawler(config, restart, n)
+    if parsers is not None:
+        config.parsers = parsers
+    crawler = Crawler(config, restart, n, mode, recrawl)
     crawler.start()
 
 
 if __name__ == "__main__":
     parser = ArgumentParser()
     parser.add_argument("--restart", action="store_true", default=False)
+    parser.add_argument("--recrawl", action="store_true", default=False, help="Also download saved pages that are due to be revisited, keeping only the ones that changed")
     parser.add_argument("--config_file", type=str, default="web_crawler/config.ini")
-    parser.add_argument("-n", type=int, default=1, help="The number of worker processes to spawn (default: 1)")
+    parser.add_argument("-n", type=int, default=1, help="The number of worker processes to spawn, or concurrent fetches in async mode (default: 1)")
+    parser.add_argument("--mode", choices=["thread", "async"], default="thread", help="Crawl with one thread per worker, or with one event loop (default: thread)")
+    parser.add_argument("-p", "--parsers", type=int, default=None, help="The number of processes that parse pages, overriding PARSERS in the config file")
     args = parser.parse_args()
-    main(args.config_file, args.restart, args.n)
+    main(args.config_file, args.restart, args.n, args.mode, args.parsers, args.recrawl)
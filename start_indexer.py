@@ -1,14 +1,18 @@
 from argparse import ArgumentParser
 from inverted_indexer.indexer import InvertedIndex
+from inverted_indexer.indexer.worker import MEMORY_BUDGET
 from pathlib import Path
 
-def main(restart, num_workers):
-    index = InvertedIndex(Path("pages"), restart=restart, num_workers=num_workers)
+def main(restart, num_workers, memory, num_shards, output):
+    index = InvertedIndex(Path("pages"), restart=restart, num_workers=num_workers, memory_budget=memory * 1024 * 1024, num_shards=num_shards, index_folder=output)
     index.start()
 
 if __name__ == "__main__":
     parser = ArgumentParser()
     parser.add_argument("--restart", action="store_true", default=False)
     parser.add_argument("-n", type=int, default=1, help="The number of worker processes to spawn (default: 1)")
+    parser.add_argument("-m", type=int, default=MEMORY_BUDGET // (1024 * 1024), help="Megabytes of postings each worker holds in memory before writing a partial index (default: 64)")
+    parser.add_argument("-s", "--shards", type=int, default=1, help="The number of shards to split the index into by domain, which can't change without --restart (default: 1)")
+    parser.add_argument("-o", "--output", type=Path, default=None, help="The folder to write the index to, with its partial indices beside it (default: inverted_indexer/indices)")
     args = parser.parse_args()
-    main(args.restart, args.n)
\ No newline at end of file
+    main(args.restart, args.n, args.m, args.shards, args.output)
\ No newline at end of file
@@ -1,157 +1,395 @@
-from collections import defaultdict
 import streamlit as st
-from typing import Dict, List, Tuple, Set
-from shared.posting import Posting
+from typing import Dict, List, Tuple
+from shared.cache import LRUCache
+from shared.postings import DecodedPostingsList, PostingsList
+from shared.proximity import ProximityScorer, phrase_documents
+from shared.ranking import Ranking
+from shared.topk import score_documents, top_k
+from shared.documents import DocTable, Document, snippet
+from shared.segments import Segment, SegmentSet
+from shared.shards import ShardDocuments, Statistics, manifest_version, shard_folders
+from collections import Counter
+from itertools import chain
+from multiprocessing import get_context
+from multiprocessing.connection import Connection
+from threading import Lock
+from pathlib import Path
+import requests
 import time
-import nltk
+import sys
 import re
-from shared.webpage import WebPage
-from nltk.stem import PorterStemmer
-import nltk 
+import os
+from shared.tokenizer import stem
+from shared.webpage import CLIENT, WebPage
+
+RESULTS = 5             # Number of webpages returned for a query.
+RERANK_DEPTH = 50       # Number of webpages ranked again with how close together the words of a query are.
+POSTINGS_CACHE_BYTES = 64 * 2**20     # Memory for the postings of the tokens searched for most often.
+RESULTS_CACHE_BYTES = 4 * 2**20       # Memory for the results of the queries searched for most often.
+ABSENT = ()                           # Cached for tokens that are not in a segment.
+SERVER_URL = os.getenv("SEARCH_SERVER", "http://127.0.0.1:8000")    # Address of the search server the interface sends queries to.
 
 class SearchEngine:
-    def __init__(self):
-        self.index_of_index: Dict[str, int] = self.read_index_files("index_of_index.txt")       # Read the the index of the index.
-        self.index_of_crawled: Dict[str, int] = self.read_index_files("index_of_crawled.txt")   # Read the index of the crawled.
-        self.crawled_file = open("inverted_indexer/indices/crawled.txt", "r", encoding="utf-8")
+    def __init__(self, refresh=True, postings_cache=POSTINGS_CACHE_BYTES, results_cache=RESULTS_CACHE_BYTES, index_folder: Path = None, processes=True):
+        # The index is a set of segments, each with its own term dictionary, postings and doc table, which are opened with mmap.
+        # Segments added or merged by the indexer are picked up when the next search starts, from the folder the index was opened in.
+        # Searches only read the index, so they can run at once in threads, if whoever runs them calls refresh between them instead.
+        self.auto_refresh = refresh
+        self.index_folder = Path(index_folder or "inverted_indexer/indices").absolute()
+
+        # A sharded index is searched by sending each query to a search engine for every shard, in a process of its own, or in this
+        # process as a stand-in if processes is False, and merging their results. Each of them picks up its own new segments,
+        # and caches the postings it reads with the memory given for the postings cache.
+        self.shards = [Shard(folder, processes, postings_cache) for folder in shard_folders(self.index_folder)]
+        self.versions = [manifest_version(shard.folder) for shard in self.shards]
+        self.segments = SegmentSet(self.index_folder) if not self.shards else None
+        self.documents: DocTable = None
+        self.open_documents()
+
+        # The decoded postings of each token in each segment, for tokens missed more than once, and the doc ids of the results of
+        # each query. Both are emptied when the index changes.
+        self.postings_cache = LRUCache(postings_cache, admit_on_second_miss=True)
+        self.results_cache = LRUCache(results_cache)
+        self.set_generation()
+
+        # Postings hold term frequencies, which are scored with the length of each document and the parameters in ranking.ini.
+        self.ranking = Ranking(Path("ranking.ini"))
 
         self.prev_tokens: List[str] = []    # The tokens used for the last search query
+        self.prev_ids: List[int] = []       # The doc ids of the results of the last search query
+
+    def refresh(self) -> bool:
+        """ Opens the segments and documents added since the index was last read. Returns whether there were any. """
+        if self.shards:
+            # Shards being rebuilt have no manifest until they are saved, and their search engines keep searching what they had open.
+            versions = [manifest_version(shard.folder) for shard in self.shards]
+            if None in versions or versions == self.versions:
+                return False
+            self.versions = versions
+            self.open_documents()
+            self.set_generation()
+            return True
+        if self.segments.refresh():
+            self.open_documents()
+            self.set_generation()
+            return True
+        return False
+
+    def changed(self) -> bool:
+        """ Returns whether the index may have changed since it was last read, without opening anything. """
+        if self.shards:
+            versions = [manifest_version(shard.folder) for shard in self.shards]
+            return None not in versions and versions != self.versions
+        return self.segments.changed()
 
-    def read_index_files(self, file_name: str) -> Dict[str, int]:
-        """ Open the given file name and read the index into a dict. """
-        index_dict = {}
-        with open(f"inverted_indexer/indices/{file_name}", "r") as file:
-            for line in file:
-                key, position = line.split(",")
-                index_dict[key] = int(position)
-        return index_dict
-    
-    def search(self, query: str) -> List[Tuple[str]]:
-        """ Return the search results for the given query.
+    def set_generation(self) -> None:
+        # The manifest of a shard is replaced whenever its generation changes, so the time each was replaced stands for their generations.
+        self.generation = tuple(self.versions) if self.shards else (self.segments.created, self.segments.generation)
+        self.postings_cache.set_generation(self.generation)
+        self.results_cache.set_generation(self.generation)
+
+    def cache_stats(self) -> Dict[str, Dict]:
+        """ Returns the hit rate and memory use of the postings and results caches. """
+        return {"generation": self.generation, "postings": self.postings_cache.stats(), "results": self.results_cache.stats()}
+
+    def close(self) -> None:
+        """ Closes the index, and stops the processes searching its shards. """
+        for shard in self.shards:
+            shard.close()
+        if self.segments:
+            self.segments.close()
+        self.documents.close()
+
+    def open_documents(self) -> None:
+        """ Opens the document table, again if it was open, to read the documents added since. """
+        if self.documents:
+            self.documents.close()
+        # The document table is memory-mapped, so only the documents in results are read. Each shard has its own.
+        self.documents = ShardDocuments([shard.folder for shard in self.shards]) if self.shards else DocTable(self.index_folder)
+
+    def search(self, query: str) -> List[Document]:
+        """ Return the search results for the given query. Words in quotes are searched for as a phrase.
             Returns a list of tuples.
             Each tuple consists of (file_path, url, title) for each search result.
         """
 
-        self.prev_tokens = self.tokenize(query)
-        webpages = self.get_results(self.prev_tokens)
+        self.prev_tokens, self.prev_ids = self.find(query)
+        return [document for doc_id in self.prev_ids if (document := self.documents.get(doc_id)) is not None]
+
+    def find(self, query: str) -> Tuple[List[str], List[int]]:
+        """ Returns the tokens of the given query, and the doc ids of its results, without keeping them for the next call. """
+        if self.auto_refresh:
+            self.refresh()
+        tokens = self.tokenize(query)
+        words = self.words(query)
+        phrases = [phrase for text in re.findall(r'"([^"]+)"', query) if (phrase := self.words(text))]
 
-        # If no webpages were found, rerun the search but with the stemmed version of each token, and without n-grams.
-        if not webpages:
-            stemmer = PorterStemmer()
-            # Each token will be lowercase, stemmed, alphanumeric, and if it is a number, no larger than 4 digits.
-            self.prev_tokens = [stemmer.stem(token.lower()) for token in re.findall(r'\b[a-zA-Z0-9]+\b', query) if not token.isnumeric() or len(token) <= 4]
-            webpages = self.get_results(self.prev_tokens)
-        return webpages
+        # Queries with the same words and phrases have the same results, however they are capitalized or punctuated.
+        key = (tuple(words), tuple(map(tuple, phrases)))
+        if (doc_ids := self.results_cache.get(key)) is None:
+            doc_ids = self.get_results(words, phrases)
+
+            # If no webpages have every phrase, rerun the search without them. Webpages with the words close together still rank higher.
+            if not doc_ids and phrases:
+                doc_ids = self.get_results(words, [])
+            doc_ids = tuple(doc_ids)
+            self.results_cache.put(key, doc_ids, sys.getsizeof(key) + sum(map(sys.getsizeof, words)) + sys.getsizeof(doc_ids))
+        return tokens, list(doc_ids)
+
+    def snippets(self) -> List[str]:
+        """ Returns a snippet of the text of each result of the last search, with the words of the query in bold. """
+        return [self.snippet(doc_id, self.prev_tokens) for doc_id in self.prev_ids]
+
+    def snippet(self, doc_id: int, tokens: List[str]) -> str:
+        """ Returns a snippet of the text of a webpage around the given tokens. Snippets are taken from the extract of
+            each webpage in the document table, without reading the webpage.
+        """
+        return snippet(self.documents.extract(doc_id), tokens)
+
+    def words(self, text: str) -> List[str]:
+        """ Returns the words of the given text. """
+
+        # Each word will be lowercase, alphanumeric, and if it is a number, no larger than 4 digits.
+        return [token.lower() for token in re.findall(r'\b[a-zA-Z0-9]+\b', text) if not token.isnumeric() or len(token) <= 4]
+
+    def word_tokens(self, word: str) -> List[str]:
+        """ Returns the tokens a word is searched for as, which are the word and its stem. """
+        return list(dict.fromkeys((word, stem(word))))
 
     def tokenize(self, query: str) -> List[str]:
         """ Returns a list of tokens for the given query. """
+        return self.query_tokens(self.words(query))
 
-        # Each token will be lowercase, alphanumeric, and if it is a number, no larger than 4 digits.
-        tokens = [token.lower() for token in re.findall(r'\b[a-zA-Z0-9]+\b', query) if not token.isnumeric() or len(token) <= 4]
+    def query_tokens(self, words: List[str]) -> List[str]:
+        """ Returns the tokens the given words are searched for as. """
+        return list(dict.fromkeys(token for word in words for token in self.word_tokens(word)))
+        
+    def get_results(self, words: List[str], phrases: List[List[str]]) -> List[int]:
+        """ Return the doc ids of the search results for the given words, only including webpages with each of the given phrases. """
 
-        # Get stemmed version of each token.
-        stemmer = PorterStemmer()
-        stemmed_tokens = [stemmer.stem(token) for token in tokens]
+        # A sharded index is searched on every shard at once, scoring with the statistics of every shard added up.
+        if self.shards:
+            statistics = Statistics.combine(self.scatter("statistics", self.query_tokens(words)))
+            candidates = list(chain.from_iterable(self.scatter("rank", words, phrases, statistics)))
+        else:
+            candidates = self.rank(words, phrases)
 
-        # Generate n-grams where n is 1 less than the number of tokens in the query, with minimum 1 and maximum 3.
-        n = min(max(1, len(tokens) - 1), 3) 
-        tokens = list(nltk.ngrams(tokens, n))                                                   # The tokens are the n-grams.
-        tokens += [ngram for ngram in nltk.ngrams(stemmed_tokens, n) if ngram not in tokens]    # Add all stemmed n-grams.
-        tokens = [" ".join(ngram) for ngram in tokens]                                          # Convert n-grams to space-separated strings.
+        # The webpages with the highest BM25F scores of every shard are narrowed down to the highest of them all, then ordered by
+        # their final scores, so the results are those of searching one index.
+        candidates = sorted(candidates, key=lambda candidate: (-candidate[1], candidate[0]))[:RERANK_DEPTH]
+        return [doc_id for doc_id, _, _ in sorted(candidates, key=lambda candidate: (-candidate[2], candidate[0]))[:RESULTS]]
 
-        return tokens
-        
-    def get_results(self, tokens: List[str]) -> List[Tuple[str]]:
-        """ Return the search results for the given tokens.
-            Returns a list of tuples.
-            Each tuple consists of (file_path, url, title) for each search result.
+    def scatter(self, method: str, *args) -> List:
+        """ Calls a method of the search engine of every shard at once, returning what each of them returned.
+            Every shard the call was sent to is received from, even once one of them has failed, so none are left waiting.
+            The first error is raised after that.
         """
+        sent, results, error = [], [], None
+        try:
+            for shard in self.shards:
+                shard.send(method, *args)
+                sent.append(shard)
+        finally:
+            for shard in sent:
+                try:
+                    results.append(shard.receive())
+                except Exception as e:
+                    error = error or e
+        if error:
+            raise error
+        return results
+
+    def statistics(self, tokens: List[str]) -> Statistics:
+        """ Returns the statistics the given tokens are scored with in this index, for a search of every shard to add up. """
+        if self.auto_refresh:
+            self.refresh()
+        frequencies = Counter()
+        for segment in self.segments:
+            frequencies.update({token: len(token_postings) for token, token_postings in self.get_postings(segment, tokens).items()})
+        return Statistics(self.segments.num_documents, self.segments.total_documents, self.segments.averages, dict(frequencies))
 
-        postings = self.get_postings(tokens)    # Get a list of postings for each token.
-        results = self.aggregate(postings)      # Merge postings with common ids and their scores
-
-        # Get the top 5 webpages based on their aggregate tf_idf scores.
-        webpages = []
-        for posting in sorted(results, key=lambda x: x.tf_idf, reverse=True)[:5]:
-            # Seek to the file position where information for this document is stored and retrieve it.
-            self.crawled_file.seek(self.index_of_crawled[str(posting.id)])
-            path = self.crawled_file.readline().strip()
-            url = self.crawled_file.readline().strip()
-            title = self.crawled_file.readline().strip()
-            webpages.append((path, url, title))
-        return webpages
-
-    def get_postings(self, tokens: List[str]) -> List[List[Posting]]:
-        """ Returns a list of lists of postings for each given token. """
-
-        token_postings: List[List[Posting]] = []    # List to store postings for each token.
-
-        with open("inverted_indexer/indices/index.txt", "r") as index:
-            for token in tokens:
-                # If the token exists in the index, retrieve its postings and add it to a list.
-                if index_position := self.index_of_index.get(token):
-                    index.seek(index_position)
-                    token, postings_string = index.readline().split(":", 1)
-                    token_postings.append([Posting.from_string(p) for p in postings_string.split(";")])
-                
-        return token_postings
-
-    def aggregate(self, token_postings: List[List[Posting]]) -> List[Posting]:
-        """ Combines the list of list of postings, returning a single list of postings.
-        Each posting stores the doc id, and its total tf-idf summed from all the tokens it had a posting for.
+    def rank(self, words: List[str], phrases: List[List[str]], statistics: Statistics = None) -> List[Tuple[int, float, float]]:
+        """ Returns the doc id, BM25F score and final score of the webpages with the highest BM25F scores for the given words,
+        only including webpages with each of the given phrases. The final score adds how close together the words are.
+        The webpages are scored with the given statistics, when they are counted over more than this index.
         """
 
-        doc_to_postings: Dict[str, List[Posting]] = defaultdict(list)   # Stores doc ids as strings, mapped to a list of its associated postings.
-        # Add all postings to its appropriate list based on its id.
-        for postings in token_postings:
-            for posting in postings:
-                doc_to_postings[posting.id].append(posting)
-
-        # Sum up each documents postings scores into a single posting add it to a list.
-        results = []
-        for doc_id in doc_to_postings.keys():
-            tf_idf_score = sum(posting.tf_idf for posting in doc_to_postings[doc_id])
-            results.append(Posting(doc_id, tf_idf_score))
+        # Get the postings of each token of each word in each segment. A token is scored with the number of webpages
+        # with it in every segment, so a webpage scores the same whichever segment holds it.
+        tokens = self.query_tokens(words)
+        segment_postings = [(segment, self.get_postings(segment, tokens)) for segment in self.segments]
+        if statistics is not None:
+            frequencies = statistics.frequencies
+        else:
+            statistics, frequencies = self.segments, Counter()
+            for _, postings in segment_postings:
+                frequencies.update({token: len(token_postings) for token, token_postings in postings.items()})
+
+        # Indices converted from the text format have no positions, so their phrases are searched for as words.
+        positional = all(not token_postings.scale for _, postings in segment_postings for token_postings in postings.values())
+        close_words = positional and len(words) > 1
+
+        # Get the webpages with the highest total BM25F scores. If there is more than one word, more of them are ranked again
+        # with how close together the words are, which only needs the positions of these webpages.
+        depth = RERANK_DEPTH if close_words else RESULTS
+        scorers = [
+            dict(zip(postings, self.ranking.scorers(list(postings.values()), segment.lengths, statistics, [frequencies.get(token, 0) for token in postings])))
+            for segment, postings in segment_postings
+        ]
+        candidates = sorted(
+            ((doc_id, score, i) for i, (segment, postings) in enumerate(segment_postings)
+             for doc_id, score in self.segment_results(segment, postings, scorers[i], phrases if positional else [], depth)),
+            key=lambda candidate: (-candidate[1], candidate[0])
+        )[:depth]
+
+        final = {doc_id: score for doc_id, score, _ in candidates}
+        if close_words:
+            # The positions of each webpage are read from the segment holding it.
+            for i in sorted({i for _, _, i in candidates}):
+                postings = segment_postings[i][1]
+                proximity = ProximityScorer(self.ranking, [[(postings[token], scorers[i][token]) for token in self.word_tokens(word) if token in postings] for word in words])
+                final.update(proximity.rerank([(doc_id, score) for doc_id, score, held_by in candidates if held_by == i], depth))
+        return [(doc_id, score, final[doc_id]) for doc_id, score, _ in candidates]
+
+    def segment_results(self, segment: Segment, postings: Dict[str, PostingsList], scorers: Dict, phrases: List[List[str]], depth: int) -> List[Tuple[int, float]]:
+        """ Returns the highest scoring webpages of a segment, leaving out its tombstoned ones. """
+        if not postings:
+            return []
+        if phrases:
+            # Only webpages with each phrase are scored. Phrases are searched for as they are written, without stemming.
+            docs = set.intersection(*(set(phrase_documents([postings[word] for word in phrase])) if all(word in postings for word in phrase) else set() for phrase in phrases))
+            return score_documents(list(postings.values()), list(scorers.values()), docs - segment.deleted, depth)
+        # Documents that cannot make it are skipped, and tombstoned ones are left out as they are scored.
+        return top_k(list(postings.values()), list(scorers.values()), depth, segment.deleted)
+
+    def get_postings(self, segment: Segment, tokens: List[str]) -> Dict[str, PostingsList]:
+        """ Returns the postings of each given token that is in the segment. Postings are decoded as the search needs them,
+            or all at once for tokens searched for often enough to be cached.
+        """
+        results = {}
+        for token in tokens:
+            key = (segment.folder.name, token)
+            if (postings := self.postings_cache.get(key)) is None:
+                postings = segment.postings(token)
+                if self.postings_cache.admits(key):
+                    postings = DecodedPostingsList(postings) if postings is not None else ABSENT
+                    self.postings_cache.put(key, postings, postings.size if postings is not ABSENT else 0)
+            if postings is not None and postings is not ABSENT:
+                results[token] = postings
         return results
 
-def display_results(results: List[Tuple[str]], tokens: List[str]) -> None:
+def serve_shard(folder: Path, connection: Connection, postings_cache: int) -> None:
+    """ Searches a shard of the index in its own process, calling the methods of its search engine sent through the connection until it is sent None,
+        or the process that started it has stopped.
+    """
+    engine = SearchEngine(postings_cache=postings_cache, results_cache=0, index_folder=folder)
+    while True:
+        try:
+            request = connection.recv()
+        except EOFError:
+            break
+        if request is None:
+            break
+        method, args = request
+        try:
+            connection.send(getattr(engine, method)(*args))
+        except Exception as e:
+            connection.send(e)
+
+class Shard:
+    """ A shard of the index, searched by a search engine in a process of its own, or in this process as a stand-in for one.
+    Calls are sent to the process through a pipe, and a shard takes one call at a time, from sending it to receiving what it returns,
+    so each search sends its calls to every shard before waiting for any of them.
+    """
+
+    def __init__(self, folder: Path, process=True, postings_cache=POSTINGS_CACHE_BYTES):
+        self.folder = folder
+        self.lock = Lock()
+        self.engine: SearchEngine = None
+        self.process = None
+        self.result = None                  # What the last call returned, for a shard searched in this process.
+        if process:
+            context = get_context("spawn")
+            self.connection, child = context.Pipe()
+            self.process = context.Process(target=serve_shard, args=(folder, child, postings_cache), daemon=True)
+            self.process.start()
+            child.close()
+        else:
+            self.engine = SearchEngine(postings_cache=postings_cache, results_cache=0, index_folder=folder)
+
+    def send(self, method: str, *args) -> None:
+        """ Calls a method of the shard's search engine, once the last call has been received. What the call raises is
+            raised by receive, so a shard searched in this process fails the same way as one in a process of its own.
+        """
+        self.lock.acquire()
+        try:
+            if self.process:
+                self.connection.send((method, args))
+            else:
+                try:
+                    self.result = getattr(self.engine, method)(*args)
+                except Exception as e:
+                    self.result = e
+        except (BrokenPipeError, ConnectionResetError) as e:
+            self.lock.release()
+            raise RuntimeError(f"The process searching the shard in {self.folder} has stopped") from e
+        except BaseException:
+            self.lock.release()
+            raise
+
+    def receive(self):
+        """ Returns what the last call returned, raising what it raised. """
+        try:
+            result = self.connection.recv() if self.process else self.result
+        except (EOFError, ConnectionResetError) as e:
+            raise RuntimeError(f"The process searching the shard in {self.folder} has stopped") from e
+        finally:
+            self.result = None
+            self.lock.release()
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def close(self) -> None:
+        if self.process:
+            with self.lock:
+                try:
+                    self.connection.send(None)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+            self.process.join()
+            self.connection.close()
+        else:
+            self.engine.close()
+
+def display_results(results: List[Dict[str, str]]) -> None:
     """ Display the given results
-    results is a tuple containing (file_path, url, title) for each webpage result.
-    tokens is the tokens the search engine used to get the results.
+    results holds the path, url, title and snippet of each webpage result, as the search server returns them.
     """
 
-    summaries = []   # A list of streamlit containers to write contents of the page into.
-    contexts = []    # A list of streamlit containers to write summaries of the page into.
-    paths: List[str] = []                                   # A list of file paths for each search result.
-
-    # Display the page title and url for each result.
-    for i, webpage_tuple in enumerate(results):
-        path, url, title = webpage_tuple
-        paths.append(path)
-        st.subheader(title, anchor=False)
-        st.write(url)
-        contexts.append(st.empty())
+    summaries = []   # A list of streamlit containers to write summaries of the page into.
+
+    # Display the page title, url and snippet for each result.
+    for result in results:
+        st.subheader(result["title"], anchor=False)
+        st.write(result["url"])
+        st.write(result["snippet"])
         summaries.append(st.empty())
         st.markdown("---")
 
-    webpages = [WebPage.from_path(path) for path in paths]  # Create a WebPage for each path.
-
-    # Get relevant page content for each result and display it.
-    for i, webpage in enumerate(webpages):
-        with contexts[i].container():
-            st.write(webpage.get_context(tokens))
-
-    # Get an AI summary for each result and display it.
-    for i, webpage in enumerate(webpages):
+    # Get an AI summary for each result and display it. Only the summaries need the webpages themselves.
+    if not CLIENT:
+        return
+    for i, result in enumerate(results):
         with summaries[i].container():
             # If either API throws an exception, do not do the summary.
             try:
-                st.write_stream(webpage.get_summary())
+                st.write_stream(WebPage.from_path(result["path"]).get_summary())
             except:
                 pass
 
 def main():
-    search_engine = SearchEngine()
+    # Queries are sent to the search server, which keeps the index open between them, so the interface loads nothing itself.
     st.title("Search Engine")
     user_input = st.text_input("Enter a query: ")
 
@@ -159,11 +397,17 @@ def main():
 
         # Retrieve results and record how long it took.
         start = time.time()
-        results = search_engine.search(user_input)
+        try:
+            response = requests.get(f"{SERVER_URL}/search", params={"q": user_input}, timeout=10)
+            response.raise_for_status()
+        except requests.RequestException as e:
+            st.error(f"Could not search with the search server at {SERVER_URL}. Start it with: python start_search_server.py ({e})")
+            return
+        results = response.json()
         elapsed_time = round((time.time() - start), 6)
-        st.write(f"Search completed in {elapsed_time} seconds.")
+        st.write(f"Search completed in {elapsed_time} seconds ({results['time']:.6f} seconds on the server).")
 
-        display_results(results, search_engine.prev_tokens)
+        display_results(results["results"])
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,148 @@
+from aiohttp import web
+from argparse import ArgumentParser
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import get_context
+from start_search_engine import SearchEngine
+from typing import Optional
+import asyncio
+import msgspec
+import time
+import os
+
+REFRESH_INTERVAL = 1.0      # Seconds between checks for segments added or merged by the indexer.
+
+encoder = msgspec.json.Encoder()
+process_engine: SearchEngine = None     # The search engine of a process in the pool, opened when the process starts.
+
+def search(engine: SearchEngine, query: str, snippets: bool) -> bytes:
+    """ Searches for the query, returning the path, url, title and snippet of each result as JSON. """
+    start = time.perf_counter()
+    tokens, doc_ids = engine.find(query)
+    results = []
+    for doc_id in doc_ids:
+        # A document missing from the table, such as one written after the index was opened, is left out.
+        if (document := engine.documents.get(doc_id)) is None:
+            continue
+        path, url, title = document
+        result = {"id": doc_id, "path": path, "url": url, "title": title}
+        if snippets:
+            result["snippet"] = engine.snippet(doc_id, tokens)
+        results.append(result)
+    return encoder.encode({"query": query, "tokens": tokens, "results": results, "time": time.perf_counter() - start})
+
+def open_process_engine(index_folder: Optional[str]) -> None:
+    global process_engine
+    process_engine = SearchEngine(index_folder=index_folder)
+
+def search_in_process(query: str, snippets: bool) -> bytes:
+    return search(process_engine, query, snippets)
+
+def cache_stats_in_process() -> dict:
+    return {"process": os.getpid(), **process_engine.cache_stats()}
+
+class SearchServer:
+    """ Serves searches as JSON over HTTP, with the index opened once for every request.
+    Searches run in a pool of threads sharing one search engine, or in a pool of processes with a search engine each,
+    whose mmaps of the index share the same pages of memory. Threads keep the event loop free to take requests while
+    searches read the index, and processes also search at once on more than one core.
+    """
+
+    def __init__(self, num_threads=4, num_processes=0, index_folder: Optional[str] = None):
+        self.engine: SearchEngine = None
+        if num_processes:
+            # Each process runs one search at a time, so its search engine picks up new segments before each search.
+            self.pool: Executor = ProcessPoolExecutor(num_processes, mp_context=get_context("spawn"), initializer=open_process_engine, initargs=(index_folder,))
+        else:
+            # Searches in threads only read the index, so the server picks up new segments between them.
+            self.engine = SearchEngine(refresh=False, index_folder=index_folder)
+            self.pool = ThreadPoolExecutor(num_threads, thread_name_prefix="Search")
+        self.num_workers = num_processes or num_threads
+        self.searching = 0                                  # Searches running in the pool.
+        self.idle = asyncio.Event()                         # Set when the last running search finishes.
+        self.refreshing: Optional[asyncio.Future] = None    # Done once the search engine has refreshed, for searches waiting on it.
+        self.refresher: asyncio.Task = None
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get("/search", self.handle_search)
+        app.router.add_get("/stats", self.handle_stats)
+        app.on_startup.append(self.start)
+        app.on_cleanup.append(self.stop)
+        return app
+
+    async def start(self, app: web.Application) -> None:
+        loop = asyncio.get_running_loop()
+        if self.engine:
+            self.refresher = asyncio.create_task(self.refresh())
+        else:
+            # Start every process before taking requests, so the first searches don't wait for them to open the index.
+            await asyncio.gather(*(loop.run_in_executor(self.pool, search_in_process, "", False) for _ in range(self.num_workers)))
+        print(f"Searching with {self.num_workers} {'threads' if self.engine else 'processes'}.")
+
+    async def stop(self, app: web.Application) -> None:
+        if self.refresher:
+            self.refresher.cancel()
+        self.pool.shutdown()
+
+    async def handle_search(self, request: web.Request) -> web.Response:
+        """ Returns the results of the query in the q parameter. Snippets are left out if snippets=0. """
+        query = request.query.get("q", "")
+        if not query.strip():
+            return web.json_response({"error": "Missing query parameter q"}, status=400)
+        body = await self.search(query, request.query.get("snippets", "1") != "0")
+        return web.Response(body=body, content_type="application/json")
+
+    async def handle_stats(self, request: web.Request) -> web.Response:
+        """ Returns the hit rates and memory use of the search engine's caches. Each process has its own caches, so with
+        processes, these are the caches of the process that takes the request.
+        """
+        if self.engine:
+            stats = self.engine.cache_stats()
+        else:
+            stats = await asyncio.get_running_loop().run_in_executor(self.pool, cache_stats_in_process)
+        return web.Response(body=encoder.encode(stats), content_type="application/json")
+
+    async def search(self, query: str, snippets: bool) -> bytes:
+        loop = asyncio.get_running_loop()
+        if not self.engine:
+            return await loop.run_in_executor(self.pool, search_in_process, query, snippets)
+
+        # Refreshing closes the segments that were merged away, so new searches wait until it is done.
+        while self.refreshing:
+            await self.refreshing
+        self.searching += 1
+        try:
+            return await loop.run_in_executor(self.pool, search, self.engine, query, snippets)
+        finally:
+            self.searching -= 1
+            if not self.searching:
+                self.idle.set()
+
+    async def refresh(self) -> None:
+        """ Checks for segments added or merged by the indexer, and opens them once the searches running have finished. """
+        while True:
+            await asyncio.sleep(REFRESH_INTERVAL)
+            if not self.engine.changed():
+                continue
+            self.refreshing = asyncio.get_running_loop().create_future()
+            while self.searching:
+                self.idle.clear()
+                await self.idle.wait()
+            try:
+                self.engine.refresh()
+            finally:
+                self.refreshing.set_result(None)
+                self.refreshing = None
+
+def main(host, port, num_threads, num_processes, index_folder):
+    web.run_app(SearchServer(num_threads, num_processes, index_folder).app(), host=host, port=port, access_log=None)
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("-t", "--threads", type=int, default=4, help="The number of threads searching at once (default: 4)")
+    parser.add_argument("-p", "--processes", type=int, default=0, help="Search in this many processes instead of threads, each opening the index")
+    parser.add_argument("-i", "--index", type=str, default=None, help="The folder of the index to search (default: inverted_indexer/indices)")
+    args = parser.parse_args()
+    main(args.host, args.port, args.threads, args.processes, args.index)
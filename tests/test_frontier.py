@@ -0,0 +1,42 @@
+""" Checks which urls the crawler downloads again when it resumes. """
+from configparser import ConfigParser
+from shared.pagestore import PageStoreWriter
+from web_crawler.crawler.frontier import Frontier
+from web_crawler.crawler.worker import Worker
+from web_crawler.utils.config import Config
+import pytest
+
+# Nothing listens on port 1, so fetching this url fails at once.
+UNREACHABLE_URL = "https://127.0.0.1:1/page"
+
+@pytest.fixture
+def config(tmp_path, monkeypatch):
+    # The frontier keeps its pages folder in the working directory.
+    monkeypatch.chdir(tmp_path)
+    cparser = ConfigParser()
+    cparser["IDENTIFICATION"] = {"USERAGENT": "TEST_CRAWLER"}
+    cparser["CRAWLER"] = {"SEEDURL": UNREACHABLE_URL, "ROOTDOMAINS": "", "POLITENESS": "0", "SEENSET": "none"}
+    cparser["LOCAL PROPERTIES"] = {"SAVE": str(tmp_path / "frontier.db")}
+    return Config(cparser)
+
+def test_dispensed_url_is_downloaded_again(config):
+    frontier = Frontier(config, restart=True)
+    assert frontier.get_tbd_url() == UNREACHABLE_URL
+    frontier.close()
+
+    # The url was dispensed but never processed, so it is queued again.
+    frontier = Frontier(config, restart=False)
+    assert frontier.tbd_count == 1
+    frontier.close()
+
+def test_failed_download_is_not_downloaded_again(config):
+    frontier = Frontier(config, restart=True)
+    page_store = PageStoreWriter("pages")
+    worker = Worker(0, config, frontier, page_store)
+    worker.process_url(frontier.get_tbd_url())
+    page_store.close()
+    frontier.close()
+
+    frontier = Frontier(config, restart=False)
+    assert frontier.tbd_count == 0
+    frontier.close()
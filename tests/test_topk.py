@@ -0,0 +1,104 @@
+""" Checks that Block-Max WAND returns the same top k as scoring every posting. """
+from shared.dictionary import LengthTable, write_lengths
+from shared.postings import BLOCK_SIZE, PostingsList, encode_postings, pack_fields
+from shared.ranking import BM25FScorer, Ranking, StoredScorer
+from shared.topk import score_all, top_k
+import random
+import pytest
+
+def postings_list(ids, values) -> PostingsList:
+    return PostingsList.from_bytes(encode_postings(ids, values))
+
+def field_postings(ids, values) -> PostingsList:
+    """ Postings whose values are packed field frequencies, as the indexer writes them. """
+    return PostingsList.from_bytes(encode_postings(ids, values, quantize=False))
+
+def random_postings(rng: random.Random, num_docs: int, count: int, values) -> PostingsList:
+    ids = sorted(rng.sample(range(num_docs), count))
+    return postings_list(ids, [rng.choice(values) for _ in ids])
+
+def check(postings, k):
+    scorers = [StoredScorer() for _ in postings]
+    expected = score_all(postings, scorers, k)
+    assert top_k(postings, scorers, k) == expected
+    return expected
+
+@pytest.mark.parametrize("seed", range(50))
+@pytest.mark.parametrize("k", [1, 5, 10, 100])
+def test_multi_block(seed, k):
+    rng = random.Random(seed)
+    postings = [random_postings(rng, 5000, rng.randint(1, 6) * BLOCK_SIZE + 1 + rng.randrange(BLOCK_SIZE), [rng.random() * 10 for _ in range(20)]) for _ in range(rng.randint(1, 4))]
+    assert all(token_postings.num_blocks > 1 for token_postings in postings)
+    check(postings, k)
+
+@pytest.mark.parametrize("seed", range(20))
+def test_mixed_block_counts(seed):
+    rng = random.Random(seed)
+    postings = [random_postings(rng, 3000, 5 * BLOCK_SIZE, [1.0, 2.0, 3.0]), random_postings(rng, 3000, rng.randint(1, BLOCK_SIZE), [1.0, 2.0, 3.0])]
+    check(postings, 10)
+
+def test_ties_go_to_lower_doc_id():
+    # Every document has the same score, so the top k are the lowest doc ids.
+    ids = list(range(0, 3 * BLOCK_SIZE * 7, 7))
+    postings = [postings_list(ids, [2.0] * len(ids))]
+    assert [doc_id for doc_id, _ in check(postings, 10)] == ids[:10]
+
+@pytest.mark.parametrize("seed", range(20))
+def test_ties_between_tokens(seed):
+    rng = random.Random(seed)
+    # Few distinct values, so many documents tie on their totals.
+    postings = [random_postings(rng, 2000, 3 * BLOCK_SIZE, [1.0, 2.0]) for _ in range(3)]
+    results = check(postings, 50)
+    assert results == sorted(results, key=lambda result: (-result[1], result[0]))
+
+def test_k_larger_than_matches():
+    rng = random.Random(0)
+    postings = [random_postings(rng, 1000, 2 * BLOCK_SIZE + 3, [1.0, 4.0]), random_postings(rng, 1000, 3 * BLOCK_SIZE, [2.5])]
+    matches = len(set(id for token_postings in postings for ids, _ in token_postings for id in ids))
+    assert len(check(postings, matches + 100)) == matches
+
+def test_single_block():
+    postings = [postings_list([1, 4, 9, 16], [1.0, 3.0, 2.0, 3.0]), postings_list([4, 5, 16], [1.0, 1.0, 2.0])]
+    assert [doc_id for doc_id, _ in check(postings, 2)] == [16, 4]
+
+def test_no_postings():
+    assert check([postings_list([], [])], 5) == []
+
+@pytest.mark.parametrize("seed", range(20))
+def test_deleted_are_left_out(seed):
+    rng = random.Random(seed)
+    postings = [random_postings(rng, 3000, rng.randint(2, 5) * BLOCK_SIZE, [rng.random() * 10 for _ in range(20)]) for _ in range(2)]
+    scorers = [StoredScorer() for _ in postings]
+    # Tombstone most of the best documents, so the top k has to be found further down.
+    best = [doc_id for doc_id, _ in score_all(postings, scorers, 200)]
+    deleted = set(rng.sample(best, 150))
+    expected = [result for result in score_all(postings, scorers, 3000) if result[0] not in deleted][:10]
+    assert top_k(postings, scorers, 10, deleted) == expected
+    assert score_all(postings, scorers, 10, deleted) == expected
+
+@pytest.mark.parametrize("seed", range(20))
+def test_bm25f(tmp_path, seed):
+    # Postings of field frequencies, scored with BM25F from the length of each field as the search engine does.
+    rng = random.Random(seed)
+    num_docs = 4000
+    frequencies = [{} for _ in range(rng.randint(1, 4))]
+    for token_frequencies in frequencies:
+        for doc_id in rng.sample(range(num_docs), rng.randint(1, 6) * BLOCK_SIZE + 1 + rng.randrange(BLOCK_SIZE)):
+            token_frequencies[doc_id] = (rng.choice([1, 1, 2, 3, 8, 40]), rng.choice([0, 0, 1, 2]), rng.choice([0, 0, 0, 1]))
+    # Each field is at least as long as the frequencies of every token in it, and some documents are as short as they can be.
+    lengths = {}
+    for doc_id in range(num_docs):
+        most = [max((token_frequencies[doc_id][field] for token_frequencies in frequencies if doc_id in token_frequencies), default=0) for field in range(3)]
+        lengths[doc_id] = tuple(most[field] if rng.random() < 0.2 else most[field] + rng.randrange(500 if field == 0 else 10) for field in range(3))
+    write_lengths(tmp_path / "doc_lengths.bin", lengths)
+    table = LengthTable(tmp_path / "doc_lengths.bin")
+
+    postings = []
+    for token_frequencies in frequencies:
+        ids = sorted(token_frequencies)
+        postings.append(field_postings(ids, [pack_fields(token_frequencies[doc_id]) for doc_id in ids]))
+    scorers = Ranking(tmp_path / "ranking.ini").scorers(postings, table)
+    assert all(isinstance(scorer, BM25FScorer) for scorer in scorers)
+    for k in (1, 10, 50):
+        assert top_k(postings, scorers, k) == score_all(postings, scorers, k)
+    table.close()
@@ -1,24 +1,46 @@
-from typing import List
+from typing import Dict, List
 from web_crawler.crawler.frontier import Frontier
 from web_crawler.crawler.worker import Worker
+from web_crawler.crawler.async_worker import AsyncWorker
+from web_crawler.crawler.parse_pool import ParsePool
 from web_crawler.utils.config import Config
 from web_crawler.utils import get_logger
+from web_crawler.utils.download import aborted
+from shared.pagestore import PageStoreWriter
+from pathlib import Path
 import time
-import json
 
 class Crawler(object):
-    def __init__(self, config: Config, restart, num_workers=1):
+    def __init__(self, config: Config, restart, num_workers=1, mode="thread", recrawl=False):
         self.config = config
         self.logger = get_logger("CRAWLER")
-        self.frontier = Frontier(config, restart)
+        self.frontier = Frontier(config, restart, recrawl)
+        # Downloaded pages are appended to compressed segments in the pages folder.
+        self.page_store = PageStoreWriter(Path("pages"))
+        # With parser processes, the workers only download pages and the parse pool parses them.
+        self.parse_pool = ParsePool(config, self.frontier, self.page_store, config.parsers) if config.parsers > 0 else None
         self.workers: List[Worker] = list()
-        self.num_workers = max(1, min(100, num_workers))
+        self.mode = mode
+        # In async mode, the number of workers is the number of concurrent fetches on the event loop.
+        self.num_workers = max(1, min(10000 if mode == "async" else 100, num_workers))
+
+    @property
+    def pages_scraped(self) -> int:
+        return sum(worker.pages_scraped for worker in self.workers) + (self.parse_pool.pages_scraped if self.parse_pool else 0)
+
+    @property
+    def aborted_downloads(self) -> Dict[str, int]:
+        # The number of downloads aborted for each reason: content_type, content_length, sniff or max_bytes.
+        return aborted.get()
 
     def start_async(self):
-        self.workers = [
-            Worker(worker_id, self.config, self.frontier)
-            for worker_id in range(self.num_workers)
-        ]
+        if self.mode == "async":
+            self.workers = [AsyncWorker(0, self.config, self.frontier, self.page_store, self.num_workers, self.parse_pool)]
+        else:
+            self.workers = [
+                Worker(worker_id, self.config, self.frontier, self.page_store, self.parse_pool)
+                for worker_id in range(self.num_workers)
+            ]
         for worker in self.workers:
             worker.start()
 
@@ -27,20 +49,19 @@ class Crawler(object):
             self.start_async()
             # Crawler will stop when the queue of urls has been empty for 5 seconds.
             time.sleep(5)
-            while not self.frontier.to_be_downloaded.empty():
+            while not self.frontier.empty():
                 time.sleep(5)
             self.join()
         except KeyboardInterrupt:
             self.logger.info("Keyboard Interrupt caught, stopping crawler...")
-            self.frontier.is_running = False
+            self.frontier.stop()
             self.join()
 
     def join(self):
         for worker in self.workers:
             worker.join()
-        with open(self.config.save_file, "w") as f:
-            data = {
-                "urls": dict(sorted(self.frontier.discovered_urls.items(), key=lambda item: item[1]["length"], reverse=True)),
-                "tokens": dict(sorted(self.frontier.frequencies.items(), key=lambda item: item[1], reverse=True))
-            }
-            json.dump(data, f, indent=4)
\ No newline at end of file
+        if self.parse_pool:
+            self.parse_pool.close()
+        self.page_store.close()
+        self.frontier.close()
+        self.logger.info(f"Aborted downloads: {self.aborted_downloads}")
\ No newline at end of file
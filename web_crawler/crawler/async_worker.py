@@ -0,0 +1,77 @@
+from concurrent.futures import ThreadPoolExecutor
+from web_crawler.crawler.frontier import Frontier
+from web_crawler.crawler.worker import Worker
+from web_crawler.crawler.parse_pool import ParsePool
+from shared.pagestore import PageStoreWriter
+from web_crawler.utils.config import Config
+from web_crawler.utils.download import download_async
+import asyncio
+import aiohttp
+
+class AsyncWorker(Worker):
+    # A single thread running an event loop with many concurrent fetches.
+
+    def __init__(self, worker_id: int, config: Config, frontier: Frontier, page_store: PageStoreWriter, concurrency: int, parse_pool: ParsePool = None):
+        super().__init__(worker_id, config, frontier, page_store, parse_pool)
+        self.concurrency = concurrency
+
+        # Getting a url from the frontier can block, so a few threads dispense urls into the event loop.
+        self.num_dispatchers = min(32, concurrency)
+        self.dispatch_pool = ThreadPoolExecutor(self.num_dispatchers, thread_name_prefix=f"Dispatch-{worker_id}")
+        # Responses are processed by a single thread so the worker's statistics are only updated by one thread at a time.
+        self.response_pool = ThreadPoolExecutor(1, thread_name_prefix=f"Response-{worker_id}")
+
+    def get_tbd_url(self):
+        # Gets the next url from the frontier, along with the headers to download it conditionally.
+        if tbd_url := self.frontier.get_tbd_url():
+            return tbd_url, self.frontier.get_validators(tbd_url)
+        return None
+
+    async def dispatch(self, urls: asyncio.Queue):
+        # Moves urls from the frontier into the queue of urls to fetch.
+        loop = asyncio.get_running_loop()
+        while self.frontier.is_running:
+            if not (item := await loop.run_in_executor(self.dispatch_pool, self.get_tbd_url)):
+                break
+            await urls.put(item)
+
+    async def fetch(self, urls: asyncio.Queue, session: aiohttp.ClientSession):
+        # Downloads urls from the queue until a None value is received.
+        loop = asyncio.get_running_loop()
+        while item := await urls.get():
+            tbd_url, headers = item
+            try:
+                resp = await download_async(tbd_url, session, self.config.max_bytes, html_only=True, headers=headers)
+                self.logger.info(f"Downloaded {tbd_url}, status <{resp.status}>.")
+            except Exception as e:
+                self.logger.error(f"Error Downloading {tbd_url}: {type(e).__name__} {e}")
+                await loop.run_in_executor(self.response_pool, self.frontier.mark_url_complete, tbd_url)
+                continue
+            # Try to process the response. If something went wrong, the worker can recover and process the next one.
+            try:
+                await loop.run_in_executor(self.response_pool, self.process_response, tbd_url, resp)
+            except Exception as e:
+                self.logger.error(f"{type(e).__name__} caught while processing {tbd_url}: {e}.")
+            await asyncio.sleep(self.config.time_delay)
+
+    async def main_async(self):
+        urls = asyncio.Queue(self.concurrency)
+
+        # Politeness already limits each host to one request at a time, so idle connections are kept
+        # open long enough to be reused for the host's next url.
+        connector = aiohttp.TCPConnector(limit=self.concurrency, keepalive_timeout=max(15, 4 * self.config.time_delay))
+        timeout = aiohttp.ClientTimeout(total=5)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            fetchers = [asyncio.create_task(self.fetch(urls, session)) for _ in range(self.concurrency)]
+            await asyncio.gather(*(self.dispatch(urls) for _ in range(self.num_dispatchers)))
+
+            # The frontier is empty or the crawler was stopped, so signal the fetchers to stop.
+            self.logger.info("Frontier is empty. Stopping Crawler.")
+            for _ in fetchers:
+                await urls.put(None)
+            await asyncio.gather(*fetchers)
+
+    def main(self):
+        asyncio.run(self.main_async())
+        self.dispatch_pool.shutdown()
+        self.response_pool.shutdown()
@@ -1,38 +1,54 @@
-import json
-from threading import Lock
-from queue import Queue, Empty
+from threading import Condition, Lock
+from collections import Counter, deque
+from shared.pagestore import ChangeLog
+from web_crawler.crawler.store import FrontierStore
+from web_crawler.crawler.seen import FingerprintSet, ScalableBloomFilter
 from web_crawler.utils import get_logger, normalize
 from urllib.parse import urlparse, ParseResult
-from typing import Dict
-from datetime import datetime
+from typing import Deque, Dict, List, Optional, Set, Tuple, Union
 from urllib.robotparser import RobotFileParser
 from web_crawler.utils.download import download
 from web_crawler.utils.config import Config
 from pathlib import Path
+import heapq
 import shutil
+import struct
+import time
 import os
 
 class Frontier(object):
-    def __init__(self, config: Config, restart):
+    def __init__(self, config: Config, restart, recrawl=False):
         self.logger = get_logger("FRONTIER")
         self.config = config
         self.is_running = True
-        self.to_be_downloaded = Queue()
-        self.discovered_urls: Dict[str, Dict] = {}
+        self.recrawl = recrawl      # Whether saved pages that are due to be revisited are crawled again.
+        # State of every discovered url, and token frequencies, are kept on disk rather than in memory.
+        self.store = FrontierStore(config.save_file, restart, config.checkpoint_interval)
+        # Compact set of the urls discovered so far, so urls found before are skipped without querying the store.
+        self.seen: Union[FingerprintSet, ScalableBloomFilter, None] = None
+        self.seen_lock = Lock()
 
-        self.last_crawls: Dict[str, datetime] = {}
-        self.crawl_lock = Lock()
+        # Each domain has its own queue of urls. Domains with urls waiting are kept in a heap ordered by
+        # the time they may next be crawled, so the next url to dispense is always from the top domain.
+        self.domain_queues: Dict[str, Deque[str]] = {}
+        self.domain_heap: List[Tuple[float, str]] = []
+        self.scheduled_domains: Set[str] = set()    # Domains in the heap, or currently being dispensed from.
+        self.next_crawls: Dict[str, float] = {}     # The time.monotonic() at which each domain may next be crawled.
+        self.tbd_count = 0                          # The number of urls waiting to be downloaded.
+        self.crawl_lock = Condition()
         
         self.robot_cache: Dict[str, RobotFileParser] = {}
-        self.robots_lock = Lock()
-        
-        self.frequencies = {}
-        self.frequencies_lock = Lock()
+
+        # Pages added, changed and deleted are appended to the change list for the indexer.
+        self.changes = ChangeLog(Path("pages"))
+        self.change_counts = Counter()
+        self.change_lock = Lock()
                                 
         if restart:
             self.logger.info(f"Restarting from seed urls.")
             if os.path.exists("pages"):
                 shutil.rmtree("pages")
+            self.seen = self.load_seen_set(restart)
             for url in self.config.seed_urls:
                 self.add_url(url)
         else:
@@ -40,27 +56,55 @@ class Frontier(object):
         Path("pages").mkdir(exist_ok=True)
 
     def _parse_save_file(self):
-        try:
-            # Try to read save file.
-            with open(self.config.save_file, "r") as f:
-                data = json.load(f)
-                self.discovered_urls: Dict[str, Dict] = data["urls"]
-                self.frequencies: Dict[str, int] = data["tokens"]
-                
-            # Add urls that have not been downloaded yet to the queue.
-            [self.to_be_downloaded.put(url) for url, data in self.discovered_urls.items() if not data["downloaded"]]
-            
-            # Log statistics.
-            total_count = len(self.discovered_urls)
-            tbd_count = self.to_be_downloaded.qsize()
-            self.logger.info(f"Found {tbd_count} urls to be downloaded from {total_count} total urls discovered.")
-            
-        except:
-            # Start from seed if save file couldn't be read.
+        # Import a save file from before the crawler used a database, if there is one.
+        legacy_save_file = Path(self.config.save_file).with_suffix(".json")
+        if not len(self.store) and legacy_save_file.exists():
+            try:
+                self.store.import_json(legacy_save_file)
+                self.logger.info(f"Imported {legacy_save_file}.")
+            except:
+                self.logger.info(f"Couldn't import {legacy_save_file}.")
+        self.seen = self.load_seen_set(restart=False)
+
+        # Start from seed if there is no saved progress.
+        if not (total_count := len(self.store)):
             self.logger.info(f"Couldn't read save {self.config.save_file}, starting from seed.")
             for url in self.config.seed_urls:
                 self.add_url(url)
+            return
+
+        # Stream urls that have not been downloaded yet into the queue.
+        [self.enqueue_url(url) for url in self.store.tbd_urls()]
+        
+        # Log statistics.
+        self.logger.info(f"Found {self.tbd_count} urls to be downloaded from {total_count} total urls discovered.")
+
+        # When recrawling, saved pages that are due to be revisited are downloaded again if they changed.
+        if self.recrawl:
+            due_count = self.tbd_count
+            [self.enqueue_url(url) for url in self.store.due_urls(time.time())]
+            self.logger.info(f"Found {self.tbd_count - due_count} saved pages due to be revisited.")
             
+    def load_seen_set(self, restart):
+        # Returns the seen set saved with the crawl, rebuilding it from the store if it is missing or out of date.
+        # Returns None if urls are only deduplicated by the store.
+        if self.config.seen_set not in ("fingerprint", "bloom"):
+            return None
+        path = f"{self.config.save_file}.seen"
+        if not restart:
+            try:
+                seen = FingerprintSet.load(path) if self.config.seen_set == "fingerprint" else ScalableBloomFilter.load(path)
+                if len(seen) == len(self.store):
+                    return seen
+            except (OSError, ValueError, struct.error):
+                pass
+
+        seen = FingerprintSet() if self.config.seen_set == "fingerprint" else ScalableBloomFilter(self.config.false_positive_rate)
+        for url in self.store.urls():
+            seen.add(url)
+        self.logger.info(f"Built {self.config.seen_set} seen set of {len(seen)} urls.")
+        return seen
+
     def create_robot(self, url: ParseResult) -> RobotFileParser:
         # Finds a robots.txt from the given url returns a RobotFileParser.
         
@@ -71,8 +115,6 @@ class Frontier(object):
         
         # Try to download robots.txt and parse it.
         try:
-            # Update the last crawled time.
-            self.last_crawls[url.netloc] = datetime.now()
             response = download(robot_url)
             robot.parse(response.raw_response.content.decode().splitlines())
             self.logger.info(f"Downloaded {robot_url}.")
@@ -82,71 +124,178 @@ class Frontier(object):
             return robot
 
     def get_tbd_url(self):
-        # Loop through list of urls looking for a domain that wasn't crawled recently.
-        while True:
-            # Parse the url and get the domain.
-            try:
-                url = self.to_be_downloaded.get(timeout=15)
-            # Return None if the frontier is empty.
-            except Empty:
-                return None
-            
-            # Parse url and get domain.
-            parsed = urlparse(url)
-            domain = parsed.netloc
-            
-            # Set a flag and reserve an entry in the robot cache if the domain was not found in the cache.
-            with self.robots_lock:
-                if create_new_robot := (domain not in self.robot_cache):
-                    self.robot_cache[domain] = None
-            # Create a new robot without locking.
-            if create_new_robot:
-                self.robot_cache[domain] = self.create_robot(parsed)
-                
-            # If robot is None, it means the frontier is currently downloading it so fetch a different url.
-            robot = self.robot_cache.get(domain)
-            if robot is None:
-                self.to_be_downloaded.put(url)
-                continue
-            # Do not download the url if it is disallowed by the robot.
-            elif not robot.can_fetch(self.config.user_agent, url):
-                self.mark_url_complete(url)
-                continue       
+        # Waits until the domain at the top of the heap may be crawled and returns its next url.
+        # Returns None if there were no urls to download for 15 seconds, or if the frontier was stopped.
+        with self.crawl_lock:
+            idle_deadline = None
+            while self.is_running:
+                # Wait for a url to be added if no domains have urls waiting.
+                if not self.domain_heap:
+                    idle_deadline = idle_deadline or time.monotonic() + 15
+                    if (remaining := idle_deadline - time.monotonic()) <= 0:
+                        return None
+                    self.crawl_lock.wait(remaining)
+                    continue
+                idle_deadline = None
+
+                # Wait until the earliest domain may be crawled. Adding a url or stopping wakes the worker early.
+                next_crawl, domain = self.domain_heap[0]
+                if (remaining := next_crawl - time.monotonic()) > 0:
+                    self.crawl_lock.wait(remaining)
+                    continue
+                heapq.heappop(self.domain_heap)
 
+                # Download the robots.txt for new domains without locking. The domain is not in the heap,
+                # so no other worker dispenses from it in the meantime. Fetching robots.txt counts as a crawl.
+                if (robot := self.robot_cache.get(domain)) is None:
+                    parsed = urlparse(self.domain_queues[domain][0])
+                    self.crawl_lock.release()
+                    try:
+                        robot = self.create_robot(parsed)
+                    finally:
+                        self.crawl_lock.acquire()
+                    self.robot_cache[domain] = robot
+                    self.schedule_domain(domain, robot)
+                    continue
+
+                # Dispense the domain's first url that is allowed by the robot.
+                queue = self.domain_queues[domain]
+                while queue:
+                    url = queue.popleft()
+                    self.tbd_count -= 1
+                    # Do not download the url if it is disallowed by the robot.
+                    if not robot.can_fetch(self.config.user_agent, url):
+                        self.mark_url_complete(url)
+                        continue
+                    self.schedule_domain(domain, robot)
+                    # The url is marked complete by the worker once it has been processed, so a url that was
+                    # dispensed but not processed when the crawler was killed is downloaded again on resume.
+                    self.logger.info(f"Dispensed {url}.")
+                    return url
+                # Every url of the domain was disallowed, so it was not crawled.
+                self.schedule_domain(domain, robot, crawled=False)
+        return None
+
+    def schedule_domain(self, domain: str, robot: RobotFileParser, crawled=True):
+        # Puts the domain back in the heap if it has urls waiting. Must be called while holding crawl_lock.
+        if crawled:
             # Get crawl delay from associated robot.
             crawl_delay = robot.crawl_delay(self.config.user_agent)
             if crawl_delay is None: 
                 crawl_delay = 0
-            # Lock last_crawls dict so that the times remain consistent.
-            with self.crawl_lock:
-                # Check how much time has passed since the domain was last crawled.
-                time_elapsed = self.config.time_delay
-                last_time = self.last_crawls.get(domain, datetime(1,1,1))
-                time_elapsed = (datetime.now() - last_time).total_seconds()  
-
-                # If sufficient time has elapsed, update the last crawled time and return url.
-                if time_elapsed >= max(crawl_delay, self.config.time_delay):
-                    # Update the last crawled time and return url.
-                    self.last_crawls[domain] = datetime.now()
-                    self.logger.info(f"Dispensed {url}.")
-                    self.mark_url_complete(url)
-                    return url
-            # Else, add url back into the list of urls.
-            self.to_be_downloaded.put(url)
+            self.next_crawls[domain] = time.monotonic() + max(crawl_delay, self.config.time_delay)
+        if self.domain_queues.get(domain):
+            heapq.heappush(self.domain_heap, (self.next_crawls.get(domain, 0), domain))
+            self.crawl_lock.notify()
+        else:
+            self.domain_queues.pop(domain, None)
+            self.scheduled_domains.discard(domain)
+
+    def enqueue_url(self, url):
+        # Adds the url to its domain's queue, scheduling the domain if it wasn't already.
+        domain = urlparse(url).netloc
+        with self.crawl_lock:
+            self.domain_queues.setdefault(domain, deque()).append(url)
+            self.tbd_count += 1
+            if domain not in self.scheduled_domains:
+                self.scheduled_domains.add(domain)
+                heapq.heappush(self.domain_heap, (self.next_crawls.get(domain, 0), domain))
+                self.crawl_lock.notify()
+
+    def empty(self):
+        # Returns whether there are no urls waiting to be downloaded.
+        return self.tbd_count == 0
+
+    def stop(self):
+        # Stops dispensing urls and wakes any waiting workers.
+        with self.crawl_lock:
+            self.is_running = False
+            self.crawl_lock.notify_all()
 
     def add_url(self, url):
         # Skip url if it has been found already.
         url = normalize(url)
-        if url in self.discovered_urls: return
-        
-        self.discovered_urls[url] = {
-            "downloaded": False,
-            "length": 0
-        }
-        self.to_be_downloaded.put(url)
+        if self.seen is not None:
+            with self.seen_lock:
+                if not self.seen.add(url): return
+        if not self.store.add_url(url): return
+        self.enqueue_url(url)
     
-    def mark_url_complete(self, url):
-        self.discovered_urls[url] = {
-            "downloaded": True,
-            "length": 0
+    def mark_url_complete(self, url, length=None):
+        self.store.mark_downloaded(url, length)
+
+    def add_frequencies(self, frequencies: Dict[str, int]):
+        self.store.add_frequencies(frequencies)
+
+    def get_validators(self, url) -> Dict[str, str]:
+        # Returns the headers that make a request for a saved page conditional on it having changed.
+        headers = {}
+        if (page := self.store.get_page(url)) and page["ref"]:
+            if page["etag"]:
+                headers["If-None-Match"] = page["etag"]
+            if page["last_modified"]:
+                headers["If-Modified-Since"] = page["last_modified"]
+        return headers
+
+    def is_unchanged(self, url, content_hash: str) -> bool:
+        # Returns whether the downloaded content is the same as the saved page's.
+        page = self.store.get_page(url)
+        return bool(page and page["ref"] and page["hash"] == content_hash)
+
+    def record_page(self, url, ref: str, content_hash: str, validators: Dict[str, str]):
+        # Records the new version of a page that was saved, and adds it to the change list.
+        page = self.store.get_page(url)
+        previous = page["ref"] if page else None
+        self.store.put_page(url, {
+            **self.schedule_revisit(page, changed=True),
+            "ref": ref, "hash": content_hash, "etag": validators.get("ETag"), "last_modified": validators.get("Last-Modified")
+        })
+        self.add_change(url, ref, previous)
+
+    def record_unchanged(self, url, validators: Dict[str, str]):
+        # Records that a saved page has not changed since it was last downloaded.
+        if not (page := self.store.get_page(url)):
+            return
+        page.update(self.schedule_revisit(page, changed=False))
+        page["etag"] = validators.get("ETag", page["etag"])
+        page["last_modified"] = validators.get("Last-Modified", page["last_modified"])
+        self.store.put_page(url, page)
+        with self.change_lock:
+            self.change_counts["unchanged"] += 1
+
+    def record_deleted(self, url):
+        # Records that a saved page no longer exists, and adds it to the change list.
+        if not (page := self.store.get_page(url)) or not page["ref"]:
+            return
+        previous = page["ref"]
+        page.update(self.schedule_revisit(page, changed=True), ref=None, hash=None)
+        self.store.put_page(url, page)
+        self.add_change(url, None, previous)
+
+    def add_change(self, url, ref: Optional[str], previous: Optional[str]):
+        change = self.changes.append(url, ref, previous)
+        with self.change_lock:
+            self.change_counts[change.change] += 1
+
+    def schedule_revisit(self, page: Optional[Dict], changed: bool) -> Dict:
+        # Returns the page's visit statistics after a visit, with its next visit scheduled after the mean
+        # time between the changes observed so far. Pages that change often are revisited sooner, and
+        # pages that never change are revisited less and less often, within the configured bounds.
+        now = time.time()
+        if not page:
+            return {"first_fetched": now, "last_checked": now, "checks": 0, "changes": 0, "next_visit": now + self.config.revisit_min}
+        changes = page["changes"] + changed
+        interval = (now - page["first_fetched"]) / (changes + 1)
+        interval = min(max(interval, self.config.revisit_min), self.config.revisit_max)
+        return {
+            "first_fetched": page["first_fetched"], "last_checked": now,
+            "checks": page["checks"] + 1, "changes": changes, "next_visit": now + interval
         }
+
+    def close(self):
+        # Writes any progress not yet checkpointed, and saves the seen set with it.
+        if self.seen is not None:
+            self.seen.save(f"{self.config.save_file}.seen")
+        self.store.close()
+        self.changes.close()
+        self.logger.info(f"Pages added, changed, deleted and unchanged: {dict(self.change_counts)}.")
@@ -0,0 +1,141 @@
+from concurrent.futures import Future, ProcessPoolExecutor
+from multiprocessing import get_context
+from queue import Empty, Queue
+from threading import Lock, Semaphore, Thread
+from shared.pagestore import PageStoreWriter, encode_record
+from shared.parser import ParsedPage
+from shared.tokenizer import computeWordFrequencies, tokenize
+from web_crawler.crawler.frontier import Frontier
+from web_crawler.utils.config import Config
+from web_crawler.utils.response import Response
+from web_crawler.utils.scraper import is_valid
+from web_crawler.utils import get_logger
+from typing import Dict, List, Tuple
+import signal
+import time
+
+# The crawler's config, set in each parser process when it starts.
+parser_config: Config = None
+
+def init_parser(config: Config):
+    global parser_config
+    parser_config = config
+    # Ctrl+C is handled by the crawler, which lets the parsers finish their batches.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+def parse_batch(pages: List[Tuple[str, str, str, bytes, Tuple]]):
+    # Parses a batch of (tbd_url, url, final_url, content, state) pages in a parser process.
+    # Returns the compressed record, valid outlinks and number of tokens of each page along with its state, the
+    # token frequencies of the whole batch, and the error of each page that could not be parsed.
+    results: List[Tuple[str, bytes, List[str], int, Tuple]] = []
+    frequencies: Dict[str, int] = {}
+    errors: List[Tuple[str, str]] = []
+    for tbd_url, url, final_url, content, state in pages:
+        try:
+            page = ParsedPage(content, final_url)
+            fields = {"title": page.title, "text": page.text, "headings": page.headings} if parser_config.save_text else {}
+            record = encode_record(url, content.decode(), **fields)
+            links = [link for link in page.links if is_valid(link, parser_config)]
+            page_frequencies = computeWordFrequencies(tokenize(" ".join(page.text)))
+        except Exception as e:
+            errors.append((tbd_url, f"{type(e).__name__}: {e}"))
+            continue
+        for key, value in page_frequencies.items():
+            frequencies[key] = frequencies.get(key, 0) + value
+        results.append((tbd_url, record, links, sum(page_frequencies.values()), state))
+    return results, frequencies, errors
+
+class ParsePool:
+    # Parses, saves and scrapes pages in separate processes, so the fetch threads only download pages.
+    # Pages are sent to the parsers in batches, and their links and token counts come back in batches.
+
+    def __init__(self, config: Config, frontier: Frontier, page_store: PageStoreWriter, num_processes: int, batch_size=16):
+        self.logger = get_logger("PARSER", "Worker")
+        self.frontier = frontier
+        self.page_store = page_store
+        self.batch_size = batch_size
+
+        # Store dict for word frequencies since the last sync, and the number of pages scraped.
+        self.frequencies: Dict[str, int] = {}
+        self.pages_scraped = 0
+        self.synced_pages = 0
+        self.last_sync = time.monotonic()
+        self.checkpoint_interval = config.checkpoint_interval
+        self.lock = Lock()
+
+        # Both the pages waiting to be batched and the batches being parsed are bounded,
+        # so the fetch threads wait when the parsers fall behind instead of filling up memory.
+        self.pages: Queue = Queue(2 * num_processes * batch_size)
+        self.batches = Semaphore(2 * num_processes)
+        # Parsers are spawned rather than forked, since the crawler is already running threads.
+        self.executor = ProcessPoolExecutor(num_processes, mp_context=get_context("spawn"), initializer=init_parser, initargs=(config,))
+        self.batcher = Thread(target=self.run, daemon=True)
+        self.batcher.start()
+
+    def submit(self, tbd_url: str, resp: Response, content_hash: str):
+        # Queues a downloaded page to be parsed, waiting if the parsers are behind.
+        # Its hash and validators are passed through the parser, to be recorded once the page is saved.
+        self.pages.put((tbd_url, resp.url, resp.raw_response.url, resp.raw_response.content, (content_hash, resp.validators)))
+
+    def run(self):
+        # Sends pages to the parsers until a None value is received. A batch is sent once it is full,
+        # or once no page has arrived for a moment, so links from a slow trickle of pages are not held back.
+        stopping = False
+        while not stopping:
+            if not (page := self.pages.get()):
+                break
+            batch = [page]
+            while len(batch) < self.batch_size:
+                try:
+                    page = self.pages.get(timeout=0.05)
+                except Empty:
+                    break
+                if not page:
+                    stopping = True
+                    break
+                batch.append(page)
+            self.batches.acquire()
+            self.executor.submit(parse_batch, batch).add_done_callback(self.process_results)
+
+    def process_results(self, future: Future):
+        # Saves a parsed batch and adds its links and token counts to the frontier.
+        try:
+            results, frequencies, errors = future.result()
+            for tbd_url, error in errors:
+                self.logger.error(f"{error} caught while parsing {tbd_url}.")
+                self.frontier.mark_url_complete(tbd_url)
+            for tbd_url, record, links, length, (content_hash, validators) in results:
+                ref = self.page_store.write_record(record)
+                self.logger.info(f"Page saved to: {ref}")
+                self.frontier.record_page(tbd_url, ref, content_hash, validators)
+                for link in links:
+                    self.frontier.add_url(link)
+                self.frontier.mark_url_complete(tbd_url, length)
+
+            with self.lock:
+                for key, value in frequencies.items():
+                    self.frequencies[key] = self.frequencies.get(key, 0) + value
+                self.pages_scraped += len(results)
+            # Periodically contribute the frequencies so they are checkpointed with the rest of the crawl.
+            if self.pages_scraped - self.synced_pages >= 100 or time.monotonic() - self.last_sync >= self.checkpoint_interval:
+                self.sync()
+        except Exception as e:
+            self.logger.error(f"{type(e).__name__} caught while processing a parsed batch: {e}.")
+        finally:
+            self.batches.release()
+
+    def sync(self):
+        # Synchronizes the word frequencies collected by the parsers with the frontier.
+        with self.lock:
+            frequencies, self.frequencies = self.frequencies, {}
+            self.synced_pages = self.pages_scraped
+            self.last_sync = time.monotonic()
+        self.frontier.add_frequencies(frequencies)
+        self.logger.info(f"Contributed {len(frequencies)} tokens.")
+
+    def close(self):
+        # Parses every page still queued, then stops the parsers.
+        self.pages.put(None)
+        self.batcher.join()
+        self.executor.shutdown()
+        self.sync()
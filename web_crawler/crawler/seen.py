@@ -0,0 +1,139 @@
+from array import array
+from hashlib import blake2b
+from typing import List
+import struct
+import math
+
+def get_fingerprint(url: str) -> int:
+    # Returns a nonzero 64-bit fingerprint of the url.
+    return int.from_bytes(blake2b(url.encode("utf-8"), digest_size=8).digest(), "little") or 1
+
+class FingerprintSet(object):
+    # A set of 64-bit url fingerprints, stored in an open-addressing hash table backed by one array.
+    # Two urls are only confused if their fingerprints collide, which is unlikely below billions of urls.
+
+    MAX_LOAD = 0.7  # The table doubles in size when it becomes this full.
+
+    def __init__(self, capacity: int = 1 << 16):
+        self.slots = array("Q", bytes(8 * (1 << max(4, capacity - 1).bit_length())))   # Empty slots are 0.
+        self.count = 0
+
+    def __len__(self) -> int:
+        return self.count
+
+    def add(self, url: str) -> bool:
+        # Adds the url to the set. Returns False if it was already in the set.
+        return self.add_fingerprint(get_fingerprint(url))
+
+    def add_fingerprint(self, fingerprint: int) -> bool:
+        # Linear probing from the slot given by the low bits of the fingerprint.
+        slots = self.slots
+        mask = len(slots) - 1
+        i = fingerprint & mask
+        while slot := slots[i]:
+            if slot == fingerprint:
+                return False
+            i = (i + 1) & mask
+        slots[i] = fingerprint
+        self.count += 1
+        if self.count > len(slots) * self.MAX_LOAD:
+            self.resize(2 * len(slots))
+        return True
+
+    def resize(self, size: int):
+        old_slots = self.slots
+        self.slots = array("Q", bytes(8 * size))
+        self.count = 0
+        for fingerprint in old_slots:
+            if fingerprint:
+                self.add_fingerprint(fingerprint)
+
+    def save(self, path: str):
+        with open(path, "wb") as f:
+            f.write(struct.pack("<4sQQ", b"FPS1", self.count, len(self.slots)))
+            self.slots.tofile(f)
+
+    @classmethod
+    def load(cls, path: str) -> "FingerprintSet":
+        with open(path, "rb") as f:
+            magic, count, size = struct.unpack("<4sQQ", f.read(20))
+            if magic != b"FPS1":
+                raise ValueError(f"{path} is not a fingerprint set.")
+            seen = cls.__new__(cls)
+            seen.count = count
+            seen.slots = array("Q")
+            seen.slots.fromfile(f, size)
+        return seen
+
+class BloomFilter(object):
+    # A single Bloom filter sized for a number of urls and a false positive rate.
+
+    def __init__(self, capacity: int, false_positive_rate: float):
+        self.capacity = capacity
+        self.num_bits = max(8, math.ceil(-capacity * math.log(false_positive_rate) / math.log(2) ** 2))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def positions(self, h1: int, h2: int):
+        # Double hashing gives each of the k positions from two hashes.
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def __contains__(self, hashes) -> bool:
+        bits = self.bits
+        return all(bits[position >> 3] & (1 << (position & 7)) for position in self.positions(*hashes))
+
+    def add(self, hashes):
+        bits = self.bits
+        for position in self.positions(*hashes):
+            bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+class ScalableBloomFilter(object):
+    # A series of Bloom filters that grows as urls are added while keeping the overall false positive rate.
+    # Each new filter holds twice as many urls at half the false positive rate of the previous one,
+    # so the rates sum to at most the configured rate. A false positive means a new url is never crawled.
+
+    def __init__(self, false_positive_rate: float = 0.001, capacity: int = 1 << 20):
+        self.false_positive_rate = false_positive_rate
+        self.filters: List[BloomFilter] = [BloomFilter(capacity, false_positive_rate / 2)]
+
+    def __len__(self) -> int:
+        return sum(bloom.count for bloom in self.filters)
+
+    def add(self, url: str) -> bool:
+        # Adds the url to the filter. Returns False if it was probably added before.
+        digest = blake2b(url.encode("utf-8"), digest_size=16).digest()
+        hashes = (int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1)
+        if any(hashes in bloom for bloom in self.filters):
+            return False
+        bloom = self.filters[-1]
+        if bloom.count >= bloom.capacity:
+            rate = self.false_positive_rate / 2 ** (len(self.filters) + 1)
+            bloom = BloomFilter(2 * bloom.capacity, rate)
+            self.filters.append(bloom)
+        bloom.add(hashes)
+        return True
+
+    def save(self, path: str):
+        with open(path, "wb") as f:
+            f.write(struct.pack("<4sdQ", b"BLM1", self.false_positive_rate, len(self.filters)))
+            for bloom in self.filters:
+                f.write(struct.pack("<QQQQ", bloom.capacity, bloom.num_bits, bloom.num_hashes, bloom.count))
+                f.write(bloom.bits)
+
+    @classmethod
+    def load(cls, path: str) -> "ScalableBloomFilter":
+        with open(path, "rb") as f:
+            magic, false_positive_rate, num_filters = struct.unpack("<4sdQ", f.read(20))
+            if magic != b"BLM1":
+                raise ValueError(f"{path} is not a Bloom filter.")
+            seen = cls.__new__(cls)
+            seen.false_positive_rate = false_positive_rate
+            seen.filters = []
+            for _ in range(num_filters):
+                bloom = BloomFilter.__new__(BloomFilter)
+                bloom.capacity, bloom.num_bits, bloom.num_hashes, bloom.count = struct.unpack("<QQQQ", f.read(32))
+                bloom.bits = bytearray(f.read((bloom.num_bits + 7) // 8))
+                seen.filters.append(bloom)
+        return seen
@@ -0,0 +1,147 @@
+from threading import Event, Lock, Thread
+from typing import Dict, Iterator, Optional
+from pathlib import Path
+import sqlite3
+import json
+import time
+import os
+
+# State kept for every saved page, so it can be fetched conditionally and revisited as often as it changes.
+PAGE_COLUMNS = ("ref", "hash", "etag", "last_modified", "first_fetched", "last_checked", "checks", "changes", "next_visit")
+
+class FrontierStore(object):
+    # Persists the state of every discovered url, and the token frequencies, as they change.
+    # Writes are committed every checkpoint interval, so a hard kill loses at most that many seconds of progress.
+    # A background thread commits writes left pending once the interval passes, so progress is saved even when no
+    # later write arrives, such as while the crawler waits on slow downloads or the frontier is idle.
+
+    def __init__(self, path: str, restart: bool, checkpoint_interval: float = 5):
+        if restart:
+            for file in (path, f"{path}-wal", f"{path}-shm"):
+                if os.path.exists(file):
+                    os.remove(file)
+        self.path = path
+        self.checkpoint_interval = checkpoint_interval
+        self.last_checkpoint = time.monotonic()
+        self.pending = False        # Whether there are writes that have not been committed yet.
+        self.lock = Lock()
+
+        # The connection is shared by every worker thread, guarded by the lock.
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS urls (
+            url TEXT PRIMARY KEY,
+            downloaded INTEGER NOT NULL DEFAULT 0,
+            length INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID""")
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS tokens (
+            token TEXT PRIMARY KEY,
+            count INTEGER NOT NULL
+        ) WITHOUT ROWID""")
+        # A page without a ref was deleted from its site.
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS pages (
+            url TEXT PRIMARY KEY,
+            ref TEXT,
+            hash TEXT,
+            etag TEXT,
+            last_modified TEXT,
+            first_fetched REAL NOT NULL,
+            last_checked REAL NOT NULL,
+            checks INTEGER NOT NULL DEFAULT 0,
+            changes INTEGER NOT NULL DEFAULT 0,
+            next_visit REAL NOT NULL
+        ) WITHOUT ROWID""")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS pages_next_visit ON pages (next_visit)")
+        self.connection.commit()
+
+        self.closed = Event()
+        self.committer = Thread(target=self.commit_pending, daemon=True)
+        self.committer.start()
+
+    def add_url(self, url: str) -> bool:
+        # Records a newly discovered url. Returns False if it was discovered before.
+        with self.lock:
+            added = self.connection.execute("INSERT OR IGNORE INTO urls (url) VALUES (?)", (url,)).rowcount == 1
+            self.checkpoint()
+        return added
+
+    def mark_downloaded(self, url: str, length: int = None):
+        # Records that a url was downloaded. Without a length, the url keeps the length it was last scraped with.
+        with self.lock:
+            self.connection.execute(
+                "INSERT INTO urls (url, downloaded, length) VALUES (?, 1, COALESCE(?, 0)) "
+                "ON CONFLICT (url) DO UPDATE SET downloaded = 1, length = COALESCE(?, length)", (url, length, length))
+            self.checkpoint()
+
+    def add_frequencies(self, frequencies: Dict[str, int]):
+        with self.lock:
+            self.connection.executemany(
+                "INSERT INTO tokens (token, count) VALUES (?, ?) "
+                "ON CONFLICT (token) DO UPDATE SET count = count + excluded.count", frequencies.items())
+            self.checkpoint()
+
+    def get_page(self, url: str) -> Optional[Dict]:
+        # Returns the saved state of a page, or None if it was never saved.
+        with self.lock:
+            row = self.connection.execute(f"SELECT {', '.join(PAGE_COLUMNS)} FROM pages WHERE url = ?", (url,)).fetchone()
+        return dict(zip(PAGE_COLUMNS, row)) if row else None
+
+    def put_page(self, url: str, page: Dict):
+        with self.lock:
+            self.connection.execute(
+                f"INSERT OR REPLACE INTO pages (url, {', '.join(PAGE_COLUMNS)}) VALUES (?{', ?' * len(PAGE_COLUMNS)})",
+                (url, *(page[column] for column in PAGE_COLUMNS)))
+            self.checkpoint()
+
+    def due_urls(self, now: float) -> Iterator[str]:
+        # Streams the saved pages that are due to be revisited.
+        for (url,) in self.connection.execute("SELECT url FROM pages WHERE next_visit <= ? AND ref IS NOT NULL", (now,)).fetchall():
+            yield url
+
+    def urls(self) -> Iterator[str]:
+        # Streams every discovered url.
+        for (url,) in self.connection.execute("SELECT url FROM urls"):
+            yield url
+
+    def tbd_urls(self) -> Iterator[str]:
+        # Streams the urls that have not been downloaded yet.
+        for (url,) in self.connection.execute("SELECT url FROM urls WHERE downloaded = 0"):
+            yield url
+
+    def __len__(self) -> int:
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM urls").fetchone()[0]
+
+    def checkpoint(self, force=False):
+        # Commits pending writes if the checkpoint interval has passed. Must be called while holding the lock.
+        self.pending = True
+        if force or time.monotonic() - self.last_checkpoint >= self.checkpoint_interval:
+            self.connection.commit()
+            self.last_checkpoint = time.monotonic()
+            self.pending = False
+
+    def commit_pending(self):
+        # Commits any writes still pending every checkpoint interval, until the store is closed.
+        while not self.closed.wait(self.checkpoint_interval):
+            with self.lock:
+                if self.pending:
+                    self.checkpoint(force=True)
+
+    def close(self):
+        self.closed.set()
+        self.committer.join()
+        with self.lock:
+            self.checkpoint(force=True)
+            self.connection.close()
+
+    def import_json(self, path: Path):
+        # Imports a save file written by earlier versions of the crawler.
+        with open(path, "r") as f:
+            data = json.load(f)
+        with self.lock:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO urls (url, downloaded, length) VALUES (?, ?, ?)",
+                ((url, int(state["downloaded"]), state["length"]) for url, state in data["urls"].items()))
+            self.connection.executemany("INSERT OR REPLACE INTO tokens (token, count) VALUES (?, ?)", data["tokens"].items())
+            self.checkpoint(force=True)
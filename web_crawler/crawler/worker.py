@@ -1,54 +1,55 @@
 from threading import Thread
 from inspect import getsource
 from urllib.parse import urlparse
-from bs4 import BeautifulSoup
+from shared.pagestore import PageStoreWriter
+from shared.parser import ParsedPage
 from shared.tokenizer import *
 from web_crawler.crawler.frontier import Frontier
+from web_crawler.crawler.parse_pool import ParsePool
 from web_crawler.utils.config import Config
-from web_crawler.utils.download import download
-from web_crawler.utils import get_logger, get_urlhash
+from web_crawler.utils.download import SNIFF_SIZE, download
+from web_crawler.utils import get_content_hash, get_logger
 from web_crawler.utils.response import Response
 from web_crawler.utils.scraper import scraper
 from typing import Dict
-import json
+import requests
 import time
-import os
 
 class Worker(Thread):
-    def __init__(self, worker_id: int, config: Config, frontier: Frontier):
+    def __init__(self, worker_id: int, config: Config, frontier: Frontier, page_store: PageStoreWriter, parse_pool: ParsePool = None):
         self.logger = get_logger(f"Worker-{worker_id}", "Worker")
         self.config = config
         self.frontier = frontier
+        self.page_store = page_store
+        self.parse_pool = parse_pool
         self.id = worker_id
                 
-        # Store dict for word frequencies, and dict for number of words in each page.
+        # Store dict for word frequencies since the last sync, and the number of pages scraped.
         self.frequencies: Dict[str, int] = {}
-        self.page_lengths: Dict[str, int] = {}
+        self.pages_scraped = 0
+        self.last_sync = time.monotonic()
+
+        # Session shared by this worker's requests so connections to each host are kept alive.
+        self.session = requests.Session()
                 
         super().__init__(daemon=True)
         
-    def save_page(self, response: Response):
-        # Parse the URL to extract domain and path.
-        parsed_url = urlparse(response.url)
-        domain = parsed_url.netloc
-
-        # Create directory structure based on domain and path.
-        directory = os.path.join(str("pages"), domain)
-        os.makedirs(directory, exist_ok=True)
-
-        # Generate filename from the url's hash.
-        filename = os.path.join(directory, get_urlhash(response.url)+".json")
-
-        # Write page content to file.
+    def save_page(self, response: Response, page: ParsedPage = None) -> str:
+        # Append the page to the page store, which is shared by every worker.
         data = {
             "url": response.url,
             "content": response.raw_response.content.decode(),
             "encoding": "utf-8"
         }
-        with open(filename, 'w') as f:
-            json.dump(data, f)
+        # Store the title, visible text and headings so the indexer does not have to parse the page again.
+        if page and self.config.save_text:
+            data["title"] = page.title
+            data["text"] = page.text
+            data["headings"] = page.headings
+        ref = self.page_store.write(**data)
 
-        self.logger.info(f"Page saved to: {filename}")
+        self.logger.info(f"Page saved to: {ref}")
+        return ref
         
     def should_scrape(self, resp: Response):
         # Returns whether the worker should scrape this page.
@@ -65,37 +66,73 @@ class Worker(Thread):
         valid_size = len(resp.raw_response.content) >= 256
         if not valid_size:
             return False
-        # Must have html tag in first 256 bytes.
-        valid_content = b'<HTML' in resp.raw_response.content[:256] or b'<html' in resp.raw_response.content[:256]
+        # Must have an html tag in the bytes the download checks for one, in any case.
+        valid_content = b'<html' in resp.raw_response.content[:SNIFF_SIZE].lower()
         
         return valid_content
     
     def process_url(self, tbd_url: str) -> bool:
         # Processes one url from the frontier.
         
-        # Try to download the url, setting the response to None if an exception was caught.
+        # Try to download the url. A url that could not be downloaded is marked complete, so it is not downloaded again on resume.
         try:
-            resp = download(tbd_url)
+            resp = download(tbd_url, self.session, self.config.max_bytes, html_only=True, headers=self.frontier.get_validators(tbd_url))
             self.logger.info(f"Downloaded {tbd_url}, status <{resp.status}>.")
-            self.save_page(resp)
         except Exception as e:
-            resp = None
             self.logger.error(f"Error Downloading {tbd_url}: {e}")
+            self.frontier.mark_url_complete(tbd_url)
             return
-        if self.should_scrape(resp):
-            # Add the scraped urls to the frontier.
-            for scraped_url in scraper(resp, self.config):                
-                self.frontier.add_url(scraped_url)
-        
-            # Tokenize the page content and get their frequencies.
-            soup = BeautifulSoup(resp.raw_response.content, "html.parser")
-            [s.extract() for s in soup(['style', 'script', '[document]', 'head', 'title', 'td', 'tr', 'code'])]
-            frequencies = computeWordFrequencies(tokenize(soup.getText()))
+        self.process_response(tbd_url, resp)
+
+    def process_response(self, tbd_url: str, resp: Response):
+        # Saves and scrapes a downloaded page. The page is parsed once for its links, text and title.
+        # The url is marked complete once its response has been processed, so a url that was being processed when the
+        # crawler was killed is downloaded again on resume. Pages handed to the parse pool are marked complete there.
+        handed_off, length = False, None
+        try:
+            # Saved pages that were not modified, or were deleted, are recorded without saving or scraping them again.
+            if resp.status == 304:
+                self.frontier.record_unchanged(tbd_url, resp.validators)
+                return
+            if resp.status in (404, 410):
+                self.frontier.record_deleted(tbd_url)
+                return
+            # Fetches that failed or were aborted have no content worth saving.
+            if not (resp.raw_response and resp.raw_response.content):
+                return
+            content_hash = get_content_hash(resp.raw_response.content)
+            if self.frontier.is_unchanged(tbd_url, content_hash):
+                self.frontier.record_unchanged(tbd_url, resp.validators)
+                return
+
+            # With a parse pool, pages to scrape are handed off to be parsed, saved and scraped in other processes.
+            if self.parse_pool and self.should_scrape(resp):
+                self.parse_pool.submit(tbd_url, resp, content_hash)
+                handed_off = True
+                return
+            page = ParsedPage(resp.raw_response.content, resp.raw_response.url) if self.should_scrape(resp) else None
+            ref = self.save_page(resp, page)
+            self.frontier.record_page(tbd_url, ref, content_hash, resp.validators)
+            if page:
+                # Add the scraped urls to the frontier.
+                for scraped_url in scraper(resp, self.config, page):                
+                    self.frontier.add_url(scraped_url)
             
-            # Add them to this worker's frequencies dictionary, as well as store the length of this page.
-            for key, value in frequencies.items():
-                self.frequencies[key] = self.frequencies.setdefault(key, 0) + value
-            self.page_lengths[tbd_url] = sum(frequencies.values())
+                # Tokenize the page's visible text and get their frequencies.
+                frequencies = computeWordFrequencies(tokenize(" ".join(page.text)))
+                
+                # Add them to this worker's frequencies dictionary, as well as store the length of this page.
+                for key, value in frequencies.items():
+                    self.frequencies[key] = self.frequencies.setdefault(key, 0) + value
+                length = sum(frequencies.values())
+                self.pages_scraped += 1
+        finally:
+            if not handed_off:
+                self.frontier.mark_url_complete(tbd_url, length)
+
+        # Periodically contribute the frequencies so they are checkpointed with the rest of the crawl.
+        if page and (self.pages_scraped % 100 == 0 or time.monotonic() - self.last_sync >= self.config.checkpoint_interval):
+            self.sync()
             
     def main(self):
         while self.frontier.is_running:
@@ -111,20 +148,11 @@ class Worker(Thread):
             time.sleep(self.config.time_delay)
         
     def sync(self):
-        # Synchronizes the statistics collected by this worker thread with its frontier.
-        
-        # Acquire mutex for frontier's frequencies data structure.
-        with self.frontier.frequencies_lock:
-            # Add this worker's word frequencies to frontier.
-            for key, value in self.frequencies.items():
-                self.frontier.frequencies[key] = self.frontier.frequencies.setdefault(key, 0) + value
-            # Add this worker's links and associated token counts to frontier.
-            for key, value in self.page_lengths.items():
-                self.frontier.discovered_urls[key] = {
-                    "downloaded": True,
-                    "length": self.page_lengths[key]
-                }
-            self.logger.info(f"Contributed {len(self.frequencies)} tokens and {len(self.page_lengths)} links.")
+        # Synchronizes the word frequencies collected by this worker thread with its frontier.
+        self.frontier.add_frequencies(self.frequencies)
+        self.logger.info(f"Contributed {len(self.frequencies)} tokens.")
+        self.frequencies = {}
+        self.last_sync = time.monotonic()
         
     def run(self):            
         self.main()    
@@ -1,6 +1,6 @@
 import os
 import logging
-from hashlib import sha256
+from hashlib import blake2b, sha256
 from urllib.parse import urlparse, unquote
 from pathlib import Path
 
@@ -31,6 +31,9 @@ def get_urlhash(url):
         f"{parsed.netloc}/{parsed.path}/{parsed.params}/"
         f"{parsed.query}/{parsed.fragment}".encode("utf-8")).hexdigest()
 
+def get_content_hash(content: bytes) -> str:
+    return blake2b(content, digest_size=16).hexdigest()
+
 def normalize(url: str):
     url = unquote(url.lower()).replace("http://", "https://")
     if url.endswith("/"):
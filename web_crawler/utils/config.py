@@ -2,6 +2,14 @@ class Config(object):
     def __init__(self, config):
         self.user_agent = config["IDENTIFICATION"]["USERAGENT"].strip()
         self.save_file = config["LOCAL PROPERTIES"]["SAVE"]
+        self.checkpoint_interval = float(config["LOCAL PROPERTIES"].get("CHECKPOINT", 5))
+        self.save_text = config["LOCAL PROPERTIES"].getboolean("SAVETEXT", True)
         self.seed_urls = config["CRAWLER"]["SEEDURL"].split(",")
         self.root_domains = config["CRAWLER"]["ROOTDOMAINS"].split(",")
-        self.time_delay = float(config["CRAWLER"]["POLITENESS"])
\ No newline at end of file
+        self.time_delay = float(config["CRAWLER"]["POLITENESS"])
+        self.seen_set = config["CRAWLER"].get("SEENSET", "fingerprint").strip()
+        self.false_positive_rate = float(config["CRAWLER"].get("FALSEPOSITIVE", 0.001))
+        self.parsers = int(config["CRAWLER"].get("PARSERS", 0))
+        self.max_bytes = int(config["CRAWLER"].get("MAXBYTES", 10000000))
+        self.revisit_min = float(config["CRAWLER"].get("REVISITMIN", 86400))
+        self.revisit_max = float(config["CRAWLER"].get("REVISITMAX", 2592000))
\ No newline at end of file
@@ -1,18 +1,121 @@
 import requests
+import aiohttp
+from collections import Counter
+from threading import Lock
+from typing import Dict, Optional
 from web_crawler.utils.response import Response
 
-def download(url) -> Response:
-    resp = requests.get(url, timeout=5)
-    if resp and resp.content:
-        return Response({
-            "url": url,
-            "status": resp.status_code,
-            "error": resp.reason,
-            "response": {"content": resp.content, "url": resp.url}
-        })
+CHUNK_SIZE = 16384      # Bytes read from the body at a time.
+SNIFF_SIZE = 1024       # Bytes of the body checked for an html tag, the same as the indexer checks.
+VALIDATORS = ("ETag", "Last-Modified")   # Response headers kept so the page can be fetched conditionally later.
+
+class AbortCounts:
+    # Thread-safe counts of fetches aborted before their body was fully read, by reason.
+
+    def __init__(self):
+        self.counts = Counter()
+        self.lock = Lock()
+
+    def add(self, reason: str):
+        with self.lock:
+            self.counts[reason] += 1
+
+    def get(self) -> Dict[str, int]:
+        with self.lock:
+            return dict(self.counts)
+
+# Shared by every worker, so the crawler can report why fetches were aborted.
+aborted = AbortCounts()
+
+def check_headers(headers, max_bytes: Optional[int], html_only: bool) -> Optional[str]:
+    # Returns the reason to abort a response from its headers, or None to read its body.
+    content_type = headers.get("Content-Type", "").lower()
+    if html_only and content_type and "html" not in content_type:
+        return "content_type"
+    length = headers.get("Content-Length", "")
+    if max_bytes is not None and length.isdigit() and int(length) > max_bytes:
+        return "content_length"
+    return None
+
+class BodyReader:
+    # Collects a streamed body, deciding after each chunk whether to stop reading it.
+
+    def __init__(self, max_bytes: Optional[int], html_only: bool):
+        self.max_bytes = max_bytes
+        self.html_only = html_only
+        self.content = bytearray()
+        self.sniffed = not html_only
+
+    def feed(self, chunk: bytes) -> Optional[str]:
+        # Adds a chunk, returning the reason to abort or None to keep reading.
+        self.content += chunk
+        if self.max_bytes is not None and len(self.content) > self.max_bytes:
+            return "max_bytes"
+        if not self.sniffed and len(self.content) >= SNIFF_SIZE:
+            self.sniffed = True
+            if b"<html" not in self.content[:SNIFF_SIZE].lower():
+                return "sniff"
+        return None
+
+    def finish(self) -> Optional[str]:
+        # Bodies shorter than the sniff size are checked once they have been read.
+        if not self.sniffed and b"<html" not in self.content.lower():
+            return "sniff"
+        return None
+
+def download(url, session: requests.Session = None, max_bytes: int = None, html_only=False, headers: Dict[str, str] = None) -> Response:
+    # Reuse the session's keep-alive connections if one was given.
+    # The body is streamed, so responses that are too large or not html are dropped before they are fully read.
+    # Headers like If-None-Match make the request conditional, and a 304 response is returned without a body.
+    with (session or requests).get(url, timeout=5, stream=True, headers=headers) as resp:
+        if resp.status_code == 304:
+            return to_response(url, 304, resp.reason, b'', resp.url, get_validators(resp.headers))
+        if not resp:
+            return to_response(url, resp.status_code, "Response is None.", b'', url)
+        if reason := check_headers(resp.headers, max_bytes, html_only):
+            return abort(url, reason, resp.status_code)
+        body = BodyReader(max_bytes, html_only)
+        for chunk in resp.iter_content(CHUNK_SIZE):
+            if reason := body.feed(chunk):
+                return abort(url, reason, resp.status_code)
+        if reason := body.finish():
+            return abort(url, reason, resp.status_code)
+        if body.content:
+            return to_response(url, resp.status_code, resp.reason, bytes(body.content), resp.url, get_validators(resp.headers))
+    return to_response(url, 404, "Response is None.", b'', url)
+
+async def download_async(url, session: aiohttp.ClientSession, max_bytes: int = None, html_only=False, headers: Dict[str, str] = None) -> Response:
+    # Connections are pooled per host by the session's connector and kept alive between requests.
+    async with session.get(url, headers=headers) as resp:
+        if resp.status == 304:
+            return to_response(url, 304, resp.reason, b'', str(resp.url), get_validators(resp.headers))
+        if not resp.ok:
+            return to_response(url, resp.status, "Response is None.", b'', url)
+        if reason := check_headers(resp.headers, max_bytes, html_only):
+            return abort(url, reason, resp.status)
+        body = BodyReader(max_bytes, html_only)
+        async for chunk in resp.content.iter_chunked(CHUNK_SIZE):
+            if reason := body.feed(chunk):
+                return abort(url, reason, resp.status)
+        if reason := body.finish():
+            return abort(url, reason, resp.status)
+        if body.content:
+            return to_response(url, resp.status, resp.reason, bytes(body.content), str(resp.url), get_validators(resp.headers))
+    return to_response(url, 404, "Response is None.", b'', url)
+
+def get_validators(headers) -> Dict[str, str]:
+    return {name: headers[name] for name in VALIDATORS if name in headers}
+
+def abort(url, reason: str, status: int) -> Response:
+    # Counts an aborted fetch and returns an empty response, which is neither saved nor scraped.
+    aborted.add(reason)
+    return to_response(url, status, f"Aborted: {reason}.", b'', url)
+
+def to_response(url, status, error, content, final_url, validators: Dict[str, str] = None) -> Response:
     return Response({
         "url": url,
-        "status": 404,
-        "error": "Response is None.",
-        "response": {"content": b'', "url": url}
-    })
\ No newline at end of file
+        "status": status,
+        "error": error,
+        "validators": validators or {},
+        "response": {"content": content, "url": final_url}
+    })
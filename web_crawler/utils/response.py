@@ -10,6 +10,7 @@ class Response(object):
         self.url = resp_dict["url"]
         self.status = resp_dict["status"]
         self.error = resp_dict["error"] if "error" in resp_dict else None
+        self.validators = resp_dict.get("validators", {})    # The ETag and Last-Modified headers, if the server sent them.
         try:
             self.raw_response: RawResponse = (
                 pickle.loads(resp_dict["response"]) if "response" in resp_dict else None
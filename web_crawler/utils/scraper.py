@@ -1,17 +1,17 @@
-from urllib.parse import urlparse, urldefrag, urljoin, parse_qs, unquote
+from urllib.parse import urlparse, parse_qs
 from web_crawler.utils.response import Response
-from bs4 import BeautifulSoup
+from shared.parser import ParsedPage
 from typing import List
 from web_crawler.utils.config import Config
 
 import re
 
-def scraper(resp: Response, config: Config) -> List[str]:
+def scraper(resp: Response, config: Config, page: ParsedPage = None) -> List[str]:
     # Returns a list of links found inside the given url that are valid to crawl.
-    links = extract_next_links(resp)
+    links = extract_next_links(resp, page)
     return [link for link in links if is_valid(link, config)]
 
-def extract_next_links(resp: Response) -> List[str]:
+def extract_next_links(resp: Response, page: ParsedPage = None) -> List[str]:
     # Implementation required.
     # url: the URL that was used to get the page
     # resp.url: the actual url of the page
@@ -22,9 +22,9 @@ def extract_next_links(resp: Response) -> List[str]:
     #         resp.raw_response.content: the content of the page!
     # Return a list with the hyperlinks (as strings) scrapped from resp.raw_response.content
 
-    # Search for links in 'a' tags.
-    soup = BeautifulSoup(resp.raw_response.content, "html.parser")
-    return [urldefrag(urljoin(resp.raw_response.url, tag["href"]))[0] for tag in soup.find_all("a", href=True)]
+    # Search for links in 'a' tags, reusing the page if it was already parsed.
+    page = page or ParsedPage(resp.raw_response.content, resp.raw_response.url)
+    return page.links
 
 def is_valid_scheme(scheme: str) -> bool:
     # Returns whether the given scheme is valid to crawl.